@@ -7,8 +7,10 @@ import argparse
 from pathlib import Path
 
 # 从 src 模块导入功能
-from src.model import load_trained_model
+from src.kv_cache import KV_CACHE_CHOICES, KVCacheQuantizer
+from src.model import DTYPE_CHOICES, QUANTIZE_CHOICES, load_trained_model
 from src.evaluator import MedicalQAEvaluator
+from src.sample_store import save_eval_samples
 
 
 def main():
@@ -55,8 +57,77 @@ def main():
         default=256,
         help='最大生成长度（减少可加快速度）'
     )
+    parser.add_argument(
+        '--adaptive_batch',
+        action='store_true',
+        help='自适应批次大小：以 --batch_size 为初始值按提示长度探测可用的最大批次，OOM 时拆分重试'
+    )
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=64,
+        help='自适应批次的上限'
+    )
+    parser.add_argument(
+        '--simulate_memory_limit',
+        type=int,
+        default=None,
+        help='模拟显存上限（批次 × 总长度 的 token 数），超过即视为 OOM，用于在 CPU 上测试'
+    )
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='auto',
+        choices=DTYPE_CHOICES,
+        help='推理精度：auto 在 GPU 上用 float16，CPU 上支持原生 bf16 时用 bfloat16，否则用 float32'
+    )
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default=None,
+        choices=QUANTIZE_CHOICES,
+        help='CPU 量化推理：int8 对 Linear 层做动态量化（LoRA 会先合并，忽略 --dtype）'
+    )
+    parser.add_argument(
+        '--num_threads',
+        type=int,
+        default=None,
+        help='CPU 推理线程数（默认使用 PyTorch 默认值）'
+    )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        help='编译解码：静态 KV cache + torch.compile（首次遇到新的形状桶需要编译预热）'
+    )
+    parser.add_argument(
+        '--compile_cache_dir',
+        type=str,
+        default='./outputs/.compile_cache',
+        help='torch.compile 编译缓存目录，重复运行时复用编译结果'
+    )
+    parser.add_argument(
+        '--kv_cache',
+        type=str,
+        default=None,
+        choices=KV_CACHE_CHOICES,
+        help='量化 KV cache：int8 / int4，或 auto（用前几条测试样本校准，逐层选择 int4 / int8）'
+    )
+    parser.add_argument(
+        '--kv_cache_max_error',
+        type=float,
+        default=0.1,
+        help='auto 模式下允许使用 int4 的最大 K/V 相对误差'
+    )
+    parser.add_argument(
+        '--journal_file',
+        type=str,
+        default=None,
+        help='预测日志路径（JSONL），每批完成后追加写入；中断后重新运行会跳过已完成样本'
+    )
     
     args = parser.parse_args()
+    if args.kv_cache and args.compile:
+        parser.error('--kv_cache 不能与 --compile 同时使用（静态 KV cache 不支持量化）')
     
     print("=" * 50)
     print("模型评估")
@@ -67,7 +138,13 @@ def main():
     if args.base_model_path:
         print(f"   基础模型: {args.base_model_path}")
     
-    model, tokenizer = load_trained_model(args.model_path, args.base_model_path)
+    model, tokenizer = load_trained_model(
+        args.model_path,
+        args.base_model_path,
+        dtype=args.dtype,
+        num_threads=args.num_threads,
+        quantize=args.quantize
+    )
     
     # 2. 加载测试数据
     print(f"\n2. 加载测试数据: {args.test_file}")
@@ -84,12 +161,40 @@ def main():
     print("\n3. 创建评估器...")
     print(f"   批量大小: {args.batch_size}")
     print(f"   最大生成长度: {args.max_new_tokens}")
-    evaluator = MedicalQAEvaluator(model, tokenizer, batch_size=args.batch_size)
+    if args.adaptive_batch:
+        print(f"   自适应批次: 开启（上限 {args.max_batch_size}）")
+    kv_cache = None
+    if args.kv_cache:
+        calibration_prompts = [
+            f"{item['instruction']}\n问题：{item['input']}\n回答："
+            for item in test_data[:8]
+        ]
+        kv_cache = KVCacheQuantizer.calibrate(
+            model, tokenizer, calibration_prompts, args.kv_cache, args.kv_cache_max_error
+        )
+        print(f"   量化 KV cache: {kv_cache.describe()}")
+    evaluator = MedicalQAEvaluator(
+        model,
+        tokenizer,
+        batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+        memory_limit_tokens=args.simulate_memory_limit,
+        compile_generation=args.compile,
+        compile_cache_dir=args.compile_cache_dir,
+        kv_cache=kv_cache
+    )
     
     # 4. 开始评估
     print("\n4. 开始评估...")
     print("-" * 50)
-    results = evaluator.evaluate(test_data, max_new_tokens=args.max_new_tokens)
+    if args.journal_file:
+        print(f"   预测日志: {args.journal_file}")
+    results = evaluator.evaluate(
+        test_data,
+        max_new_tokens=args.max_new_tokens,
+        journal_path=args.journal_file
+    )
     
     # 5. 打印结果
     print("\n5. 评估结果:")
@@ -102,11 +207,15 @@ def main():
         # 创建输出目录
         Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
         
+        # 全部样本写入旁边的列式存储（预测、参考、逐样本 ROUGE、token 数、生成耗时）
+        store_path = save_eval_samples(args.output_file, test_data, results, tokenizer=tokenizer)
+        
         # 保存详细结果（包含示例）
         save_results = {
             'rouge_scores': results['rouge_scores'],
             'num_samples': results['num_samples'],
             'empty_count': results.get('empty_count', 0),
+            'sample_store': store_path.name,
             'samples': [
                 {
                     'input': test_data[i]['input'],
@@ -3,12 +3,159 @@
 """
 
 import json
+import time
 import argparse
 from pathlib import Path
 
 # 从 src 模块导入功能
-from src.model import load_trained_model
+from src.kv_cache import KV_CACHE_CHOICES, KVCacheQuantizer
+from src.model import DTYPE_CHOICES, QUANTIZE_CHOICES, load_draft_model, load_multi_adapter_model, load_trained_model
 from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+from src.metrics import parse_metric_names
+from src.sample_store import save_eval_samples
+from src.sequential import SEQUENTIAL_METRICS
+
+
+def save_eval_results(results, test_data, output_file, tokenizer=None):
+    """保存评估结果（指标 + 前 10 个示例），全部样本写入旁边的列式存储"""
+    
+    # 创建输出目录
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    
+    # 逐样本结果：预测、参考、逐样本指标、token 数、生成耗时（用于显著性检验和后续分析）
+    store_path = save_eval_samples(output_file, test_data, results, tokenizer=tokenizer)
+    
+    # 序贯评估只评估了部分样本，sample_indices 记录它们在 test_data 中的位置
+    sample_indices = results.get('sample_indices') or list(range(len(results['predictions'])))
+    
+    # 保存详细结果
+    save_results = {
+        'rouge_scores': results['rouge_scores'],
+        'bleu_score': results['bleu_score'],
+        'corpus_bleu': results.get('corpus_bleu'),
+        'bert_score': results['bert_score'],
+        'length_stats': results['length_stats'],
+        'metric_times': results.get('metric_times'),
+        'num_samples': results['num_samples'],
+        'empty_count': results.get('empty_count', 0),
+        'sequential': results.get('sequential'),
+        'sample_store': store_path.name,
+        'samples': [
+            {
+                'input': test_data[k]['input'],
+                'reference': results['references'][i],
+                'prediction': results['predictions'][i]
+            }
+            for i, k in enumerate(sample_indices[:10])
+        ]
+    }
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(save_results, f, ensure_ascii=False, indent=2)
+
+
+def parameter_bytes(model) -> int:
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def build_kv_cache(args, model, tokenizer, test_data):
+    """按 --kv_cache 构造量化 KV cache（auto 模式用前 8 条测试样本校准）"""
+    
+    if not args.kv_cache:
+        return None
+    
+    calibration_prompts = [
+        f"{item['instruction']}\n问题：{item['input']}\n回答："
+        for item in test_data[:8]
+    ]
+    kv_cache = KVCacheQuantizer.calibrate(
+        model, tokenizer, calibration_prompts, args.kv_cache, args.kv_cache_max_error
+    )
+    print(f"   量化 KV cache: {kv_cache.describe()}")
+    return kv_cache
+
+
+def sequential_options(args):
+    """--seq_* 参数 → evaluate_sequential 的关键字参数"""
+    return {
+        'metric': args.seq_metric,
+        'chunk_size': args.seq_chunk_size,
+        'min_samples': args.seq_min_samples,
+        'target_half_width': args.seq_target_half_width,
+        'num_resamples': args.seq_resamples,
+        'confidence': args.seq_confidence,
+        'seed': args.seq_seed
+    }
+
+
+def evaluate_multi_adapter(args, test_data):
+    """单基座多 adapter 评估：加载一次基础模型，批内混合不同 adapter"""
+    
+    adapter_paths = dict(item.split('=', 1) for item in args.adapters.split(','))
+    
+    print(f"\n3. 加载基础模型 + {len(adapter_paths)} 个 adapter")
+    start = time.perf_counter()
+    model, tokenizer = load_multi_adapter_model(
+        adapter_paths, args.base_model_path, dtype=args.dtype, num_threads=args.num_threads
+    )
+    load_time = time.perf_counter() - start
+    
+    total_bytes = parameter_bytes(model)
+    adapter_bytes = sum(
+        p.numel() * p.element_size() for n, p in model.named_parameters() if 'lora_' in n
+    )
+    base_bytes = total_bytes - adapter_bytes
+    print(f"   加载耗时: {load_time:.1f}s（顺序重载需加载基础模型 {len(adapter_paths)} 次）")
+    print(
+        f"   参数占用: 基础模型 {base_bytes / 1024 ** 3:.2f} GB + "
+        f"{len(adapter_paths)} 个 adapter {adapter_bytes / 1024 ** 2:.1f} MB"
+        f"（顺序重载时每次仍需 {base_bytes / 1024 ** 3:.2f} GB）"
+    )
+    
+    kv_cache = build_kv_cache(args, model, tokenizer, test_data)
+    evaluator = EnhancedMedicalQAEvaluator(
+        model,
+        tokenizer,
+        batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+        memory_limit_tokens=args.simulate_memory_limit,
+        compile_generation=args.compile,
+        compile_cache_dir=args.compile_cache_dir,
+        kv_cache=kv_cache,
+        metric_cache_dir=args.metric_cache_dir,
+        metric_workers=args.metric_workers,
+        bertscore_model=args.bertscore_model,
+        bertscore_batch_size=args.bertscore_batch_size,
+        bertscore_threads=args.bertscore_threads,
+        metrics=args.metrics
+    )
+    
+    print("\n4. 开始评估...")
+    print("-" * 60)
+    if args.sequential:
+        all_results = evaluator.evaluate_sequential(
+            test_data,
+            list(adapter_paths),
+            max_new_tokens=args.max_new_tokens,
+            **sequential_options(args)
+        )
+    else:
+        all_results = evaluator.evaluate_adapters(
+            test_data,
+            list(adapter_paths),
+            verbose=True,
+            max_new_tokens=args.max_new_tokens
+        )
+    
+    for name, results in all_results.items():
+        print(f"\n5. 评估结果: {name}")
+        evaluator.print_results(results)
+        
+        if args.adapter_output_dir:
+            output_file = Path(args.adapter_output_dir) / f"{name}.json"
+            save_eval_results(results, test_data, output_file, tokenizer=evaluator.tokenizer)
+            print(f"   ✓ 结果已保存到: {output_file}")
 
 
 def main():
@@ -16,7 +163,7 @@ def main():
     parser.add_argument(
         '--model_path',
         type=str,
-        required=True,
+        default=None,
         help='模型路径，如 outputs/lora_medical/checkpoint-best'
     )
     parser.add_argument(
@@ -61,6 +208,182 @@ def main():
         default=256,
         help='最大生成长度（减少可加快速度）'
     )
+    parser.add_argument(
+        '--adaptive_batch',
+        action='store_true',
+        help='自适应批次大小：以 --batch_size 为初始值按提示长度探测可用的最大批次，OOM 时拆分重试'
+    )
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=64,
+        help='自适应批次的上限'
+    )
+    parser.add_argument(
+        '--simulate_memory_limit',
+        type=int,
+        default=None,
+        help='模拟显存上限（批次 × 总长度 的 token 数），超过即视为 OOM，用于在 CPU 上测试'
+    )
+    parser.add_argument(
+        '--draft_model_path',
+        type=str,
+        default=None,
+        help='投机解码草稿模型路径（需与目标模型同词表，如 Qwen2.5-0.5B-Instruct）'
+    )
+    parser.add_argument(
+        '--draft_num_layers',
+        type=int,
+        default=None,
+        help='用目标模型的前 N 层作为草稿模型进行投机解码（与 --draft_model_path 二选一）'
+    )
+    parser.add_argument(
+        '--adapters',
+        type=str,
+        default=None,
+        help='单基座多 adapter 评估：逗号分隔的 名称=路径，如 lora_2k=outputs/lora_2k/checkpoint-best,'
+             'qlora_2k=outputs/qlora_2k/checkpoint-best（需提供 --base_model_path）'
+    )
+    parser.add_argument(
+        '--adapter_output_dir',
+        type=str,
+        default=None,
+        help='多 adapter 评估结果目录，每个 adapter 保存为 <名称>.json'
+    )
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='auto',
+        choices=DTYPE_CHOICES,
+        help='推理精度：auto 在 GPU 上用 float16，CPU 上支持原生 bf16 时用 bfloat16，否则用 float32'
+    )
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default=None,
+        choices=QUANTIZE_CHOICES,
+        help='CPU 量化推理：int8 对 Linear 层做动态量化（LoRA 会先合并，忽略 --dtype）'
+    )
+    parser.add_argument(
+        '--num_threads',
+        type=int,
+        default=None,
+        help='CPU 推理线程数（默认使用 PyTorch 默认值）'
+    )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        help='编译解码：静态 KV cache + torch.compile（首次遇到新的形状桶需要编译预热）'
+    )
+    parser.add_argument(
+        '--compile_cache_dir',
+        type=str,
+        default='./outputs/.compile_cache',
+        help='torch.compile 编译缓存目录，重复运行时复用编译结果'
+    )
+    parser.add_argument(
+        '--kv_cache',
+        type=str,
+        default=None,
+        choices=KV_CACHE_CHOICES,
+        help='量化 KV cache：int8 / int4，或 auto（用前几条测试样本校准，逐层选择 int4 / int8）'
+    )
+    parser.add_argument(
+        '--kv_cache_max_error',
+        type=float,
+        default=0.1,
+        help='auto 模式下允许使用 int4 的最大 K/V 相对误差'
+    )
+    parser.add_argument(
+        '--journal_file',
+        type=str,
+        default=None,
+        help='预测日志路径（JSONL），每批完成后追加写入；中断后重新运行会跳过已完成样本'
+    )
+    parser.add_argument(
+        '--metric_cache_dir',
+        type=str,
+        default='./outputs/.metric_cache',
+        help='指标缓存目录（参考答案分词结果和 BERTScore 向量，多次实验共用同一 test.json 时复用）'
+    )
+    parser.add_argument(
+        '--metric_workers',
+        type=int,
+        default=None,
+        help='指标计算进程数（默认 CPU 核数；样本较少时在主进程计算）'
+    )
+    parser.add_argument(
+        '--bertscore_model',
+        type=str,
+        default='bert-base-chinese',
+        help='BERTScore 打分模型（名称或本地路径，默认与 bert_score lang=zh 相同）'
+    )
+    parser.add_argument(
+        '--bertscore_batch_size',
+        type=int,
+        default=64,
+        help='BERTScore 编码批次大小（文本按长度排序后分批）'
+    )
+    parser.add_argument(
+        '--bertscore_threads',
+        type=int,
+        default=None,
+        help='BERTScore 在 CPU 上编码时的线程数（默认沿用 torch 设置）'
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        default='rouge,bleu,bertscore,length',
+        help='要计算的指标，逗号分隔（可选: rouge, bleu, bertscore, length）'
+    )
+    parser.add_argument(
+        '--sequential',
+        action='store_true',
+        help='序贯评估：随机顺序分块评估，置信区间足够窄或模型已能区分时提前停止'
+    )
+    parser.add_argument(
+        '--seq_metric',
+        type=str,
+        default='rouge-l',
+        choices=list(SEQUENTIAL_METRICS),
+        help='序贯评估的主指标（逐样本分数）'
+    )
+    parser.add_argument(
+        '--seq_chunk_size',
+        type=int,
+        default=500,
+        help='序贯评估每块样本数'
+    )
+    parser.add_argument(
+        '--seq_min_samples',
+        type=int,
+        default=1000,
+        help='序贯评估至少评估的样本数'
+    )
+    parser.add_argument(
+        '--seq_target_half_width',
+        type=float,
+        default=0.005,
+        help='置信区间半宽低于该值时停止'
+    )
+    parser.add_argument(
+        '--seq_resamples',
+        type=int,
+        default=10000,
+        help='bootstrap 重采样次数（差值区间经多次检查校正后置信水平很高，需要足够多的重采样）'
+    )
+    parser.add_argument(
+        '--seq_confidence',
+        type=float,
+        default=0.95,
+        help='置信水平'
+    )
+    parser.add_argument(
+        '--seq_seed',
+        type=int,
+        default=42,
+        help='样本顺序和 bootstrap 的随机种子'
+    )
     parser.add_argument(
         "--infer_results_file",
         type=str,
@@ -80,17 +403,58 @@ def main():
     )
     
     args = parser.parse_args()
+    try:
+        args.metrics = parse_metric_names(args.metrics)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.sequential and (args.journal_file or args.use_vllm or args.infer_results_file):
+        parser.error('--sequential 不能与 --journal_file / --use_vllm / --infer_results_file 同时使用')
+    if args.adapters and not args.base_model_path:
+        parser.error('--adapters 需要同时提供 --base_model_path')
+    if not args.adapters and not args.model_path:
+        parser.error('需要提供 --model_path 或 --adapters')
+    if args.compile and (args.draft_model_path or args.draft_num_layers):
+        parser.error('--compile 不能与投机解码同时使用（assisted generation 不支持静态 KV cache）')
+    if args.kv_cache and args.compile:
+        parser.error('--kv_cache 不能与 --compile 同时使用（静态 KV cache 不支持量化）')
     
     print("=" * 60)
     print("增强版模型评估 (ROUGE + BLEU + BERTScore)")
     print("=" * 60)
     
+    if args.adapters:
+        print(f"\n1. 单基座多 adapter 模式，基础模型: {args.base_model_path}")
+        print(f"\n2. 加载测试数据: {args.test_file}")
+        with open(args.test_file, 'r', encoding='utf-8') as f:
+            test_data = json.load(f)
+        if args.max_samples and len(test_data) > args.max_samples:
+            test_data = test_data[:args.max_samples]
+        print(f"   测试样本数: {len(test_data)}")
+        
+        evaluate_multi_adapter(args, test_data)
+        
+        print("\n" + "=" * 60)
+        print("✓ 评估完成！")
+        print("=" * 60)
+        return
+    
     # 1. 加载模型
     print(f"\n1. 加载模型: {args.model_path}")
     model, tokenizer = None, None
     if args.base_model_path and (not args.use_vllm) and (args.infer_results_file is None):
         print(f"   基础模型: {args.base_model_path}")
-        model, tokenizer = load_trained_model(args.model_path, args.base_model_path)
+        model, tokenizer = load_trained_model(
+            args.model_path,
+            args.base_model_path,
+            dtype=args.dtype,
+            num_threads=args.num_threads,
+            quantize=args.quantize
+        )
+    
+    draft_model = None
+    if model is not None and (args.draft_model_path or args.draft_num_layers):
+        draft_model = load_draft_model(model, args.draft_model_path, args.draft_num_layers)
+        print(f"   草稿模型: {args.draft_model_path or f'前 {args.draft_num_layers} 层'}（投机解码）")
     
     # 2. 加载测试数据
     print(f"\n2. 加载测试数据: {args.test_file}")
@@ -107,7 +471,27 @@ def main():
     print("\n3. 创建增强版评估器...")
     print(f"   批量大小: {args.batch_size}")
     print(f"   最大生成长度: {args.max_new_tokens} tokens")
-    evaluator = EnhancedMedicalQAEvaluator(model, tokenizer, batch_size=args.batch_size)
+    if args.adaptive_batch:
+        print(f"   自适应批次: 开启（上限 {args.max_batch_size}）")
+    kv_cache = build_kv_cache(args, model, tokenizer, test_data) if model is not None else None
+    evaluator = EnhancedMedicalQAEvaluator(
+        model,
+        tokenizer,
+        batch_size=args.batch_size,
+        adaptive_batch=args.adaptive_batch,
+        max_batch_size=args.max_batch_size,
+        memory_limit_tokens=args.simulate_memory_limit,
+        draft_model=draft_model,
+        compile_generation=args.compile,
+        compile_cache_dir=args.compile_cache_dir,
+        kv_cache=kv_cache,
+        metric_cache_dir=args.metric_cache_dir,
+        metric_workers=args.metric_workers,
+        bertscore_model=args.bertscore_model,
+        bertscore_batch_size=args.bertscore_batch_size,
+        bertscore_threads=args.bertscore_threads,
+        metrics=args.metrics
+    )
     
     # 4. 开始评估
     print("\n4. 开始评估...")
@@ -137,6 +521,7 @@ def main():
                 dataset_path=args.test_file,
                 output_path=args.vllm_output_file,
                 lora_path=lora_path,
+                journal_path=args.journal_file,
             )
             predictions = predictions[:len(test_data)]
             results = evaluator.evaluate_by_results(
@@ -146,8 +531,23 @@ def main():
         else:
             print("   使用 transformers 进行推理...")
             print(f"   预计时间: ~{len(test_data) * 3 / args.batch_size / 60:.1f} 分钟")
+            if args.journal_file:
+                print(f"   预测日志: {args.journal_file}")
             print("-" * 60)
-            results = evaluator.evaluate(test_data, verbose=True, use_batch=True, max_new_tokens=args.max_new_tokens)
+            if args.sequential:
+                results = evaluator.evaluate_sequential(
+                    test_data,
+                    max_new_tokens=args.max_new_tokens,
+                    **sequential_options(args)
+                )['model']
+            else:
+                results = evaluator.evaluate(
+                    test_data,
+                    verbose=True,
+                    use_batch=True,
+                    max_new_tokens=args.max_new_tokens,
+                    journal_path=args.journal_file
+                )
     
     # 5. 打印结果
     print("\n5. 评估结果:")
@@ -161,29 +561,7 @@ def main():
     if args.output_file:
         print(f"\n7. 保存结果到: {args.output_file}")
         
-        # 创建输出目录
-        Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
-        
-        # 保存详细结果
-        save_results = {
-            'rouge_scores': results['rouge_scores'],
-            'bleu_score': results['bleu_score'],
-            'bert_score': results['bert_score'],
-            'length_stats': results['length_stats'],
-            'num_samples': results['num_samples'],
-            'empty_count': results.get('empty_count', 0),
-            'samples': [
-                {
-                    'input': test_data[i]['input'],
-                    'reference': results['references'][i],
-                    'prediction': results['predictions'][i]
-                }
-                for i in range(min(10, len(test_data)))
-            ]
-        }
-        
-        with open(args.output_file, 'w', encoding='utf-8') as f:
-            json.dump(save_results, f, ensure_ascii=False, indent=2)
+        save_eval_results(results, test_data, args.output_file, tokenizer=evaluator.tokenizer)
         
         print(f"   ✓ 结果已保存")
     
@@ -0,0 +1,387 @@
+"""
+数据并行评估脚本 - 测试集分片到多个进程，每个进程持有一份模型副本
+"""
+
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+def shard_ranges(num_samples: int, num_workers: int) -> List[tuple]:
+    """把 [0, num_samples) 切成 num_workers 段连续区间（合并时保持原顺序）"""
+    bounds = [num_samples * k // num_workers for k in range(num_workers + 1)]
+    return [(bounds[k], bounds[k + 1]) for k in range(num_workers) if bounds[k] < bounds[k + 1]]
+
+
+def default_devices() -> List[str]:
+    """有 GPU 时每张卡一个进程，否则全部使用 CPU"""
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ['cpu']
+
+
+def run_worker(
+    worker_id: int,
+    device: str,
+    num_threads: int,
+    shard: List[Dict],
+    args_dict: Dict
+) -> Dict:
+    """工作进程：加载模型副本并生成分片内的回答"""
+
+    # 必须在初始化 CUDA 之前限定可见设备，使 device_map='auto' 只落在分配到的卡上
+    if device.startswith('cuda'):
+        os.environ['CUDA_VISIBLE_DEVICES'] = device.split(':', 1)[1] if ':' in device else '0'
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    import torch
+    torch.set_num_threads(num_threads)
+
+    from src.model import load_trained_model
+    from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+    from src.sample_store import token_counts
+
+    load_start = time.perf_counter()
+    model, tokenizer = load_trained_model(
+        args_dict['model_path'],
+        args_dict['base_model_path'],
+        dtype=args_dict['dtype'],
+        quantize=args_dict['quantize']
+    )
+    load_time = time.perf_counter() - load_start
+
+    evaluator = EnhancedMedicalQAEvaluator(
+        model,
+        tokenizer,
+        batch_size=args_dict['batch_size'],
+        adaptive_batch=args_dict['adaptive_batch'],
+        max_batch_size=args_dict['max_batch_size']
+    )
+
+    journal_path = None
+    if args_dict['journal_dir']:
+        start, end = args_dict['shard_range']
+        journal_path = str(Path(args_dict['journal_dir']) / f"shard_{start}_{end}.jsonl")
+
+    gen_start = time.perf_counter()
+    predictions = evaluator.generate_predictions(
+        shard,
+        verbose=(worker_id == 0),
+        max_new_tokens=args_dict['max_new_tokens'],
+        journal_path=journal_path
+    )
+    gen_time = time.perf_counter() - gen_start
+
+    return {
+        'worker_id': worker_id,
+        'device': device,
+        'num_threads': num_threads,
+        'num_samples': len(shard),
+        'load_time': load_time,
+        'generate_time': gen_time,
+        'predictions': predictions,
+        'latencies': evaluator.generation_latencies,
+        'token_counts': token_counts(tokenizer, shard, predictions)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据并行模型评估")
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        required=True,
+        help='模型路径，如 outputs/lora_medical/checkpoint-best'
+    )
+    parser.add_argument(
+        '--base_model_path',
+        type=str,
+        default=None,
+        help='基础模型路径（如果是 LoRA 模型需要提供）'
+    )
+    parser.add_argument(
+        '--test_file',
+        type=str,
+        default='./data/processed/test.json',
+        help='测试数据文件'
+    )
+    parser.add_argument(
+        '--output_file',
+        type=str,
+        default=None,
+        help='结果保存路径'
+    )
+    parser.add_argument(
+        '--max_samples',
+        type=int,
+        default=None,
+        help='最大评估样本数（用于快速测试）'
+    )
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=None,
+        help='工作进程数（默认每个设备一个进程）'
+    )
+    parser.add_argument(
+        '--devices',
+        type=str,
+        default=None,
+        help='逗号分隔的设备列表，如 cuda:0,cuda:1 或 cpu（进程按顺序轮流分配）'
+    )
+    parser.add_argument(
+        '--threads_per_worker',
+        type=int,
+        default=None,
+        help='每个进程的 CPU 线程数（默认平分 CPU 核数）'
+    )
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='auto',
+        choices=['auto', 'float16', 'bfloat16', 'float32'],
+        help='推理精度（见 evaluate.py --dtype）'
+    )
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default=None,
+        choices=['int8'],
+        help='CPU int8 动态量化（见 evaluate.py --quantize）'
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=16,
+        help='每个进程的批量生成大小'
+    )
+    parser.add_argument(
+        '--adaptive_batch',
+        action='store_true',
+        help='自适应批次大小（见 evaluate_enhanced.py）'
+    )
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=64,
+        help='自适应批次的上限'
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=256,
+        help='最大生成长度（减少可加快速度）'
+    )
+    parser.add_argument(
+        '--metric_cache_dir',
+        type=str,
+        default='./outputs/.metric_cache',
+        help='指标缓存目录（参考答案分词结果和 BERTScore 向量，多次实验共用同一 test.json 时复用）'
+    )
+    parser.add_argument(
+        '--metric_workers',
+        type=int,
+        default=None,
+        help='指标计算进程数（默认 CPU 核数；样本较少时在主进程计算）'
+    )
+    parser.add_argument(
+        '--bertscore_model',
+        type=str,
+        default='bert-base-chinese',
+        help='BERTScore 打分模型（名称或本地路径，默认与 bert_score lang=zh 相同）'
+    )
+    parser.add_argument(
+        '--bertscore_batch_size',
+        type=int,
+        default=64,
+        help='BERTScore 编码批次大小（文本按长度排序后分批）'
+    )
+    parser.add_argument(
+        '--bertscore_threads',
+        type=int,
+        default=None,
+        help='BERTScore 在 CPU 上编码时的线程数（默认沿用 torch 设置）'
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        default='rouge,bleu,bertscore,length',
+        help='要计算的指标，逗号分隔（可选: rouge, bleu, bertscore, length）'
+    )
+    parser.add_argument(
+        '--journal_dir',
+        type=str,
+        default=None,
+        help='分片预测日志目录，每个分片一个 JSONL 文件，支持断点续跑'
+    )
+
+    args = parser.parse_args()
+    from src.metrics import parse_metric_names
+
+    try:
+        args.metrics = parse_metric_names(args.metrics)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("=" * 60)
+    print("数据并行模型评估 (ROUGE + BLEU + BERTScore)")
+    print("=" * 60)
+
+    # 1. 加载测试数据
+    print(f"\n1. 加载测试数据: {args.test_file}")
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)
+
+    if args.max_samples and len(test_data) > args.max_samples:
+        test_data = test_data[:args.max_samples]
+        print(f"   限制样本数: {args.max_samples}")
+
+    print(f"   测试样本数: {len(test_data)}")
+
+    # 2. 分配设备和分片
+    devices = args.devices.split(',') if args.devices else default_devices()
+    num_workers = args.num_workers or len(devices)
+    ranges = shard_ranges(len(test_data), num_workers)
+    num_workers = len(ranges)
+
+    cpu_workers = sum(1 for k in range(num_workers) if devices[k % len(devices)] == 'cpu')
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, cpu_workers))
+
+    print(f"\n2. 启动 {num_workers} 个工作进程")
+    for k, (start, end) in enumerate(ranges):
+        print(f"   worker {k}: {devices[k % len(devices)]:<8} 样本 [{start}, {end})")
+
+    # 主进程在等待生成时空闲：先建好指标调度器，每个分片完成即交给后台累加指标
+    from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+    from src.sample_store import save_eval_samples
+    evaluator = EnhancedMedicalQAEvaluator(
+        None, None,
+        metric_cache_dir=args.metric_cache_dir,
+        metric_workers=args.metric_workers,
+        bertscore_model=args.bertscore_model,
+        bertscore_batch_size=args.bertscore_batch_size,
+        bertscore_threads=args.bertscore_threads,
+        metrics=args.metrics
+    )
+    references = [item['output'] for item in test_data]
+    # 模型类指标（BERTScore）推迟到生成结束后再加载模型、编码并打分，不与 worker 抢占 GPU
+    metric_run = evaluator.metric_scheduler.start(references, background=True, prepare=False)
+
+    # 3. 并行生成
+    print("\n3. 并行生成回答...")
+    print("-" * 60)
+    wall_start = time.perf_counter()
+
+    # spawn：每个子进程独立初始化 CUDA，避免 fork 继承父进程状态
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as pool:
+        futures = {}
+        for k, (start, end) in enumerate(ranges):
+            args_dict = dict(vars(args), shard_range=(start, end))
+            future = pool.submit(
+                run_worker,
+                k,
+                devices[k % len(devices)],
+                threads,
+                test_data[start:end],
+                args_dict
+            )
+            futures[future] = k
+        worker_results = [None] * len(ranges)
+        for future in as_completed(futures):
+            k = futures[future]
+            start, end = ranges[k]
+            worker_results[k] = future.result()
+            metric_run.submit(worker_results[k]['predictions'], references[start:end], range(start, end))
+
+    wall_time = time.perf_counter() - wall_start
+
+    # 按分片顺序合并
+    predictions = []
+    for result in worker_results:
+        predictions.extend(result['predictions'])
+    latencies = np.concatenate([result['latencies'] for result in worker_results])
+    counts = {
+        name: np.concatenate([result['token_counts'][name] for result in worker_results])
+        for name in worker_results[0]['token_counts']
+    }
+
+    # 4. 等待指标累加完成（结果与在合并后的完整集合上整批计算相同）
+    print("\n4. 计算评估指标（合并结果）...")
+    results = evaluator.evaluate_by_results(test_data, predictions, metric_run=metric_run)
+    results['latencies'] = latencies
+
+    # 5. 打印结果
+    print("\n5. 评估结果:")
+    evaluator.print_results(results)
+
+    print("\n【并行吞吐】")
+    print(f"  {'worker':<8} {'设备':<8} {'线程':>4} {'样本':>6} {'加载(s)':>9} {'生成(s)':>9} {'样本/s':>8}")
+    for result in worker_results:
+        throughput = result['num_samples'] / result['generate_time'] if result['generate_time'] > 0 else 0.0
+        print(
+            f"  {result['worker_id']:<8} {result['device']:<8} {result['num_threads']:>4} "
+            f"{result['num_samples']:>6} {result['load_time']:>9.1f} {result['generate_time']:>9.1f} "
+            f"{throughput:>8.2f}"
+        )
+    print(f"  总耗时: {wall_time:.1f}s，整体吞吐: {len(test_data) / wall_time:.2f} 样本/s")
+
+    # 6. 保存结果
+    if args.output_file:
+        print(f"\n6. 保存结果到: {args.output_file}")
+
+        # 创建输出目录
+        Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
+
+        # 全部样本写入旁边的列式存储（预测、参考、逐样本指标、token 数、生成耗时）
+        store_path = save_eval_samples(args.output_file, test_data, results, counts=counts)
+
+        save_results = {
+            'rouge_scores': results['rouge_scores'],
+            'bleu_score': results['bleu_score'],
+            'corpus_bleu': results.get('corpus_bleu'),
+            'bert_score': results['bert_score'],
+            'length_stats': results['length_stats'],
+            'metric_times': results.get('metric_times'),
+            'num_samples': results['num_samples'],
+            'empty_count': results.get('empty_count', 0),
+            'parallel': {
+                'num_workers': num_workers,
+                'wall_time': wall_time,
+                'workers': [
+                    {k: v for k, v in result.items() if k not in ('predictions', 'latencies', 'token_counts')}
+                    for result in worker_results
+                ]
+            },
+            'sample_store': store_path.name,
+            'samples': [
+                {
+                    'input': test_data[i]['input'],
+                    'reference': results['references'][i],
+                    'prediction': results['predictions'][i]
+                }
+                for i in range(min(10, len(test_data)))
+            ]
+        }
+
+        with open(args.output_file, 'w', encoding='utf-8') as f:
+            json.dump(save_results, f, ensure_ascii=False, indent=2)
+
+        print(f"   ✓ 结果已保存")
+
+    print("\n" + "=" * 60)
+    print("✓ 评估完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,56 @@
 """
 交互式推理脚本
-用于测试微调后的模型
+用于测试微调后的模型；指定 --input_file 时进入批量推理模式
 """
 
 import argparse
-import torch
 
 # 从 src 模块导入功能
-from src.model import load_trained_model
+from src.batch_inference import ORDER_CHOICES, BatchInferenceRunner, read_requests
+from src.chat import ChatSession, ChatStats, format_turn_stats
+from src.model import DTYPE_CHOICES, QUANTIZE_CHOICES, load_draft_model, load_trained_model
+from src.speculative import SpeculativeStats
 
 
-def chat(model, tokenizer, instruction="回答医疗健康问题"):
-    """交互式对话"""
+def chat(
+    model,
+    tokenizer,
+    instruction="回答医疗健康问题",
+    draft_model=None,
+    max_context=2048,
+    max_new_tokens=256,
+    prefill_stats=False,
+    show_stats=False
+):
+    """交互式多轮对话（保留历史和 KV cache，流式输出；提供 draft_model 时使用投机解码）"""
     print("=" * 50)
     print("🏥 医疗问答助手")
     print("=" * 50)
-    print("输入问题开始对话")
+    print("输入问题开始对话（会记住之前的对话）")
     print("输入 'quit' 或 'exit' 退出")
+    print("输入 'reset' 清空对话历史")
     print("输入 'clear' 清屏")
     print("=" * 50)
     
+    session = ChatSession(
+        model,
+        tokenizer,
+        instruction,
+        max_context=max_context,
+        max_new_tokens=max_new_tokens,
+        generate_kwargs=dict(
+            do_sample=True,
+            top_p=0.8,
+            temperature=0.8,
+            repetition_penalty=1.1
+        ),
+        draft_model=draft_model
+    )
+    session_stats = ChatStats()
+    
+    def stream(text):
+        print(text, end="", flush=True)
+    
     while True:
         try:
             user_input = input("\n💬 问题: ").strip()
@@ -34,43 +65,46 @@ def chat(model, tokenizer, instruction="回答医疗健康问题"):
                 print("\033[2J\033[H")  # 清屏
                 continue
             
+            # 清空对话历史
+            if user_input.lower() == 'reset':
+                session.reset()
+                print("✓ 对话历史已清空")
+                continue
+            
             # 空输入
             if not user_input:
                 continue
             
-            # 构建提示
-            prompt = f"{instruction}\n问题：{user_input}\n回答："
-            
-            # 生成回答
-            inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+            print("\n🏥 回答: ", end="", flush=True)
             
-            print("\n🤔 思考中...")
-            
-            with torch.no_grad():
-                outputs = model.generate(
-                    **inputs,
-                    max_length=512,
-                    do_sample=True,
-                    top_p=0.8,
-                    temperature=0.8,
-                    repetition_penalty=1.1
+            if draft_model is not None:
+                turn_stats = SpeculativeStats()
+                with turn_stats.track(model, draft_model):
+                    response, stats = session.ask(user_input, on_text=stream)
+                turn_stats.new_tokens = stats['new_tokens']
+            else:
+                response, stats = session.ask(
+                    user_input, measure_full_prefill=prefill_stats, on_text=stream
                 )
+            session_stats.add(stats)
             
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # 提取回答部分（去掉提示）
-            if "回答：" in response:
-                response = response.split("回答：")[-1].strip()
-            
-            print(f"\n🏥 回答: {response}")
+            if not stats['new_tokens']:
+                print(response, end="")
+            print()
+            if draft_model is not None:
+                turn_stats.print_summary()
+            print(f"⏱️  {format_turn_stats(stats)}")
             print("-" * 50)
             
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             print("\n\n👋 再见！")
             break
         except Exception as e:
             print(f"\n❌ 错误: {e}")
             continue
+    
+    if show_stats:
+        session_stats.print_summary()
 
 
 def main():
@@ -93,6 +127,108 @@ def main():
         default="回答医疗健康问题",
         help='指令提示'
     )
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='auto',
+        choices=DTYPE_CHOICES,
+        help='推理精度：auto 在 GPU 上用 float16，CPU 上支持原生 bf16 时用 bfloat16，否则用 float32'
+    )
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default=None,
+        choices=QUANTIZE_CHOICES,
+        help='CPU 量化推理：int8 对 Linear 层做动态量化（LoRA 会先合并，忽略 --dtype）'
+    )
+    parser.add_argument(
+        '--num_threads',
+        type=int,
+        default=None,
+        help='CPU 推理线程数（默认使用 PyTorch 默认值）'
+    )
+    parser.add_argument(
+        '--max_context',
+        type=int,
+        default=2048,
+        help='对话上下文上限（token），超出后丢弃最早的轮次'
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=256,
+        help='每轮最大生成长度'
+    )
+    parser.add_argument(
+        '--prefill_stats',
+        action='store_true',
+        help='每轮额外测量一次完整上下文的预填充耗时，对比复用 KV cache 节省的延迟'
+    )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='退出时打印整个会话的首 token 延迟、token 间隔分位数和吞吐'
+    )
+    parser.add_argument(
+        '--input_file',
+        type=str,
+        default=None,
+        help='批量推理：请求 JSONL 文件（"-" 表示标准输入），每行一个含 --input_field 字段的 JSON'
+    )
+    parser.add_argument(
+        '--output_file',
+        type=str,
+        default='./outputs/batch_responses.jsonl',
+        help='批量推理：输出 JSONL（逐批追加写入，重新运行时跳过已完成的 id）'
+    )
+    parser.add_argument(
+        '--input_field',
+        type=str,
+        default='input',
+        help='批量推理：请求中作为问题的字段名'
+    )
+    parser.add_argument(
+        '--id_field',
+        type=str,
+        default='id',
+        help='批量推理：请求 id 字段名（缺失时使用行号）'
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=16,
+        help='批量推理：批次大小'
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=256,
+        help='批量推理：每次读入的请求数，窗口内按长度组批，决定内存占用上限'
+    )
+    parser.add_argument(
+        '--order',
+        type=str,
+        default='input',
+        choices=ORDER_CHOICES,
+        help='批量推理：输出顺序，input 按输入顺序，completion 按完成顺序'
+    )
+    parser.add_argument(
+        '--do_sample',
+        action='store_true',
+        help='批量推理：使用采样（默认贪心解码）'
+    )
+    parser.add_argument(
+        '--draft_model_path',
+        type=str,
+        default=None,
+        help='投机解码草稿模型路径（需与目标模型同词表，如 Qwen2.5-0.5B-Instruct）'
+    )
+    parser.add_argument(
+        '--draft_num_layers',
+        type=int,
+        default=None,
+        help='用目标模型的前 N 层作为草稿模型进行投机解码（与 --draft_model_path 二选一）'
+    )
     
     args = parser.parse_args()
     
@@ -102,12 +238,49 @@ def main():
         print(f"   基础模型: {args.base_model_path}")
     
     # 加载模型
-    model, tokenizer = load_trained_model(args.model_path, args.base_model_path)
+    model, tokenizer = load_trained_model(
+        args.model_path,
+        args.base_model_path,
+        dtype=args.dtype,
+        num_threads=args.num_threads,
+        quantize=args.quantize
+    )
+    
+    draft_model = None
+    if args.draft_model_path or args.draft_num_layers:
+        draft_model = load_draft_model(model, args.draft_model_path, args.draft_num_layers)
+        print(f"   草稿模型: {args.draft_model_path or f'前 {args.draft_num_layers} 层'}（投机解码）")
     
     print("✓ 模型加载完成！\n")
     
+    if args.input_file:
+        if draft_model is not None:
+            parser.error("批量推理模式不支持投机解码（--draft_model_path / --draft_num_layers）")
+        runner = BatchInferenceRunner(
+            model,
+            tokenizer,
+            batch_size=args.batch_size,
+            window=args.window,
+            max_new_tokens=args.max_new_tokens,
+            do_sample=args.do_sample,
+            order=args.order
+        )
+        requests = read_requests(args.input_file, args.id_field, args.input_field, args.instruction)
+        runner.run(requests, args.output_file)
+        runner.print_report()
+        return
+    
     # 开始对话
-    chat(model, tokenizer, args.instruction)
+    chat(
+        model,
+        tokenizer,
+        args.instruction,
+        draft_model=draft_model,
+        max_context=args.max_context,
+        max_new_tokens=args.max_new_tokens,
+        prefill_stats=args.prefill_stats,
+        show_stats=args.stats
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+"""
+编译解码基准测试
+对比 eager（动态 KV cache）与 torch.compile + 静态 KV cache 的每 token 解码延迟（贪心解码，输出应一致）
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import DTYPE_CHOICES, load_trained_model
+from src.generation import CompiledGeneration, encode_prompts
+
+
+def run(model, tokenizer, batches, max_new_tokens, compiled=None):
+    """逐批贪心生成，返回 (输出列表, 总耗时, 新 token 数)"""
+    generate_kwargs = dict(
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+    if compiled is not None:
+        generate_kwargs.update(compiled.generate_kwargs())
+
+    outputs, total_time, total_tokens = [], 0.0, 0
+    for inputs in batches:
+        input_length = inputs['input_ids'].shape[1]
+        start = time.perf_counter()
+        with torch.no_grad():
+            if compiled is not None:
+                output = compiled.generate(
+                    inputs, lambda batch: model.generate(**batch, **generate_kwargs), max_new_tokens
+                )
+            else:
+                output = model.generate(**inputs, **generate_kwargs)
+        total_time += time.perf_counter() - start
+        total_tokens += int((output[:, input_length:] != tokenizer.pad_token_id).sum())
+        outputs.extend(row[input_length:].tolist() for row in output)
+    return outputs, total_time, total_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="编译解码基准测试")
+    parser.add_argument('--model_path', type=str, required=True, help='模型路径')
+    parser.add_argument('--base_model_path', type=str, default=None, help='基础模型路径（LoRA 模型需要提供）')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--num_samples', type=int, default=32, help='测试样本数')
+    parser.add_argument('--batch_size', type=int, default=8, help='批量生成大小')
+    parser.add_argument('--max_new_tokens', type=int, default=64, help='最大生成长度')
+    parser.add_argument('--bucket_width', type=int, default=64, help='提示长度分桶宽度')
+    parser.add_argument('--dtype', type=str, default='auto', choices=DTYPE_CHOICES, help='推理精度')
+    parser.add_argument('--num_threads', type=int, default=None, help='CPU 推理线程数')
+    parser.add_argument('--compile_cache_dir', type=str, default='./outputs/.compile_cache', help='编译缓存目录')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("编译解码基准测试")
+    print("=" * 60)
+
+    model, tokenizer = load_trained_model(
+        args.model_path, args.base_model_path, dtype=args.dtype, num_threads=args.num_threads
+    )
+    tokenizer.padding_side = 'left'
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+    prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data]
+
+    # 两条路径使用相同的分桶填充，保证输入完全一致
+    batches = [
+        encode_prompts(
+            tokenizer,
+            prompts[start:start + args.batch_size],
+            model.device,
+            pad_to_multiple_of=args.bucket_width
+        )
+        for start in range(0, len(prompts), args.batch_size)
+    ]
+
+    compiled = CompiledGeneration(args.bucket_width, args.compile_cache_dir)
+
+    # 预热：eager 跑一批；编译路径对每个形状桶各跑一次，把编译时间单独统计
+    run(model, tokenizer, batches[:1], args.max_new_tokens)
+    warmup_start = time.perf_counter()
+    seen = set()
+    for inputs in batches:
+        shape = (1 << (inputs['input_ids'].shape[0] - 1).bit_length(), inputs['input_ids'].shape[1])
+        if shape not in seen:
+            seen.add(shape)
+            run(model, tokenizer, [inputs], args.max_new_tokens, compiled)
+    warmup_time = time.perf_counter() - warmup_start
+
+    eager_outputs, eager_time, eager_tokens = run(model, tokenizer, batches, args.max_new_tokens)
+    compiled_outputs, compiled_time, compiled_tokens = run(
+        model, tokenizer, batches, args.max_new_tokens, compiled
+    )
+
+    eager_ms = eager_time / max(1, eager_tokens) * 1000
+    compiled_ms = compiled_time / max(1, compiled_tokens) * 1000
+    same = sum(1 for a, b in zip(eager_outputs, compiled_outputs) if a == b)
+
+    print(f"\n样本数: {len(prompts)}，批次: {args.batch_size}，最大生成长度: {args.max_new_tokens}")
+    print(f"编译预热: {warmup_time:.1f}s（{len(seen)} 个形状桶，缓存目录 {args.compile_cache_dir}）")
+    print(f"{'':<10} {'token':>8} {'耗时(s)':>9} {'ms/token':>10}")
+    print(f"{'eager':<10} {eager_tokens:>8} {eager_time:>9.2f} {eager_ms:>10.2f}")
+    print(f"{'compiled':<10} {compiled_tokens:>8} {compiled_time:>9.2f} {compiled_ms:>10.2f}")
+    print(f"每 token 加速: {eager_ms / compiled_ms:.2f}x")
+    print(f"输出一致: {same}/{len(prompts)}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
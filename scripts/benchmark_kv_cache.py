@@ -0,0 +1,119 @@
+"""
+量化 KV cache 基准测试
+在 test.json 样本上对比 原精度 / int8 / int4 / auto（逐层选择）KV cache 的
+显存占用、给定 KV 预算下可容纳的批次大小以及 ROUGE 差异（贪心解码）
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import DTYPE_CHOICES, load_trained_model
+from src.generation import decode_responses, encode_prompts
+from src.kv_cache import KVCacheQuantizer, full_precision_nbytes, layer_nbytes
+from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+
+
+def run(model, tokenizer, prompts, batch_size, max_new_tokens, quantizer=None):
+    """贪心批量生成，返回 (回答列表, 每条序列 KV 字节数, 原精度每条序列 KV 字节数, 耗时)"""
+    predictions = []
+    per_seq_bytes, per_seq_full = 0.0, 0.0
+    start = time.perf_counter()
+
+    for begin in range(0, len(prompts), batch_size):
+        batch = prompts[begin:begin + batch_size]
+        inputs = encode_prompts(tokenizer, batch, model.device)
+        input_length = inputs['input_ids'].shape[1]
+        # 不量化时用 layer_bits=16（全部 DynamicLayer），便于统一统计
+        cache = (quantizer or KVCacheQuantizer([16] * len(model_layers(model)))).new_cache()
+
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                past_key_values=cache,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id
+            )
+
+        per_seq_bytes = max(per_seq_bytes, sum(layer_nbytes(l) for l in cache.layers) / len(batch))
+        per_seq_full = max(per_seq_full, sum(full_precision_nbytes(l) for l in cache.layers) / len(batch))
+        predictions.extend(decode_responses(tokenizer, outputs, input_length))
+
+    return predictions, per_seq_bytes, per_seq_full, time.perf_counter() - start
+
+
+def model_layers(model):
+    return range(model.config.get_text_config().num_hidden_layers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量化 KV cache 基准测试")
+    parser.add_argument('--model_path', type=str, required=True, help='模型路径')
+    parser.add_argument('--base_model_path', type=str, default=None, help='基础模型路径（LoRA 模型需要提供）')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--num_samples', type=int, default=64, help='测试样本数')
+    parser.add_argument('--batch_size', type=int, default=16, help='批量生成大小')
+    parser.add_argument('--max_new_tokens', type=int, default=256, help='最大生成长度')
+    parser.add_argument('--residual_length', type=int, default=128, help='保持原精度的最近 token 数')
+    parser.add_argument('--max_error', type=float, default=0.1, help='auto 模式允许 int4 的最大相对误差')
+    parser.add_argument('--kv_budget_gb', type=float, default=8.0, help='用于换算可容纳批次的 KV cache 显存预算')
+    parser.add_argument('--dtype', type=str, default='auto', choices=DTYPE_CHOICES, help='推理精度')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("量化 KV cache 基准测试")
+    print("=" * 60)
+
+    model, tokenizer = load_trained_model(args.model_path, args.base_model_path, dtype=args.dtype)
+    tokenizer.padding_side = 'left'
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+    prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data]
+
+    scorer = EnhancedMedicalQAEvaluator(None, None)
+    budget = args.kv_budget_gb * 1024 ** 3
+
+    rows = []
+    for mode in [None, 'int8', 'int4', 'auto']:
+        quantizer = None
+        if mode:
+            quantizer = KVCacheQuantizer.calibrate(
+                model, tokenizer, prompts[:8], mode, args.max_error, residual_length=args.residual_length
+            )
+        predictions, per_seq, per_seq_full, elapsed = run(
+            model, tokenizer, prompts, args.batch_size, args.max_new_tokens, quantizer
+        )
+        rouge_l = scorer.calculate_rouge(predictions, [item['output'] for item in test_data])['rouge-l']['f']
+        rows.append({
+            'name': f"{mode}（{quantizer.describe()}）" if quantizer else '原精度',
+            'per_seq': per_seq,
+            'max_batch': int(budget // per_seq) if per_seq else 0,
+            'rouge_l': rouge_l,
+            'elapsed': elapsed,
+            'predictions': predictions
+        })
+
+    base = rows[0]
+    print(f"\n样本数: {len(prompts)}，批次: {args.batch_size}，最大生成长度: {args.max_new_tokens}")
+    print(f"{'KV cache':<26} {'MB/序列':>9} {'节省':>7} {'可容纳批次':>10} {'ROUGE-L':>9} {'ΔROUGE-L':>9} {'耗时(s)':>8}")
+    for row in rows:
+        saved = 1 - row['per_seq'] / base['per_seq'] if base['per_seq'] else 0.0
+        print(
+            f"{row['name']:<26} {row['per_seq'] / 1024 ** 2:>9.2f} {saved:>7.1%} {row['max_batch']:>10} "
+            f"{row['rouge_l']:>9.4f} {row['rouge_l'] - base['rouge_l']:>+9.4f} {row['elapsed']:>8.1f}"
+        )
+    print(f"（可容纳批次按 {args.kv_budget_gb:.0f} GB KV 预算、本次最长批次的每序列占用换算）")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
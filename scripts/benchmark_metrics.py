@@ -0,0 +1,155 @@
+"""
+评估指标基准测试
+对比 rouge_chinese / NLTK / bert_score 与 src.rouge.NativeRouge / src.bleu.NativeBleu / src.bertscore.BertScorer
+的耗时和逐样本分数差异（预测取错位的参考答案，长度分布与真实回答相近；分词预先完成，只计指标耗时）
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.bertscore import DEFAULT_MODEL, DEFAULT_NUM_LAYERS, BertScorer
+from src.bleu import NativeBleu
+from src.rouge import ROUGE_METRICS, ROUGE_STATS, NativeRouge
+from src.segmentation import Segmenter
+
+
+def load_pairs(test_file: str, num_samples: int, predictions_file: str = None):
+    """返回 (预测列表, 参考列表)；没有预测文件时用错位一条的参考答案充当预测"""
+    with open(test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)
+    references = [item['output'] for item in test_data]
+
+    if predictions_file:
+        with open(predictions_file, 'r', encoding='utf-8') as f:
+            predictions = [json.loads(line)['output'] for line in f if line.strip()]
+        references = references[:len(predictions)]
+    else:
+        predictions = references[1:] + references[:1]
+
+    # 样本不足时循环补齐到 num_samples
+    repeat = -(-num_samples // len(references))
+    return (predictions * repeat)[:num_samples], (references * repeat)[:num_samples]
+
+
+def bench_rouge(predictions_seg, references_seg, num_workers):
+    from rouge_chinese import Rouge
+
+    start = time.perf_counter()
+    baseline = Rouge().get_scores(predictions_seg, references_seg)
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    averages, per_sample = NativeRouge(num_workers).get_scores(predictions_seg, references_seg)
+    native_time = time.perf_counter() - start
+
+    max_diff = max(
+        float(np.abs(np.array([row[metric][stat] for row in baseline]) - per_sample[metric][stat]).max())
+        for metric in ROUGE_METRICS
+        for stat in ROUGE_STATS
+    )
+    print(f"\n【ROUGE】")
+    print(f"  rouge_chinese: {baseline_time:.2f}s | native: {native_time:.2f}s | 加速 {baseline_time / native_time:.1f}x")
+    print(f"  逐样本最大差异: {max_diff:.2e}")
+    print("  " + " | ".join(f"{metric.upper()} F {averages[metric]['f']:.4f}" for metric in ROUGE_METRICS))
+
+
+def bench_bleu(predictions_tokens, references_tokens, num_workers):
+    from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu, sentence_bleu
+
+    smooth = SmoothingFunction().method1
+    start = time.perf_counter()
+    baseline = [
+        sentence_bleu([ref], pred, smoothing_function=smooth)
+        for pred, ref in zip(predictions_tokens, references_tokens)
+    ]
+    baseline_time = time.perf_counter() - start
+    start = time.perf_counter()
+    baseline_corpus = corpus_bleu([[ref] for ref in references_tokens], predictions_tokens, smoothing_function=smooth)
+    baseline_corpus_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sentence_scores, corpus_score = NativeBleu(num_workers=num_workers).score(predictions_tokens, references_tokens)
+    native_time = time.perf_counter() - start
+
+    print(f"\n【BLEU】")
+    print(
+        f"  NLTK 句子级: {baseline_time:.2f}s + 语料级: {baseline_corpus_time:.2f}s | "
+        f"native（一次算出两者）: {native_time:.2f}s | "
+        f"加速 {(baseline_time + baseline_corpus_time) / native_time:.1f}x"
+    )
+    print(
+        f"  句子级最大差异: {np.abs(np.array(baseline) - sentence_scores).max():.2e} | "
+        f"语料级差异: {abs(baseline_corpus - corpus_score):.2e}"
+    )
+    print(f"  平均句子 BLEU {sentence_scores.mean():.4f} | 语料级 BLEU {corpus_score:.4f}")
+
+
+def bench_bertscore(predictions, references, model_type, num_layers, batch_size):
+    from bert_score import score as bert_score
+
+    start = time.perf_counter()
+    baseline = bert_score(
+        predictions, references, model_type=model_type, num_layers=num_layers, batch_size=batch_size, lang='zh'
+    )
+    baseline_time = time.perf_counter() - start
+
+    scorer = BertScorer(model_type, num_layers, batch_size=batch_size)
+    start = time.perf_counter()
+    native = scorer.score(predictions, references)
+    native_time = time.perf_counter() - start
+
+    max_diff = max(
+        float(np.abs(values.numpy() - native[key]).max())
+        for key, values in zip(('precision', 'recall', 'f1'), baseline)
+    )
+    print(f"\n【BERTScore】（{len(predictions)} 条）")
+    print(f"  bert_score: {baseline_time:.2f}s | BertScorer: {native_time:.2f}s")
+    print(f"  逐样本 P / R / F1 最大差异: {max_diff:.2e} | 平均 F1 差异: {abs(float(baseline[2].mean()) - native['f1'].mean()):.2e}")
+    print(f"  平均 F1 {native['f1'].mean():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估指标基准测试")
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--predictions_file', type=str, default=None, help='预测 JSONL（含 output 字段，可用预测日志）')
+    parser.add_argument('--num_samples', type=int, default=5000, help='样本数（不足时循环补齐）')
+    parser.add_argument('--metric_workers', type=int, default=None, help='指标计算进程数（默认 CPU 核数）')
+    parser.add_argument('--bertscore_model', type=str, default=DEFAULT_MODEL, help='BERTScore 模型')
+    parser.add_argument('--bertscore_num_layers', type=int, default=DEFAULT_NUM_LAYERS, help='BERTScore 取第几层输出')
+    parser.add_argument('--bertscore_samples', type=int, default=500, help='BERTScore 对比的样本数（0 表示跳过）')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("评估指标基准测试")
+    print("=" * 60)
+
+    predictions, references = load_pairs(args.test_file, args.num_samples, args.predictions_file)
+    print(f"样本数: {len(predictions)}")
+
+    segmenter = Segmenter(num_workers=args.metric_workers)
+    start = time.perf_counter()
+    predictions_tokens = segmenter.segment(predictions)
+    references_tokens = segmenter.segment(references)
+    predictions_seg = [' '.join(tokens) for tokens in predictions_tokens]
+    references_seg = [' '.join(tokens) for tokens in references_tokens]
+    print(f"分词: {time.perf_counter() - start:.2f}s（不计入指标耗时）")
+
+    bench_rouge(predictions_seg, references_seg, args.metric_workers)
+    bench_bleu(predictions_tokens, references_tokens, args.metric_workers)
+    if args.bertscore_samples > 0:
+        bench_bertscore(
+            predictions[:args.bertscore_samples], references[:args.bertscore_samples],
+            args.bertscore_model, args.bertscore_num_layers, batch_size=64
+        )
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
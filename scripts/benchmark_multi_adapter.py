@@ -0,0 +1,114 @@
+"""
+多 adapter 推理基准测试
+对比 逐个加载「基础模型 + adapter」顺序评估 与 单基座挂载多个 adapter 混合批次评估 的加载耗时、参数内存和吞吐
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import load_multi_adapter_model, load_trained_model
+from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+
+
+def parameter_bytes(model) -> int:
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def peak_memory_gb() -> float:
+    """CUDA 峰值显存（CPU 下返回 0）"""
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 1024 ** 3
+    return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多 adapter 推理基准测试")
+    parser.add_argument('--adapters', type=str, required=True, help='逗号分隔的 名称=路径')
+    parser.add_argument('--base_model_path', type=str, required=True, help='基础模型路径')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--num_samples', type=int, default=20, help='每个 adapter 的测试样本数')
+    parser.add_argument('--batch_size', type=int, default=16, help='批量生成大小')
+    parser.add_argument('--max_new_tokens', type=int, default=64, help='最大生成长度')
+    args = parser.parse_args()
+
+    adapter_paths = dict(item.split('=', 1) for item in args.adapters.split(','))
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+    total = len(test_data) * len(adapter_paths)
+
+    print("=" * 60)
+    print("多 adapter 推理基准测试")
+    print("=" * 60)
+    print(f"adapter 数: {len(adapter_paths)}，每个 {len(test_data)} 条，共 {total} 条生成")
+
+    # 1. 顺序：每个 adapter 重新加载基础模型
+    print("\n1. 顺序重载...")
+    seq_load, seq_gen, seq_bytes = 0.0, 0.0, 0
+    seq_predictions = {}
+    for name, path in adapter_paths.items():
+        start = time.perf_counter()
+        model, tokenizer = load_trained_model(path, args.base_model_path)
+        seq_load += time.perf_counter() - start
+        seq_bytes = max(seq_bytes, parameter_bytes(model))
+
+        evaluator = EnhancedMedicalQAEvaluator(model, tokenizer, batch_size=args.batch_size)
+        torch.manual_seed(42)
+        start = time.perf_counter()
+        seq_predictions[name] = evaluator.generate_predictions(
+            test_data, verbose=False, max_new_tokens=args.max_new_tokens
+        )
+        seq_gen += time.perf_counter() - start
+        del model, evaluator
+    seq_peak = peak_memory_gb()
+
+    # 2. 单基座多 adapter：一次加载，批内混合
+    print("\n2. 单基座多 adapter...")
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    model, tokenizer = load_multi_adapter_model(adapter_paths, args.base_model_path)
+    multi_load = time.perf_counter() - start
+    multi_bytes = parameter_bytes(model)
+
+    evaluator = EnhancedMedicalQAEvaluator(model, tokenizer, batch_size=args.batch_size)
+    torch.manual_seed(42)
+    start = time.perf_counter()
+    multi_predictions = evaluator.generate_adapter_predictions(
+        test_data, list(adapter_paths), verbose=False, max_new_tokens=args.max_new_tokens
+    )
+    multi_gen = time.perf_counter() - start
+    multi_peak = peak_memory_gb()
+
+    # 两条路径批次组成不同，采样时随机数序列也不同，一致率仅供参考
+    same = sum(
+        1
+        for name in adapter_paths
+        for a, b in zip(seq_predictions[name], multi_predictions[name])
+        if a == b
+    )
+
+    print("\n" + "=" * 60)
+    print(f"{'':<12} {'加载(s)':>9} {'生成(s)':>9} {'样本/s':>8} {'参数(GB)':>9} {'峰值显存(GB)':>13}")
+    print(
+        f"{'顺序重载':<12} {seq_load:>9.1f} {seq_gen:>9.1f} {total / seq_gen:>8.2f} "
+        f"{seq_bytes / 1024 ** 3:>9.2f} {seq_peak:>13.2f}"
+    )
+    print(
+        f"{'多adapter':<12} {multi_load:>9.1f} {multi_gen:>9.1f} {total / multi_gen:>8.2f} "
+        f"{multi_bytes / 1024 ** 3:>9.2f} {multi_peak:>13.2f}"
+    )
+    print(f"端到端加速: {(seq_load + seq_gen) / (multi_load + multi_gen):.2f}x")
+    print(f"预测一致: {same}/{total}（启用采样时两条路径随机数不同，不一致属正常）")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
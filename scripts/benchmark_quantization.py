@@ -0,0 +1,120 @@
+"""
+CPU int8 动态量化基准测试
+在 test.json 的样本上对比 float32 与 int8 动态量化的模型大小、解码延迟和评估指标偏移
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import load_trained_model
+from src.generation import decode_responses, encode_prompts
+from src.evaluator_enhanced import EnhancedMedicalQAEvaluator
+
+
+def model_size_mb(model) -> float:
+    """序列化 state_dict 的大小（量化权重以打包形式保存，参数统计会漏掉）"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 ** 2
+
+
+def greedy_generate(model, tokenizer, prompts, batch_size, max_new_tokens):
+    """贪心批量生成，返回 (回答列表, 每 token 平均延迟 ms)"""
+    tokenizer.padding_side = 'left'
+    predictions = []
+    total_time, total_tokens = 0.0, 0
+
+    for start in range(0, len(prompts), batch_size):
+        inputs = encode_prompts(tokenizer, prompts[start:start + batch_size], model.device)
+        input_length = inputs['input_ids'].shape[1]
+
+        begin = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id
+            )
+        total_time += time.perf_counter() - begin
+        total_tokens += int((outputs[:, input_length:] != tokenizer.pad_token_id).sum())
+        predictions.extend(decode_responses(tokenizer, outputs, input_length))
+
+    return predictions, total_time / max(1, total_tokens) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU int8 动态量化基准测试")
+    parser.add_argument('--model_path', type=str, required=True, help='模型路径（推荐 merge_lora.py 导出的合并模型）')
+    parser.add_argument('--base_model_path', type=str, default=None, help='基础模型路径（LoRA 模型需要提供）')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--num_samples', type=int, default=50, help='测试样本数')
+    parser.add_argument('--batch_size', type=int, default=8, help='批量生成大小')
+    parser.add_argument('--max_new_tokens', type=int, default=128, help='最大生成长度')
+    parser.add_argument('--num_threads', type=int, default=None, help='CPU 推理线程数')
+    args = parser.parse_args()
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+    prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data]
+
+    print("=" * 60)
+    print("CPU int8 动态量化基准测试")
+    print("=" * 60)
+    print(f"样本数: {len(test_data)}，最大生成长度: {args.max_new_tokens}（贪心解码）")
+
+    scorer = EnhancedMedicalQAEvaluator(None, None)
+    rows = {}
+    for name, quantize in [('float32', None), ('int8', 'int8')]:
+        print(f"\n[{name}]")
+        model, tokenizer = load_trained_model(
+            args.model_path,
+            args.base_model_path,
+            dtype='float32',
+            num_threads=args.num_threads,
+            quantize=quantize
+        )
+        size = model_size_mb(model)
+        predictions, ms_per_token = greedy_generate(
+            model, tokenizer, prompts, args.batch_size, args.max_new_tokens
+        )
+        results = scorer.evaluate_by_results(test_data, predictions)
+        rows[name] = {
+            'size_mb': size,
+            'ms_per_token': ms_per_token,
+            'rouge_l': results['rouge_scores']['rouge-l']['f'],
+            'bleu': results['bleu_score'],
+            'predictions': predictions
+        }
+        del model
+
+    fp32, int8 = rows['float32'], rows['int8']
+    same = sum(1 for a, b in zip(fp32['predictions'], int8['predictions']) if a == b)
+
+    print("\n" + "=" * 60)
+    print(f"{'':<10} {'大小(MB)':>10} {'ms/token':>10} {'ROUGE-L':>9} {'BLEU':>8}")
+    for name, row in rows.items():
+        print(
+            f"{name:<10} {row['size_mb']:>10.1f} {row['ms_per_token']:>10.2f} "
+            f"{row['rouge_l']:>9.4f} {row['bleu']:>8.4f}"
+        )
+    print(f"模型压缩: {fp32['size_mb'] / int8['size_mb']:.2f}x，解码加速: {fp32['ms_per_token'] / int8['ms_per_token']:.2f}x")
+    print(
+        f"指标偏移: ROUGE-L {int8['rouge_l'] - fp32['rouge_l']:+.4f}，"
+        f"BLEU {int8['bleu'] - fp32['bleu']:+.4f}"
+    )
+    print(f"输出一致: {same}/{len(prompts)}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+投机解码基准测试
+对比 普通解码 与 草稿模型辅助解码 的速度、接受率和输出一致性（贪心解码下两者应完全一致）
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import load_draft_model, load_trained_model
+from src.speculative import SpeculativeStats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投机解码基准测试")
+    parser.add_argument('--model_path', type=str, required=True, help='目标模型路径')
+    parser.add_argument('--base_model_path', type=str, default=None, help='基础模型路径（LoRA 模型需要提供）')
+    parser.add_argument('--draft_model_path', type=str, default=None, help='草稿模型路径')
+    parser.add_argument('--draft_num_layers', type=int, default=None, help='截取目标模型前 N 层作为草稿')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='测试数据文件')
+    parser.add_argument('--num_samples', type=int, default=20, help='测试样本数')
+    parser.add_argument('--max_new_tokens', type=int, default=128, help='最大生成长度')
+    args = parser.parse_args()
+
+    assert args.draft_model_path or args.draft_num_layers, "需要提供 --draft_model_path 或 --draft_num_layers"
+
+    print("=" * 60)
+    print("投机解码基准测试")
+    print("=" * 60)
+
+    model, tokenizer = load_trained_model(args.model_path, args.base_model_path)
+    draft_model = load_draft_model(model, args.draft_model_path, args.draft_num_layers)
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+
+    prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data]
+
+    # 贪心解码：assisted generation 的输出必须与普通解码逐 token 一致
+    generate_kwargs = dict(
+        max_new_tokens=args.max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+
+    # 预热
+    warmup = tokenizer(prompts[0], return_tensors='pt').to(model.device)
+    with torch.no_grad():
+        model.generate(**warmup, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        model.generate(**warmup, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id,
+                       assistant_model=draft_model)
+
+    baseline_time, baseline_tokens = 0.0, 0
+    stats = SpeculativeStats()
+    mismatches = 0
+
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+        input_length = inputs['input_ids'].shape[1]
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            baseline = model.generate(**inputs, **generate_kwargs)
+        baseline_time += time.perf_counter() - start
+        baseline_tokens += baseline.shape[1] - input_length
+
+        with stats.track(model, draft_model), torch.no_grad():
+            assisted = model.generate(**inputs, assistant_model=draft_model, **generate_kwargs)
+        stats.new_tokens += assisted.shape[1] - input_length
+
+        if not torch.equal(baseline, assisted):
+            mismatches += 1
+
+    baseline_tps = baseline_tokens / baseline_time if baseline_time > 0 else 0.0
+
+    print(f"\n样本数: {len(prompts)}，最大生成长度: {args.max_new_tokens}")
+    print(f"普通解码:   {baseline_tokens} token / {baseline_time:.2f}s = {baseline_tps:.1f} token/s")
+    print(f"投机解码:   {stats.new_tokens} token / {stats.elapsed:.2f}s = {stats.tokens_per_second:.1f} token/s")
+    stats.print_summary()
+    print(f"加速比: {stats.tokens_per_second / baseline_tps:.2f}x" if baseline_tps > 0 else "加速比: N/A")
+    print(f"输出一致性: {len(prompts) - mismatches}/{len(prompts)} 条与普通解码完全一致")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+合并 LoRA adapter 到基础模型并导出
+导出后可直接用 evaluate.py / inference.py --model_path <导出目录> 加载（无需 --base_model_path）
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.model import load_trained_model, merge_and_export
+
+
+def benchmark_latency(model, tokenizer, prompts, max_new_tokens):
+    """贪心解码，返回 (每 token 平均延迟 ms, 生成结果)"""
+    outputs = []
+    total_time, total_tokens = 0.0, 0
+
+    # 预热
+    warmup = tokenizer(prompts[0], return_tensors='pt').to(model.device)
+    with torch.no_grad():
+        model.generate(**warmup, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id
+            )
+        total_time += time.perf_counter() - start
+        total_tokens += output.shape[1] - inputs['input_ids'].shape[1]
+        outputs.append(output[0].tolist())
+
+    return total_time / max(1, total_tokens) * 1000, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并 LoRA adapter 并导出")
+    parser.add_argument('--model_path', type=str, required=True, help='LoRA adapter 路径，如 outputs/lora_20k/checkpoint-best')
+    parser.add_argument('--base_model_path', type=str, required=True, help='基础模型路径')
+    parser.add_argument('--output_dir', type=str, required=True, help='合并模型导出目录')
+    parser.add_argument('--max_shard_size', type=str, default='2GB', help='safetensors 分片大小')
+    parser.add_argument('--benchmark', action='store_true', help='导出后对比合并前后的解码延迟')
+    parser.add_argument('--test_file', type=str, default='./data/processed/test.json', help='基准测试数据')
+    parser.add_argument('--num_samples', type=int, default=10, help='基准测试样本数')
+    parser.add_argument('--max_new_tokens', type=int, default=64, help='基准测试生成长度')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("合并 LoRA adapter")
+    print("=" * 60)
+    print(f"adapter:  {args.model_path}")
+    print(f"基础模型: {args.base_model_path}")
+
+    start = time.perf_counter()
+    merge_and_export(args.model_path, args.base_model_path, args.output_dir, args.max_shard_size)
+    print(f"\n✓ 已导出到: {args.output_dir}（{time.perf_counter() - start:.1f}s）")
+
+    shards = sorted(Path(args.output_dir).glob('*.safetensors'))
+    total_size = sum(p.stat().st_size for p in shards) / 1024 ** 3
+    print(f"  safetensors 分片: {len(shards)} 个，共 {total_size:.2f} GB")
+
+    if not args.benchmark:
+        return
+
+    print("\n" + "=" * 60)
+    print("延迟对比（贪心解码）")
+    print("=" * 60)
+
+    with open(args.test_file, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)[:args.num_samples]
+    prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data]
+
+    start = time.perf_counter()
+    model, tokenizer = load_trained_model(args.model_path, args.base_model_path)
+    unmerged_load = time.perf_counter() - start
+    unmerged_ms, unmerged_outputs = benchmark_latency(model, tokenizer, prompts, args.max_new_tokens)
+    del model
+
+    start = time.perf_counter()
+    model, tokenizer = load_trained_model(args.output_dir)
+    merged_load = time.perf_counter() - start
+    merged_ms, merged_outputs = benchmark_latency(model, tokenizer, prompts, args.max_new_tokens)
+
+    same = sum(1 for a, b in zip(unmerged_outputs, merged_outputs) if a == b)
+
+    print(f"{'':<12} {'加载(s)':>10} {'ms/token':>10}")
+    print(f"{'base+LoRA':<12} {unmerged_load:>10.2f} {unmerged_ms:>10.2f}")
+    print(f"{'merged':<12} {merged_load:>10.2f} {merged_ms:>10.2f}")
+    print(f"解码加速: {unmerged_ms / merged_ms:.2f}x")
+    print(f"输出一致: {same}/{len(prompts)}（fp16 合并存在舍入误差，少量不一致属正常）")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 """
 汇总所有实验结果
 生成对比表格和图表
+
+自动发现 outputs/ 下的评估结果，登记到 outputs/summary/runs.sqlite；
+只为新增 / 修改的实验计算置信区间和显著性检验，数据未变化的图表不重画。
 """
 
-import json
-import os
+import argparse
+import hashlib
+import sys
 from pathlib import Path
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -12,109 +16,132 @@ import matplotlib
 matplotlib.rcParams['font.sans-serif'] = ['PingFang SC', 'Arial Unicode MS']  # 支持中文
 matplotlib.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.run_db import DEFAULT_PATTERNS, RunDatabase
 
-def load_results(result_file):
-    """加载评估结果"""
-    if not os.path.exists(result_file):
-        return None
-    
-    with open(result_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    results = {
-        'rouge_scores': data.get('rouge_scores'),
-        'bleu_score': data.get('bleu_score'),
-        'bert_score': data.get('bert_score'),
-        'num_samples': data.get('num_samples', 0)
-    }
-    
-    return results
+
+# 每张图依赖的数据：(方法, 指标列)，用于判断是否需要重画
+CHART_DEPENDENCIES = {
+    '1_rouge_all_metrics': (['-', 'LoRA', 'QLoRA'], ['ROUGE-1', 'ROUGE-2', 'ROUGE-L']),
+    '2_bleu_comparison': (['-', 'LoRA', 'QLoRA'], ['BLEU']),
+    '3_bertscore_comparison': (['-', 'LoRA', 'QLoRA'], ['BERTScore-F1']),
+    '4_lora_all_metrics': (['LoRA'], ['ROUGE-1', 'ROUGE-2', 'ROUGE-L', 'BLEU', 'BERTScore-F1']),
+    '5_qlora_all_metrics': (['QLoRA'], ['ROUGE-1', 'ROUGE-2', 'ROUGE-L', 'BLEU', 'BERTScore-F1']),
+}
+
+
+def chart_fingerprints(df):
+    """每张图所用数据的指纹"""
+    fingerprints = {}
+    for name, (methods, columns) in CHART_DEPENDENCIES.items():
+        subset = df[df['方法'].isin(methods)][['方法', '数据量'] + [c for c in columns if c in df.columns]]
+        fingerprints[name] = hashlib.sha1(subset.to_csv(index=False).encode('utf-8')).hexdigest()
+    return fingerprints
 
 
 def main():
+    parser = argparse.ArgumentParser(description="汇总所有实验结果")
+    parser.add_argument(
+        '--results',
+        type=str,
+        nargs='+',
+        default=DEFAULT_PATTERNS,
+        help='结果文件的 glob 模式（非评估结果的 JSON 会被忽略）'
+    )
+    parser.add_argument(
+        '--db',
+        type=str,
+        default='outputs/summary/runs.sqlite',
+        help='实验数据库路径'
+    )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='清空数据库，重新登记所有结果并重画全部图表'
+    )
+    parser.add_argument(
+        '--num_resamples',
+        type=int,
+        default=10000,
+        help='显著性检验的 bootstrap 重采样 / 置换次数'
+    )
+    parser.add_argument(
+        '--confidence',
+        type=float,
+        default=0.95,
+        help='置信区间的置信水平（显著性水平 = 1 - confidence）'
+    )
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("实验结果汇总 (ROUGE + BLEU + BERTScore)")
     print("=" * 60)
     
-    # 实验配置 - 数据规模: 2k, 5k, 10k, 20k, 40k
-    experiments = [
-        ('Baseline', 'outputs/base.json', 0, '-'),
-        ('LoRA-2k', 'outputs/lora_2k.json', 2000, 'LoRA'),
-        ('LoRA-5k', 'outputs/lora_5k.json', 5000, 'LoRA'),
-        ('LoRA-10k', 'outputs/lora_10k.json', 10000, 'LoRA'),
-        ('LoRA-20k', 'outputs/lora_20k.json', 20000, 'LoRA'),
-        ('LoRA-40k', 'outputs/lora_40k.json', 40000, 'LoRA'),
-        ('QLoRA-2k', 'outputs/qlora_2k.json', 2000, 'QLoRA'),
-        ('QLoRA-5k', 'outputs/qlora_5k.json', 5000, 'QLoRA'),
-        ('QLoRA-10k', 'outputs/qlora_10k.json', 10000, 'QLoRA'),
-        ('QLoRA-20k', 'outputs/qlora_20k.json', 20000, 'QLoRA'),
-        ('QLoRA-40k', 'outputs/qlora_40k.json', 40000, 'QLoRA'),
-    ]
-    
-    # 收集结果
-    results = []
-    for name, file_path, data_size, method in experiments:
-        data = load_results(file_path)
-        if data and data['rouge_scores']:
-            rouge = data['rouge_scores']
-            bleu = data['bleu_score']
-            bert = data['bert_score']
-            
-            result = {
-                '实验': name,
-                '方法': method,
-                '数据量': data_size,
-                'ROUGE-1': rouge['rouge-1']['f'],
-                'ROUGE-2': rouge['rouge-2']['f'],
-                'ROUGE-L': rouge['rouge-l']['f'],
-            }
-            
-            # 添加 BLEU（如果有）
-            if bleu is not None:
-                result['BLEU'] = bleu
-            
-            # 添加 BERTScore（如果有）
-            if bert:
-                result['BERTScore-F1'] = bert['f1']
-            
-            results.append(result)
-            
-            # 打印加载状态 - 显示所有关键指标
-            print(f"✓ {name:15s} R1: {rouge['rouge-1']['f']:.4f}  "
-                  f"R2: {rouge['rouge-2']['f']:.4f}  "
-                  f"RL: {rouge['rouge-l']['f']:.4f}", end="")
-            
-            if bleu is not None:
-                print(f"  BLEU: {bleu:.4f}", end="")
-            
-            if bert:
-                print(f"  BERT: {bert['f1']:.4f}", end="")
-            
-            print()  # 换行
-        else:
-            print(f"✗ {name:15s} 结果文件不存在")
-    
-    if not results:
+    if args.rebuild and Path(args.db).exists():
+        Path(args.db).unlink()
+    db = RunDatabase(args.db)
+    
+    # 发现结果文件：只读取新增 / 修改的文件
+    changes = db.scan(args.results)
+    print(f"结果文件: 新增 {len(changes['added'])}，更新 {len(changes['updated'])}，"
+          f"删除 {len(changes['removed'])}，未变化 {len(changes['unchanged'])}")
+    for path in changes['added']:
+        print(f"  + {path}")
+    for path in changes['updated']:
+        print(f"  * {path}")
+    for path in changes['removed']:
+        print(f"  - {path}")
+    
+    # 只为变化的实验计算置信区间，并检验涉及它们的实验对（需要逐样本存储）
+    num_runs, num_pairs = db.update_statistics(args.num_resamples, args.confidence)
+    if num_runs:
+        print(f"✓ 重新计算 {num_runs} 个实验的置信区间、{num_pairs} 对实验的显著性检验")
+    
+    summary = db.summary_frame()
+    if len(summary) == 0:
         print("\n⚠️  没有找到任何评估结果")
         print("请先运行评估脚本生成结果文件")
+        db.close()
         return
     
-    # 创建 DataFrame
-    df = pd.DataFrame(results)
+    print()
+    for _, row in summary.iterrows():
+        # 打印加载状态 - 显示所有关键指标
+        print(f"✓ {row['实验']:15s} R1: {row['ROUGE-1']:.4f}  "
+              f"R2: {row['ROUGE-2']:.4f}  "
+              f"RL: {row['ROUGE-L']:.4f}", end="")
+        
+        if 'BLEU' in row and pd.notna(row['BLEU']):
+            print(f"  BLEU: {row['BLEU']:.4f}", end="")
+        
+        if 'BERTScore-F1' in row and pd.notna(row['BERTScore-F1']):
+            print(f"  BERT: {row['BERTScore-F1']:.4f}", end="")
+        
+        print()  # 换行
+    
+    # 分析和绘图只用各实验的最终结果（不含中间检查点）
+    df = summary[summary['检查点'] == ''].reset_index(drop=True)
+    pairs = db.pairs_frame(args.confidence)
     
     # 保存为 CSV
     output_dir = Path('outputs/summary')
     output_dir.mkdir(parents=True, exist_ok=True)
     
     csv_file = output_dir / 'results_summary.csv'
-    df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+    db.summary_frame(with_intervals=True).to_csv(csv_file, index=False, encoding='utf-8-sig')
     print(f"\n✓ 结果已保存到: {csv_file}")
     
+    if len(pairs) > 0:
+        pairs_file = output_dir / 'significance.csv'
+        pairs.to_csv(pairs_file, index=False, encoding='utf-8-sig')
+        print(f"✓ 两两显著性检验已保存到: {pairs_file}")
+    
     # 打印表格
     print("\n" + "=" * 60)
     print("实验结果对比表")
     print("=" * 60)
-    print(df.to_string(index=False))
+    print(summary.to_string(index=False))
     
     # 详细分析所有指标
     print("\n" + "=" * 60)
@@ -272,20 +299,46 @@ def main():
     for metric, info in best_configs.items():
         print(f"{metric:<15}: {info['config']:<15} (分数: {info['score']:.4f})")
     
-    
-    # 绘制图表
+    # 5. 配对显著性检验（ROUGE-L；所有指标见 significance.csv）
+    if len(pairs) > 0:
+        metric = 'ROUGE-L' if 'ROUGE-L' in set(pairs['指标']) else pairs['指标'].iloc[0]
+        print(f"\n5. 配对显著性检验 ({metric}, {args.num_resamples} 次重采样, {args.confidence:.0%} 置信区间)")
+        print("-" * 60)
+        print(f"{'实验A':<12} {'实验B':<12} {'差值':>9} {'置信区间':>20} {'bootstrap p':>12} {'置换 p':>8} {'校正 p':>8}")
+        print("-" * 60)
+        for _, row in pairs[pairs['指标'] == metric].iterrows():
+            mark = '✓' if row['显著'] else ' '
+            interval = f"[{row['CI低']:+.4f}, {row['CI高']:+.4f}]"
+            print(f"{row['实验A']:<12} {row['实验B']:<12} {row['差值(A-B)']:>+9.4f} {interval:>20} "
+                  f"{row['bootstrap p']:>12.4f} {row['置换检验 p']:>8.4f} {row['校正 p (Holm)']:>8.4f} {mark}")
+        print(f"\n注: ✓ 表示 Holm 校正后的置换检验 p < {1 - args.confidence:.2f}（差异显著；"
+              f"校正范围为 significance.csv 中全部 {len(pairs)} 项检验）")
+    
+    
+    # 绘制图表（只重画数据有变化的图）
+    fingerprints = chart_fingerprints(df)
+    skip = {
+        name for name, fingerprint in fingerprints.items()
+        if db.chart_fingerprint(name) == fingerprint and (output_dir / f'{name}.png').exists()
+    }
+    written = []
     try:
-        plot_comparison_charts(df, output_dir)
+        plot_comparison_charts(df, output_dir, skip, written)
     except Exception as e:
         print(f"\n⚠️  绘图失败: {e}")
+    for name in written:
+        db.set_chart_fingerprint(name, fingerprints[name])
+    db.close()
     
     print("\n" + "=" * 60)
     print("✓ 汇总完成！")
     print("=" * 60)
 
 
-def plot_comparison_charts(df, output_dir):
-    """绘制对比图表 - 全面分析所有指标"""
+def plot_comparison_charts(df, output_dir, skip=(), written=None):
+    """绘制对比图表 - 全面分析所有指标（skip 中的图数据未变化，不重画；已画的图名追加到 written）"""
+    
+    written = written if written is not None else []
     
     # 过滤出有效数据
     lora_data = df[df['方法'] == 'LoRA'].sort_values('数据量')
@@ -296,48 +349,54 @@ def plot_comparison_charts(df, output_dir):
         print("\n⚠️  没有足够的数据用于绘图")
         return
     
+    if set(CHART_DEPENDENCIES) <= set(skip):
+        print("\n✓ 图表数据未变化，跳过绘图")
+        return
+    
     print("\n" + "=" * 60)
     print("生成对比图表...")
     print("=" * 60)
     
     # 图1: 所有 ROUGE 指标对比（3个子图）
-    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
-    metrics = ['ROUGE-1', 'ROUGE-2', 'ROUGE-L']
+    if '1_rouge_all_metrics' not in skip:
+        fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+        metrics = ['ROUGE-1', 'ROUGE-2', 'ROUGE-L']
     
-    for idx, metric in enumerate(metrics):
-        ax = axes[idx]
+        for idx, metric in enumerate(metrics):
+            ax = axes[idx]
         
-        if len(lora_data) > 0:
-            ax.plot(lora_data['数据量']/1000, lora_data[metric], 
-                   marker='o', label='LoRA', linewidth=2.5, markersize=8, color='#2E86AB')
+            if len(lora_data) > 0:
+                ax.plot(lora_data['数据量']/1000, lora_data[metric], 
+                       marker='o', label='LoRA', linewidth=2.5, markersize=8, color='#2E86AB')
         
-        if len(qlora_data) > 0:
-            ax.plot(qlora_data['数据量']/1000, qlora_data[metric], 
-                   marker='s', label='QLoRA', linewidth=2.5, markersize=8, color='#A23B72')
+            if len(qlora_data) > 0:
+                ax.plot(qlora_data['数据量']/1000, qlora_data[metric], 
+                       marker='s', label='QLoRA', linewidth=2.5, markersize=8, color='#A23B72')
         
-        # Baseline
-        if len(baseline_data) > 0:
-            baseline_score = baseline_data[metric].values[0]
-            ax.axhline(y=baseline_score, color='#F18F01', linestyle='--', 
-                      label=f'Baseline ({baseline_score:.4f})', linewidth=2)
+            # Baseline
+            if len(baseline_data) > 0:
+                baseline_score = baseline_data[metric].values[0]
+                ax.axhline(y=baseline_score, color='#F18F01', linestyle='--', 
+                          label=f'Baseline ({baseline_score:.4f})', linewidth=2)
         
-        ax.set_xlabel('训练数据量 (k)', fontsize=12, fontweight='bold')
-        # 只在最左边的子图显示 Y 轴标签
-        if idx == 0:
-            ax.set_ylabel('ROUGE F1 Score', fontsize=12, fontweight='bold')
-        ax.set_title(metric, fontsize=13, fontweight='bold')
-        ax.legend(fontsize=10, loc='best')
-        ax.grid(True, alpha=0.3, linestyle='--')
-        ax.set_ylim(bottom=0)
-    
-    plt.tight_layout()
-    chart_file = output_dir / '1_rouge_all_metrics.png'
-    plt.savefig(chart_file, dpi=300, bbox_inches='tight')
-    print(f"✓ [1/5] ROUGE 全指标对比图: {chart_file.name}")
-    plt.close()
+            ax.set_xlabel('训练数据量 (k)', fontsize=12, fontweight='bold')
+            # 只在最左边的子图显示 Y 轴标签
+            if idx == 0:
+                ax.set_ylabel('ROUGE F1 Score', fontsize=12, fontweight='bold')
+            ax.set_title(metric, fontsize=13, fontweight='bold')
+            ax.legend(fontsize=10, loc='best')
+            ax.grid(True, alpha=0.3, linestyle='--')
+            ax.set_ylim(bottom=0)
+    
+        plt.tight_layout()
+        chart_file = output_dir / '1_rouge_all_metrics.png'
+        plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+        written.append(chart_file.stem)
+        print(f"✓ [1/5] ROUGE 全指标对比图: {chart_file.name}")
+        plt.close()
     
     # 图2: BLEU 对比
-    if 'BLEU' in df.columns:
+    if 'BLEU' in df.columns and '2_bleu_comparison' not in skip:
         lora_bleu = lora_data[lora_data['BLEU'].notna()]
         qlora_bleu = qlora_data[qlora_data['BLEU'].notna()]
         
@@ -368,11 +427,12 @@ def plot_comparison_charts(df, output_dir):
             
             chart_file = output_dir / '2_bleu_comparison.png'
             plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+            written.append(chart_file.stem)
             print(f"✓ [2/5] BLEU 对比图: {chart_file.name}")
             plt.close()
     
     # 图3: BERTScore 对比
-    if 'BERTScore-F1' in df.columns:
+    if 'BERTScore-F1' in df.columns and '3_bertscore_comparison' not in skip:
         lora_bert = lora_data[lora_data['BERTScore-F1'].notna()]
         qlora_bert = qlora_data[qlora_data['BERTScore-F1'].notna()]
         
@@ -403,11 +463,12 @@ def plot_comparison_charts(df, output_dir):
             
             chart_file = output_dir / '3_bertscore_comparison.png'
             plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+            written.append(chart_file.stem)
             print(f"✓ [3/5] BERTScore 对比图: {chart_file.name}")
             plt.close()
     
     # 图4: 所有指标综合对比（LoRA）
-    if len(lora_data) > 0:
+    if len(lora_data) > 0 and '4_lora_all_metrics' not in skip:
         plt.figure(figsize=(12, 7))
         
         plt.plot(lora_data['数据量']/1000, lora_data['ROUGE-1'], 
@@ -434,11 +495,12 @@ def plot_comparison_charts(df, output_dir):
         
         chart_file = output_dir / '4_lora_all_metrics.png'
         plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+        written.append(chart_file.stem)
         print(f"✓ [4/5] LoRA 全指标综合图: {chart_file.name}")
         plt.close()
     
     # 图5: 所有指标综合对比（QLoRA）
-    if len(qlora_data) > 0:
+    if len(qlora_data) > 0 and '5_qlora_all_metrics' not in skip:
         plt.figure(figsize=(12, 7))
         
         plt.plot(qlora_data['数据量']/1000, qlora_data['ROUGE-1'], 
@@ -465,9 +527,12 @@ def plot_comparison_charts(df, output_dir):
         
         chart_file = output_dir / '5_qlora_all_metrics.png'
         plt.savefig(chart_file, dpi=300, bbox_inches='tight')
+        written.append(chart_file.stem)
         print(f"✓ [5/5] QLoRA 全指标综合图: {chart_file.name}")
         plt.close()
     
+    if skip:
+        print(f"  数据未变化（未重画）: {', '.join(sorted(skip))}")
     print("=" * 60)
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+"""
+推理服务脚本
+把微调后的模型包装成 HTTP 接口，并发请求在等待窗口内合并成批次生成
+"""
+
+import asyncio
+import argparse
+
+# 从 src 模块导入功能
+from src.model import DTYPE_CHOICES, QUANTIZE_CHOICES, load_trained_model
+from src.serving import InferenceServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理服务")
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        required=True,
+        help='模型路径，如 outputs/lora_medical/checkpoint-best'
+    )
+    parser.add_argument(
+        '--base_model_path',
+        type=str,
+        default=None,
+        help='基础模型路径（如果是 LoRA 模型需要提供）'
+    )
+    parser.add_argument(
+        '--instruction',
+        type=str,
+        default="回答医疗健康问题",
+        help='默认指令提示（请求中可用 instruction 字段覆盖）'
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=8,
+        help='每批最多合并的请求数'
+    )
+    parser.add_argument(
+        '--max_wait_ms',
+        type=float,
+        default=20.0,
+        help='收到第一个请求后等待更多请求凑批的最长时间（毫秒）'
+    )
+    parser.add_argument(
+        '--max_queue',
+        type=int,
+        default=256,
+        help='等待队列上限，队列满时新请求返回 503'
+    )
+    parser.add_argument(
+        '--max_new_tokens',
+        type=int,
+        default=256,
+        help='最大生成长度（请求中的 max_new_tokens 不能超过该值）'
+    )
+    parser.add_argument(
+        '--do_sample',
+        action='store_true',
+        help='使用采样（默认贪心解码）'
+    )
+    parser.add_argument(
+        '--latency_window',
+        type=int,
+        default=1000,
+        help='/metrics 延迟分位数统计最近多少个请求'
+    )
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='auto',
+        choices=DTYPE_CHOICES,
+        help='推理精度：auto 在 GPU 上用 float16，CPU 上支持原生 bf16 时用 bfloat16，否则用 float32'
+    )
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default=None,
+        choices=QUANTIZE_CHOICES,
+        help='CPU 量化推理：int8 对 Linear 层做动态量化（LoRA 会先合并，忽略 --dtype）'
+    )
+    parser.add_argument(
+        '--num_threads',
+        type=int,
+        default=None,
+        help='CPU 推理线程数（默认使用 PyTorch 默认值）'
+    )
+    
+    args = parser.parse_args()
+    
+    print("\n🚀 加载模型...")
+    print(f"   模型路径: {args.model_path}")
+    if args.base_model_path:
+        print(f"   基础模型: {args.base_model_path}")
+    
+    model, tokenizer = load_trained_model(
+        args.model_path,
+        args.base_model_path,
+        dtype=args.dtype,
+        num_threads=args.num_threads,
+        quantize=args.quantize
+    )
+    print("✓ 模型加载完成！\n")
+    
+    server = InferenceServer(
+        model,
+        tokenizer,
+        instruction=args.instruction,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+        max_new_tokens=args.max_new_tokens,
+        do_sample=args.do_sample,
+        latency_window=args.latency_window
+    )
+    
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 服务已停止")
+
+
+if __name__ == "__main__":
+    main()
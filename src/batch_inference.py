@@ -0,0 +1,195 @@
+"""
+批量推理模块 - 从 JSONL 文件或标准输入流式读取请求，批量生成并增量写出结果
+"""
+
+import sys
+import json
+import time
+from collections import deque
+from typing import Dict, Iterator, List
+
+import torch
+
+from src.generation import GenerationPipeline
+from src.journal import PredictionJournal
+
+
+ORDER_CHOICES = ['input', 'completion']
+
+
+def read_requests(
+    input_file: str,
+    id_field: str = 'id',
+    input_field: str = 'input',
+    instruction: str = "回答医疗健康问题"
+) -> Iterator[Dict]:
+    """逐行读取请求（input_file 为 '-' 时读标准输入）
+
+    每行一个 JSON 对象；没有 id_field 时用行号作为 id，没有 instruction 字段时用默认指令。
+    """
+    f = sys.stdin if input_file == '-' else open(input_file, 'r', encoding='utf-8')
+    try:
+        for line_no, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️  跳过无法解析的第 {line_no + 1} 行")
+                continue
+            if input_field not in record:
+                print(f"⚠️  第 {line_no + 1} 行缺少字段 '{input_field}'，跳过")
+                continue
+            yield {
+                'id': str(record.get(id_field, line_no)),
+                'instruction': record.get('instruction', instruction),
+                'input': record[input_field],
+            }
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+class BatchInferenceRunner:
+    """流式批量推理
+
+    每次读入 window 条未完成的请求，窗口内按提示长度排序组批（减少填充），
+    经 GenerationPipeline 生成；结果通过 PredictionJournal 每批追加写入输出 JSONL。
+    - order='completion': 每批完成即写出
+    - order='input': 按输入顺序写出，先完成的结果在重排缓冲区等待
+
+    内存占用只与窗口大小有关；输出文件同时是断点日志，重新运行时跳过已完成的 id。
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        batch_size: int = 16,
+        window: int = 256,
+        max_new_tokens: int = 256,
+        do_sample: bool = False,
+        order: str = 'input'
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.window = max(window, batch_size)
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.order = order
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+
+        self.pipeline = GenerationPipeline(tokenizer, model.device)
+        self.stats = {'read': 0, 'skipped': 0, 'completed': 0, 'peak_buffer': 0, 'wall': 0.0}
+
+    def _generate(self, inputs):
+        generate_kwargs = dict(
+            max_new_tokens=self.max_new_tokens,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id
+        )
+        if self.do_sample:
+            generate_kwargs.update(do_sample=True, temperature=0.7, top_p=0.9)
+        else:
+            generate_kwargs.update(do_sample=False)
+        with torch.no_grad():
+            return self.model.generate(**inputs, **generate_kwargs)
+
+    def _windows(self, requests: Iterator[Dict], journal: PredictionJournal) -> Iterator[List[Dict]]:
+        """跳过已完成的请求，按窗口产出待处理请求（附输入序号）"""
+        window, seq = [], 0
+        for request in requests:
+            self.stats['read'] += 1
+            if journal.is_done(request['id']):
+                self.stats['skipped'] += 1
+                continue
+            request['seq'] = seq
+            seq += 1
+            window.append(request)
+            if len(window) >= self.window:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    def run(self, requests: Iterator[Dict], output_file: str, progress_every: int = 100) -> Dict:
+        """处理全部请求，返回统计信息"""
+        start = time.perf_counter()
+        # 已发出、尚未取回结果的批次（流水线按顺序产出）
+        issued = deque()
+        buffer, next_seq = {}, 0
+
+        def prompt_batches():
+            for window in self._windows(requests, journal):
+                prompts = {
+                    request['seq']: f"{request['instruction']}\n问题：{request['input']}\n回答："
+                    for request in window
+                }
+                lengths = self.tokenizer(list(prompts.values()), truncation=True, max_length=512)['input_ids']
+                ordered = [
+                    request for _, request in sorted(
+                        zip(lengths, window), key=lambda pair: len(pair[0]), reverse=True
+                    )
+                ]
+                for begin in range(0, len(ordered), self.batch_size):
+                    batch = ordered[begin:begin + self.batch_size]
+                    issued.append(batch)
+                    yield [prompts[request['seq']] for request in batch]
+
+        journal = PredictionJournal(output_file, keep_records=False)
+        if journal.completed_ids:
+            print(f"从输出文件恢复 {len(journal.completed_ids)} 条已完成请求: {output_file}")
+
+        try:
+            for responses in self.pipeline.run(prompt_batches(), self._generate):
+                batch = issued.popleft()
+                records = [
+                    {'id': request['id'], 'input': request['input'], 'output': response}
+                    for request, response in zip(batch, responses)
+                ]
+
+                if self.order == 'completion':
+                    journal.append(records)
+                else:
+                    for request, record in zip(batch, records):
+                        buffer[request['seq']] = record
+                    self.stats['peak_buffer'] = max(self.stats['peak_buffer'], len(buffer))
+                    ready = []
+                    while next_seq in buffer:
+                        ready.append(buffer.pop(next_seq))
+                        next_seq += 1
+                    if ready:
+                        journal.append(ready)
+
+                before = self.stats['completed']
+                self.stats['completed'] += len(records)
+                if progress_every and self.stats['completed'] // progress_every > before // progress_every:
+                    elapsed = time.perf_counter() - start
+                    print(
+                        f"已完成 {self.stats['completed']} 条，"
+                        f"{self.stats['completed'] / elapsed:.2f} 条/s"
+                    )
+        finally:
+            journal.close()
+            self.stats['wall'] = time.perf_counter() - start
+
+        return self.stats
+
+    def print_report(self):
+        stats = self.stats
+        wall = stats['wall']
+        print("=" * 60)
+        print("批量推理报告")
+        print("=" * 60)
+        print(f"读取请求: {stats['read']}（跳过已完成 {stats['skipped']}），本次生成: {stats['completed']}")
+        if stats['completed']:
+            print(f"总耗时: {wall:.1f}s，吞吐: {stats['completed'] / wall:.2f} 条/s")
+            self.pipeline.print_timing()
+        if self.order == 'input':
+            print(f"重排缓冲区峰值: {stats['peak_buffer']} 条（窗口 {self.window}）")
+        print("=" * 60)
@@ -0,0 +1,263 @@
+"""
+BERTScore 模块 - 常驻打分模型 + 参考答案 token 向量磁盘缓存（内存映射）+ 按长度分桶批处理
+
+计算方式与 bert_score.score(lang='zh') 默认设置一致：bert-base-chinese 第 8 层输出，
+向量归一化后做贪心匹配，不使用 idf 和 baseline 重标定。[CLS] / [SEP] 与 bert_score 相同：
+参与相似度矩阵（可以作为对方 token 的最佳匹配），但在本侧求平均时权重为 0。
+与 bert_score 的差异只来自批次填充不同带来的浮点误差（scripts/benchmark_metrics.py 对比）。
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from src.segmentation import text_key
+
+
+# bert_score 对中文默认使用的模型和层数
+DEFAULT_MODEL = 'bert-base-chinese'
+DEFAULT_NUM_LAYERS = 8
+
+# 缓存格式版本（向量含 [CLS] / [SEP]，float32），格式变化时旧缓存自动失效
+CACHE_VERSION = 2
+
+
+class EmbeddingCache:
+    """参考答案 token 向量缓存
+
+    每次写入生成一个分片：shard_<时间>_<pid>_<随机串>.npy 为所有文本的向量按行拼接（float32），
+    同名 .json 记录 文本 sha1 -> [起始行, 行数]。读取时以 mmap 方式打开分片，
+    只有真正用到的行才会读入内存。
+
+    多个进程（或线程）可同时读写同一目录：分片名互不冲突，文件先写临时文件再 os.replace，
+    .json 最后出现即说明分片完整；写入前重新扫描目录，别的进程已写入的文本不再重复写。
+    """
+
+    def __init__(self, cache_dir: str, model_key: str):
+        self.dir = os.path.join(cache_dir, 'bertscore', model_key)
+        os.makedirs(self.dir, exist_ok=True)
+        self.index: Dict[str, Tuple[str, int, int]] = {}
+        self.shards: Dict[str, np.ndarray] = {}
+        self.lock = threading.Lock()
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        """打开目录中尚未打开的完整分片"""
+        for name in sorted(os.listdir(self.dir)):
+            if name.startswith('shard_') and name.endswith('.json') and name[:-len('.json')] not in self.shards:
+                self._open_shard(name[:-len('.json')])
+
+    def _open_shard(self, name: str):
+        prefix = os.path.join(self.dir, name)
+        with open(prefix + '.json', 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        self.shards[name] = np.load(prefix + '.npy', mmap_mode='r')
+        for key, (start, length) in entries.items():
+            self.index.setdefault(key, (name, start, length))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        location = self.index.get(key)
+        if location is None:
+            return None
+        name, start, length = location
+        return self.shards[name][start:start + length]
+
+    def add(self, items: Dict[str, np.ndarray]):
+        with self.lock:
+            self._refresh()
+            items = {key: value for key, value in items.items() if key not in self.index}
+            if not items:
+                return
+            name = f"shard_{time.time_ns()}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+            prefix = os.path.join(self.dir, name)
+            entries, start = {}, 0
+            for key, value in items.items():
+                entries[key] = [start, len(value)]
+                start += len(value)
+
+            with open(prefix + '.npy.tmp', 'wb') as f:
+                np.save(f, np.concatenate(list(items.values())).astype(np.float32))
+            os.replace(prefix + '.npy.tmp', prefix + '.npy')
+            with open(prefix + '.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(prefix + '.json.tmp', prefix + '.json')
+            self._open_shard(name)
+
+
+def model_cache_key(model_type: str, num_layers: int) -> str:
+    """缓存目录名：Hub 模型用模型名；本地目录附加绝对路径的哈希，同名的不同本地模型互不共用缓存"""
+    if os.path.isdir(model_type):
+        path = os.path.realpath(model_type)
+        name = f"{os.path.basename(path)}-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]}"
+    else:
+        name = model_type.replace('/', '--')
+    return f"{name}_L{num_layers}_v{CACHE_VERSION}"
+
+
+class BertScorer:
+    """常驻的 BERTScore 打分器
+
+    模型在第一次打分时加载并一直保留；参考答案向量写入 cache_dir，
+    11 组实验评估同一份 test.json 时参考答案只需编码一次（进程内和跨进程都复用）。
+    编码时按 token 长度排序分批，减少填充；num_threads 设置 CPU 编码线程数。
+    """
+
+    def __init__(
+        self,
+        model_type: str = DEFAULT_MODEL,
+        num_layers: int = DEFAULT_NUM_LAYERS,
+        batch_size: int = 64,
+        device: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        cache_dir: Optional[str] = None
+    ):
+        self.model_type = model_type
+        self.num_layers = num_layers
+        self.batch_size = batch_size
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.num_threads = num_threads
+        self.cache = EmbeddingCache(cache_dir, model_cache_key(model_type, num_layers)) if cache_dir else None
+        self.references: Dict[str, np.ndarray] = {}
+        self.model = None
+        self.tokenizer = None
+        self.stats = {'encoded': 0, 'cache_hits': 0}
+
+    def _load(self):
+        if self.model is not None:
+            return
+        from transformers import AutoModel, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_type)
+        model = AutoModel.from_pretrained(self.model_type)
+        # 与 bert_score 相同：只保留前 num_layers 层，取最后一层输出
+        encoder = getattr(model, 'encoder', None)
+        if encoder is not None and hasattr(encoder, 'layer'):
+            encoder.layer = torch.nn.ModuleList(list(encoder.layer)[:self.num_layers])
+        self.model = model.eval().to(self.device)
+
+    def _encode(self, texts: List[str]) -> List[np.ndarray]:
+        """按长度分桶批量编码，返回每个文本（含首尾 [CLS] / [SEP]）的归一化向量 [长度, 维度]"""
+        self._load()
+        max_length = min(self.tokenizer.model_max_length, self.model.config.max_position_embeddings)
+        ids = [
+            self.tokenizer.encode(
+                text.strip(), add_special_tokens=True, truncation=True,
+                max_length=max_length
+            )
+            for text in texts
+        ]
+        order = sorted(range(len(texts)), key=lambda i: len(ids[i]))
+        pad_id = self.tokenizer.pad_token_id or 0
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+
+        previous_threads = torch.get_num_threads()
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        try:
+            for begin in range(0, len(order), self.batch_size):
+                batch = order[begin:begin + self.batch_size]
+                max_len = max(len(ids[i]) for i in batch)
+                input_ids = torch.full((len(batch), max_len), pad_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+                for row, i in enumerate(batch):
+                    input_ids[row, :len(ids[i])] = torch.tensor(ids[i])
+                    attention_mask[row, :len(ids[i])] = 1
+
+                with torch.no_grad():
+                    hidden = self.model(
+                        input_ids=input_ids.to(self.device),
+                        attention_mask=attention_mask.to(self.device),
+                        output_hidden_states=True
+                    ).hidden_states[self.num_layers]
+                hidden = torch.nn.functional.normalize(hidden.float(), dim=-1).cpu().numpy()
+
+                for row, i in enumerate(batch):
+                    results[i] = hidden[row, :len(ids[i])]
+        finally:
+            torch.set_num_threads(previous_threads)
+
+        self.stats['encoded'] += len(texts)
+        return results
+
+    def embed(self, texts: List[str], persist: bool = False) -> List[np.ndarray]:
+        """取文本向量；persist=True（参考答案）时常驻内存并读写磁盘缓存，否则每次现算"""
+        if not persist:
+            unique = list(dict.fromkeys(texts))
+            encoded = dict(zip(unique, self._encode(unique))) if unique else {}
+            return [encoded[text] for text in texts]
+
+        keys = [text_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self.references or key in missing:
+                continue
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                self.references[key] = cached
+                self.stats['cache_hits'] += 1
+            else:
+                missing[key] = text
+
+        if missing:
+            new_items = dict(zip(missing, self._encode(list(missing.values()))))
+            if self.cache is not None:
+                self.cache.add(new_items)
+                # 换成 mmap 视图，不再占用内存
+                new_items = {key: self.cache.get(key) for key in new_items}
+            self.references.update(new_items)
+
+        return [self.references[key] for key in keys]
+
+    def score(self, candidates: List[str], references: List[str]) -> Dict[str, np.ndarray]:
+        """逐样本 precision / recall / f1
+
+        相似度矩阵包含 [CLS] / [SEP]，求平均时只取中间的普通 token（与 bert_score 的 idf 权重一致）；
+        任一侧没有普通 token（空文本）时三项都记为 0。
+        """
+        reference_embeddings = self.embed(references, persist=True)
+        candidate_embeddings = self.embed(candidates)
+
+        precision = np.zeros(len(candidates))
+        recall = np.zeros(len(candidates))
+        for i, (cand, ref) in enumerate(zip(candidate_embeddings, reference_embeddings)):
+            if len(cand) <= 2 or len(ref) <= 2:
+                continue
+            similarity = np.asarray(cand, dtype=np.float32) @ np.asarray(ref, dtype=np.float32).T
+            precision[i] = similarity[1:-1].max(axis=1).mean()
+            recall[i] = similarity[:, 1:-1].max(axis=0).mean()
+        f1 = np.divide(
+            2 * precision * recall, precision + recall,
+            out=np.zeros_like(precision), where=(precision + recall) > 0
+        )
+
+        return {'precision': precision, 'recall': recall, 'f1': f1}
+
+    def print_summary(self):
+        print(f"BERTScore: 编码 {self.stats['encoded']} 条 | 参考向量缓存命中 {self.stats['cache_hits']} 条")
+
+
+class BertScoreMetric:
+    """指标注册表中的 BERTScore（接口见 src.metrics）：在调度器的模型线程中运行，打分器常驻"""
+
+    def __init__(self, **scorer_options):
+        self.scorer = BertScorer(**scorer_options)
+
+    def prepare(self, references: List[str]):
+        # 全部参考答案一次编码（与整批计算时相同），生成期间即可完成
+        self.scorer.embed(references, persist=True)
+
+    def partial(self, batch: Dict) -> Dict[str, np.ndarray]:
+        return self.scorer.score(batch['predictions'], batch['references'])
+
+    def finalize(self, parts: List[Dict[str, np.ndarray]]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        scores = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        self.scorer.print_summary()
+        return {'bert_score': {key: float(values.mean()) for key, values in scores.items()}}, {'bertscore': scores['f1']}
@@ -0,0 +1,160 @@
+"""
+BLEU 模块 - 一次计算出句子级和语料级 BLEU，结果与 NLTK（method1 平滑）一致
+
+词先映射成整数 id；每阶 n-gram 在整批句子上统一编号、计数和截断（clip），
+不再逐句构造 Counter。样本多时分块交给进程池。
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.rouge import TokenInterner
+from src.segmentation import default_workers, process_pool
+
+
+def clipped_counts(
+    codes: np.ndarray,
+    owners: np.ndarray,
+    is_hyp: np.ndarray,
+    size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """整批计算某一阶修正精度的分子（截断后的匹配数）和预测 n-gram 总数
+
+    codes 为该阶所有合法 n-gram 的编号，owners 为所属句对下标，is_hyp 区分预测 / 参考。
+    """
+    num_codes = int(codes.max()) + 1 if len(codes) else 1
+    keys = owners * num_codes + codes
+    hyp_keys, hyp_counts = np.unique(keys[is_hyp], return_counts=True)
+    ref_keys, ref_counts = np.unique(keys[~is_hyp], return_counts=True)
+    totals = np.bincount(owners[is_hyp], minlength=size)
+
+    common, hyp_index, ref_index = np.intersect1d(hyp_keys, ref_keys, assume_unique=True, return_indices=True)
+    clipped = np.minimum(hyp_counts[hyp_index], ref_counts[ref_index])
+    numerators = np.bincount(common // num_codes, weights=clipped, minlength=size)
+    return numerators, totals
+
+
+def count_chunk(pairs: List[Tuple[np.ndarray, np.ndarray]], max_order: int) -> Dict[str, np.ndarray]:
+    """一批句子的 BLEU 充分统计量
+
+    所有预测和参考拼成一个一维数组；n 阶编号由 (n-1 阶编号, 第 n 个词) 组合后重新压缩得到，
+    始终是 int64，不受词表大小限制。起止不在同一句内的窗口被丢弃。
+    """
+    size = len(pairs)
+    sequences = [hyp for hyp, _ in pairs] + [ref for _, ref in pairs]
+    lengths = np.array([len(ids) for ids in sequences], dtype=np.int64)
+    tokens = np.concatenate(sequences) if lengths.sum() else np.zeros(0, dtype=np.int64)
+    sentence = np.repeat(np.arange(2 * size), lengths)
+    base = int(tokens.max()) + 1 if len(tokens) else 1
+
+    numerators = np.zeros((size, max_order))
+    denominators = np.zeros((size, max_order))
+    codes = tokens
+    for n in range(1, max_order + 1):
+        if n > 1:
+            _, codes = np.unique(codes[:-1] * base + tokens[n - 1:], return_inverse=True)
+            codes = codes.reshape(-1)
+        starts = sentence[:len(codes)]
+        valid = starts == sentence[n - 1:]
+        if not valid.any():
+            break
+        owners = starts[valid]
+        numerators[:, n - 1], denominators[:, n - 1] = clipped_counts(
+            codes[valid], owners % size, owners < size, size
+        )
+
+    return {
+        'numerators': numerators,
+        # 与 NLTK 相同：分母至少为 1
+        'denominators': np.maximum(denominators, 1),
+        'hyp_lengths': lengths[:size].astype(np.float64),
+        'ref_lengths': lengths[size:].astype(np.float64),
+    }
+
+
+def brevity_penalty(ref_lengths: np.ndarray, hyp_lengths: np.ndarray) -> np.ndarray:
+    ratio = np.divide(ref_lengths, hyp_lengths, out=np.zeros_like(ref_lengths), where=hyp_lengths > 0)
+    return np.where(hyp_lengths > ref_lengths, 1.0, np.where(hyp_lengths == 0, 0.0, np.exp(1 - ratio)))
+
+
+class NativeBleu:
+    """单参考 BLEU，对应 nltk sentence_bleu / corpus_bleu + SmoothingFunction().method1
+
+    method1：某阶匹配数为 0 时用 epsilon / 总数 代替；没有任何 unigram 匹配时 BLEU 为 0。
+    """
+
+    def __init__(
+        self,
+        weights: Sequence[float] = (0.25, 0.25, 0.25, 0.25),
+        epsilon: float = 0.1,
+        num_workers: Optional[int] = None,
+        min_parallel: int = 2000,
+        chunk_size: int = 1000
+    ):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.epsilon = epsilon
+        self.num_workers = num_workers or default_workers()
+        self.min_parallel = min_parallel
+        self.chunk_size = chunk_size
+
+    def statistics(self, hypotheses: List[List[str]], references: List[List[str]]) -> Dict[str, np.ndarray]:
+        assert len(hypotheses) == len(references)
+        interner = TokenInterner()
+        pairs = [(interner(hyp), interner(ref)) for hyp, ref in zip(hypotheses, references)]
+        max_order = len(self.weights)
+
+        if self.num_workers <= 1 or len(pairs) < self.min_parallel:
+            return count_chunk(pairs, max_order)
+
+        chunks = [pairs[i:i + self.chunk_size] for i in range(0, len(pairs), self.chunk_size)]
+        parts = list(process_pool(self.num_workers).map(count_chunk, chunks, [max_order] * len(chunks)))
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    def _smoothed_precisions(self, numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+        return np.where(numerators == 0, self.epsilon / denominators, numerators / denominators)
+
+    def sentence_scores(self, stats: Dict[str, np.ndarray]) -> np.ndarray:
+        if len(stats['numerators']) == 0:
+            return np.zeros(0)
+        precisions = self._smoothed_precisions(stats['numerators'], stats['denominators'])
+        scores = brevity_penalty(stats['ref_lengths'], stats['hyp_lengths']) * np.exp(
+            (self.weights * np.log(precisions)).sum(axis=1)
+        )
+        return np.where(stats['numerators'][:, 0] == 0, 0.0, scores)
+
+    def corpus_score(self, stats: Dict[str, np.ndarray]) -> float:
+        numerators = stats['numerators'].sum(axis=0)
+        if len(numerators) == 0 or numerators[0] == 0:
+            return 0.0
+        denominators = stats['denominators'].sum(axis=0)
+        precisions = self._smoothed_precisions(numerators, denominators)
+        penalty = brevity_penalty(
+            np.array([stats['ref_lengths'].sum()]), np.array([stats['hyp_lengths'].sum()])
+        )[0]
+        return float(penalty * math.exp(math.fsum(w * math.log(p) for w, p in zip(self.weights, precisions))))
+
+    def score(self, hypotheses: List[List[str]], references: List[List[str]]) -> Tuple[np.ndarray, float]:
+        """返回 (句子级 BLEU 数组, 语料级 BLEU)"""
+        stats = self.statistics(hypotheses, references)
+        return self.sentence_scores(stats), self.corpus_score(stats)
+
+
+class BleuMetric:
+    """指标注册表中的 BLEU（接口见 src.metrics）：分块统计计数，合并后算句子级和语料级分数"""
+
+    def __init__(self):
+        self.bleu = NativeBleu(num_workers=1)
+
+    def partial(self, batch: Dict) -> Dict[str, np.ndarray]:
+        return self.bleu.statistics(batch['prediction_tokens'], batch['reference_tokens'])
+
+    def finalize(self, parts: List[Dict[str, np.ndarray]]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        stats = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        sentence_scores = self.bleu.sentence_scores(stats)
+        fields = {
+            'bleu_score': float(sentence_scores.mean()) if len(sentence_scores) else 0.0,
+            'corpus_bleu': self.bleu.corpus_score(stats),
+        }
+        return fields, {'bleu': sentence_scores}
@@ -0,0 +1,305 @@
+"""
+多轮对话模块 - 保留对话历史和 KV cache，每轮只预填充新增 token；回答在后台线程生成并流式输出
+"""
+
+import time
+from threading import Thread
+from typing import Callable, Dict, List, Optional
+
+import torch
+from transformers import DynamicCache, LogitsProcessor, LogitsProcessorList, TextIteratorStreamer
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """记录第一次采样的时间点（此时预填充刚好完成）"""
+
+    def __init__(self):
+        self.first_token_time = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        return scores
+
+
+class TimedTextStreamer(TextIteratorStreamer):
+    """在生成线程内记录每次产出 token 的时间点
+
+    投机解码一次可能产出多个 token，因此记录 (时间, token 数)。
+    """
+
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True, **kwargs)
+        self.token_times = []
+
+    def put(self, value):
+        if not self.next_tokens_are_prompt:
+            self.token_times.append((time.perf_counter(), value.numel()))
+        super().put(value)
+
+    def latency_stats(self, start: float) -> Dict:
+        """首 token 延迟、逐 token 间隔和解码速度"""
+        if not self.token_times:
+            return {'ttft': 0.0, 'token_intervals': [], 'decode_tokens_per_second': 0.0}
+
+        first_time = self.token_times[0][0]
+        intervals = []
+        previous = first_time
+        for moment, count in self.token_times[1:]:
+            intervals.extend([(moment - previous) / count] * count)
+            previous = moment
+
+        decode_time = previous - first_time
+        return {
+            'ttft': first_time - start,
+            'token_intervals': intervals,
+            'decode_tokens_per_second': len(intervals) / decode_time if decode_time > 0 else 0.0,
+        }
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class ChatSession:
+    """多轮对话会话
+
+    上下文按 token 保存：指令前缀 + 每轮（问题 + 回答）。generate 结束后 KV cache 覆盖了
+    除最后一个生成 token 以外的全部上下文，下一轮把新问题拼在后面继续生成，
+    transformers 只会对缓存之外的 token 做预填充。
+
+    上下文超过 max_context 时按轮次丢弃最早的对话（保留指令前缀），
+    丢弃后位置编码整体变化，KV cache 作废并在下一轮重新预填充。
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        instruction: str = "回答医疗健康问题",
+        max_context: int = 2048,
+        max_new_tokens: int = 256,
+        generate_kwargs: Optional[Dict] = None,
+        draft_model=None
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.instruction = instruction
+        self.max_context = max_context
+        self.max_new_tokens = max_new_tokens
+        self.generate_kwargs = generate_kwargs or {}
+        # assisted generation 不复用外部 KV cache，投机解码时每轮重新预填充完整上下文
+        self.draft_model = draft_model
+
+        self.prefix_ids = self._encode(instruction)
+        # 问答标记单独编码，问题超长截断时保留
+        self.question_marker_ids = self._encode("\n问题：")
+        self.answer_marker_ids = self._encode("\n回答：")
+        min_context = (
+            len(self.prefix_ids) + len(self.question_marker_ids) + len(self.answer_marker_ids) + max_new_tokens
+        )
+        if max_context <= min_context:
+            raise ValueError(
+                f"max_context ({max_context}) 需大于 指令前缀 + 问答标记 + max_new_tokens ({min_context})，"
+                f"否则放不下任何问题内容"
+            )
+        self.reset()
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False)['input_ids']
+
+    def reset(self):
+        """清空对话历史和 KV cache"""
+        self.turns: List[Dict] = []
+        self.cache = None
+        self.cache_length = 0
+
+    def context_ids(self) -> List[int]:
+        ids = list(self.prefix_ids)
+        for turn in self.turns:
+            ids.extend(turn['ids'])
+        return ids
+
+    def _fit_context(self, question_ids: List[int]) -> int:
+        """丢弃最早的轮次直到 上下文 + 新问题 + 生成长度 不超过 max_context，返回丢弃轮数"""
+        budget = self.max_context - self.max_new_tokens - len(question_ids)
+        dropped = 0
+        while self.turns and len(self.context_ids()) > budget:
+            self.turns.pop(0)
+            dropped += 1
+        if dropped:
+            self.cache = None
+            self.cache_length = 0
+        return dropped
+
+    def _generate_in_thread(self, streamer: TimedTextStreamer, **kwargs):
+        """后台线程运行 generate，主线程从 streamer 读取文本"""
+        result = {}
+
+        def target():
+            try:
+                with torch.no_grad():
+                    result['outputs'] = self.model.generate(streamer=streamer, **kwargs)
+            except Exception as e:
+                result['error'] = e
+                streamer.end()
+
+        thread = Thread(target=target, daemon=True)
+        thread.start()
+        return thread, result
+
+    def ask(
+        self,
+        question: str,
+        measure_full_prefill: bool = False,
+        on_text: Optional[Callable[[str], None]] = None
+    ):
+        """生成一轮回答，返回 (回答, 本轮统计)
+
+        on_text: 每解码出一段文本就回调一次，用于流式输出。
+        """
+        question_ids = self._encode(f"\n问题：{question}\n回答：")
+        dropped = self._fit_context(question_ids)
+
+        limit = self.max_context - self.max_new_tokens - len(self.prefix_ids)
+        if len(question_ids) > limit:
+            # 单个问题本身就超长：清空历史，问题内容从左侧截断，前后的问答标记保留
+            self.reset()
+            keep = limit - len(self.question_marker_ids) - len(self.answer_marker_ids)
+            question_ids = self.question_marker_ids + self._encode(question)[-keep:] + self.answer_marker_ids
+
+        input_ids = self.context_ids() + question_ids
+        inputs = torch.tensor([input_ids], device=self.model.device)
+
+        reuse_cache = self.draft_model is None
+        if reuse_cache and self.cache is None:
+            self.cache = DynamicCache()
+            self.cache_length = 0
+        cached = self.cache_length if reuse_cache else 0
+
+        timer = FirstTokenTimer()
+        generate_kwargs = dict(self.generate_kwargs)
+        if reuse_cache:
+            generate_kwargs['past_key_values'] = self.cache
+        else:
+            generate_kwargs['assistant_model'] = self.draft_model
+
+        streamer = TimedTextStreamer(self.tokenizer)
+        start = time.perf_counter()
+        thread, result = self._generate_in_thread(
+            streamer,
+            input_ids=inputs,
+            attention_mask=torch.ones_like(inputs),
+            max_new_tokens=self.max_new_tokens,
+            logits_processor=LogitsProcessorList([timer]),
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            **generate_kwargs
+        )
+        for text in streamer:
+            if on_text is not None:
+                on_text(text)
+        thread.join()
+        total_time = time.perf_counter() - start
+
+        if 'error' in result:
+            # cache 可能已写入一半，作废
+            self.cache = None
+            self.cache_length = 0
+            raise result['error']
+        outputs = result['outputs']
+
+        answer_ids = outputs[0][len(input_ids):].tolist()
+        response = self.tokenizer.decode(answer_ids, skip_special_tokens=True).strip()
+
+        self.turns.append({'question': question, 'response': response, 'ids': question_ids + answer_ids})
+        # 最后一个生成的 token 还没有经过前向，不在 cache 中
+        self.cache_length = len(input_ids) + len(answer_ids) - 1
+
+        stats = {
+            'context_tokens': len(input_ids),
+            'cached_tokens': cached,
+            'prefill_tokens': len(input_ids) - cached,
+            'new_tokens': len(answer_ids),
+            'dropped_turns': dropped,
+            'prefill_time': (timer.first_token_time or start) - start,
+            'total_time': total_time,
+            'tokens_per_second': len(answer_ids) / total_time if total_time > 0 else 0.0,
+        }
+        stats.update(streamer.latency_stats(start))
+
+        if measure_full_prefill and cached > 0:
+            # 对照：不复用 cache 时整段上下文的预填充耗时（同样走 generate，计时口径一致）
+            baseline = FirstTokenTimer()
+            begin = time.perf_counter()
+            with torch.no_grad():
+                self.model.generate(
+                    input_ids=inputs,
+                    attention_mask=torch.ones_like(inputs),
+                    max_new_tokens=1,
+                    logits_processor=LogitsProcessorList([baseline]),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    **self.generate_kwargs
+                )
+            stats['full_prefill_time'] = baseline.first_token_time - begin
+
+        return response or "无法生成回答", stats
+
+
+def format_turn_stats(stats: Dict) -> str:
+    """单轮统计的一行摘要"""
+    line = (
+        f"上下文 {stats['context_tokens']} token（复用缓存 {stats['cached_tokens']}，"
+        f"预填充 {stats['prefill_tokens']}）| 首 token {stats['ttft'] * 1000:.0f}ms | "
+        f"token 间隔 {percentile(stats['token_intervals'], 50) * 1000:.1f}ms | "
+        f"生成 {stats['new_tokens']} token，{stats['total_time']:.1f}s，{stats['tokens_per_second']:.1f} token/s"
+    )
+    if 'full_prefill_time' in stats:
+        saved = stats['full_prefill_time'] - stats['prefill_time']
+        line += f" | 完整预填充 {stats['full_prefill_time'] * 1000:.0f}ms，节省 {saved * 1000:.0f}ms"
+    if stats['dropped_turns']:
+        line += f" | 超出上下文上限，丢弃最早 {stats['dropped_turns']} 轮"
+    return line
+
+
+class ChatStats:
+    """整个会话的流式生成统计（退出时打印）"""
+
+    def __init__(self):
+        self.turns: List[Dict] = []
+
+    def add(self, stats: Dict):
+        self.turns.append(stats)
+
+    def print_summary(self):
+        print("=" * 50)
+        print("📊 会话统计")
+        print("=" * 50)
+        if not self.turns:
+            print("（没有对话）")
+            return
+
+        ttfts = [turn['ttft'] for turn in self.turns]
+        intervals = [value for turn in self.turns for value in turn['token_intervals']]
+        new_tokens = sum(turn['new_tokens'] for turn in self.turns)
+        total_time = sum(turn['total_time'] for turn in self.turns)
+
+        print(f"轮数: {len(self.turns)}，生成 {new_tokens} token，用时 {total_time:.1f}s")
+        print(
+            f"首 token 延迟: 平均 {sum(ttfts) / len(ttfts) * 1000:.0f}ms | "
+            f"P50 {percentile(ttfts, 50) * 1000:.0f}ms | P95 {percentile(ttfts, 95) * 1000:.0f}ms"
+        )
+        print(
+            f"token 间隔: P50 {percentile(intervals, 50) * 1000:.1f}ms | "
+            f"P95 {percentile(intervals, 95) * 1000:.1f}ms | P99 {percentile(intervals, 99) * 1000:.1f}ms"
+        )
+        print(f"平均吞吐: {new_tokens / total_time if total_time > 0 else 0.0:.1f} token/s")
+        print(
+            f"复用缓存: {sum(turn['cached_tokens'] for turn in self.turns)} token，"
+            f"预填充: {sum(turn['prefill_tokens'] for turn in self.turns)} token"
+        )
+        print("=" * 50)
@@ -2,22 +2,59 @@
 评估模块
 """
 
+import time
+import numpy as np
 import torch
 import jieba  # 用于中文分词（ROUGE 计算需要）
 from rouge_chinese import Rouge # 用于计算文本相似度
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from tqdm import tqdm
 
+from src.generation import (
+    AdaptiveBatchSizer,
+    CompiledGeneration,
+    GenerationPipeline,
+    decode_responses,
+    encode_prompts,
+    simulate_memory_limit,
+)
+from src.journal import PredictionJournal
+
 
 class MedicalQAEvaluator:
     """医疗问答评估器"""
     
-    def __init__(self, model, tokenizer, batch_size=16):
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        batch_size=16,
+        adaptive_batch=False,
+        max_batch_size=64,
+        memory_limit_tokens=None,
+        compile_generation=False,
+        compile_cache_dir=None,
+        kv_cache=None
+    ):
         self.model = model
         self.tokenizer = tokenizer
         self.rouge = Rouge()
         self.batch_size = batch_size
         
+        # 自适应批次：以 batch_size 为初始探测值，OOM 时拆分重试
+        self.batch_sizer = AdaptiveBatchSizer(batch_size, max_batch_size) if adaptive_batch else None
+        # 模拟显存上限（token 数），用于在 CPU 上测试 OOM 处理
+        self.memory_limit_tokens = memory_limit_tokens
+        
+        # 编译解码：静态 KV cache + torch.compile，提示长度和批次大小分桶以限制重编译
+        self.compiled_generation = (
+            CompiledGeneration(cache_dir=compile_cache_dir) if compile_generation else None
+        )
+        self.prompt_bucket = self.compiled_generation.bucket_width if compile_generation else None
+        
+        # 量化 KV cache（KVCacheQuantizer），每次 generate 新建一个 cache
+        self.kv_cache = kv_cache
+        
         # 设置 pad_token
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
@@ -35,20 +72,21 @@ class MedicalQAEvaluator:
     ) -> str:
         """生成单个回答"""
         
-        inputs = self.tokenizer(prompt, return_tensors='pt').to(self.model.device)
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors='pt',
+            padding=self.prompt_bucket is not None,
+            pad_to_multiple_of=self.prompt_bucket
+        ).to(self.model.device)
         input_length = inputs['input_ids'].shape[1]
         
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-                do_sample=True,
-                top_p=top_p,
-                temperature=temperature,
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
-            )
+        outputs = self._generate_ids(
+            inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            min_new_tokens=min_new_tokens
+        )
         
         # 只解码生成的新token
         generated_tokens = outputs[0][input_length:]
@@ -68,64 +106,105 @@ class MedicalQAEvaluator:
         
         return response
     
-    def generate_batch(
+    def _generate_ids(
         self,
-        prompts: List[str],
+        inputs,
         max_new_tokens: int = 256,
         temperature: float = 0.7,
         top_p: float = 0.9,
-        min_new_tokens: int = 10  # 强制至少生成10个token
-    ) -> List[str]:
-        """批量生成回答（更快）"""
+        min_new_tokens: int = 10
+    ):
+        """对已编码的批次执行 generate，返回完整 token id"""
         
-        # 批量编码
-        inputs = self.tokenizer(
-            prompts,
-            return_tensors='pt',
-            padding=True,
-            truncation=True,
-            max_length=512
-        ).to(self.model.device)
+        generate_kwargs = dict(
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,  # 强制最小生成长度
+            do_sample=True,
+            top_p=top_p,
+            temperature=temperature,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id
+        )
         
         with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
+            if self.compiled_generation is not None:
+                generate_kwargs.update(self.compiled_generation.generate_kwargs())
+                return self.compiled_generation.generate(
+                    inputs,
+                    lambda batch: self.model.generate(**batch, **generate_kwargs),
+                    max_new_tokens
+                )
+            if self.kv_cache is not None:
+                cache = self.kv_cache.new_cache()
+                outputs = self.model.generate(**inputs, past_key_values=cache, **generate_kwargs)
+                self.kv_cache.record(cache, outputs.shape[0])
+                return outputs
+            return self.model.generate(**inputs, **generate_kwargs)
+    
+    def _make_generate_fn(self, max_new_tokens, temperature, top_p, min_new_tokens):
+        """构造生成函数（按需叠加模拟显存上限和 OOM 拆分重试）"""
+        
+        def generate_fn(inputs):
+            return self._generate_ids(
+                inputs,
                 max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,  # 强制最小生成长度
-                do_sample=True,
-                top_p=top_p,
                 temperature=temperature,
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
+                top_p=top_p,
+                min_new_tokens=min_new_tokens
+            )
+        
+        if self.memory_limit_tokens:
+            generate_fn = simulate_memory_limit(generate_fn, self.memory_limit_tokens, max_new_tokens)
+        
+        if self.batch_sizer is not None:
+            raw_generate_fn = generate_fn
+            generate_fn = lambda inputs: self.batch_sizer.generate(
+                inputs, raw_generate_fn, self.tokenizer.pad_token_id
             )
         
-        # 批量解码
-        responses = []
+        return generate_fn
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        min_new_tokens: int = 10  # 强制至少生成10个token
+    ) -> List[str]:
+        """批量生成回答（更快）"""
+        
+        inputs = encode_prompts(
+            self.tokenizer, prompts, self.model.device, pad_to_multiple_of=self.prompt_bucket
+        )
+        generate_fn = self._make_generate_fn(max_new_tokens, temperature, top_p, min_new_tokens)
+        outputs = generate_fn(inputs)
         # 获取输入序列的总长度（包括padding）
-        input_length = inputs['input_ids'].shape[1]
+        return decode_responses(self.tokenizer, outputs, inputs['input_ids'].shape[1])
+    
+    def generate_batches(
+        self,
+        prompt_batches: Iterable[List[str]],
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        min_new_tokens: int = 10,
+        prefetch: bool = True
+    ) -> Iterator[List[str]]:
+        """流水线批量生成：编码下一批、解码上一批与当前批 generate 重叠
+
+        prefetch=False 时本批生成结束后才取下一批（自适应批次），只有解码与生成重叠。
+        分阶段耗时记录在 self.pipeline.stage_times 中。
+        """
         
-        for i, output in enumerate(outputs):
-            # 只取生成的新token（从输入总长度之后开始）
-            generated_tokens = output[input_length:]
-            response = self.tokenizer.decode(generated_tokens, skip_special_tokens=True)
-            
-            # 清理回答
-            response = response.strip()
-            
-            # 如果回答为空，使用完整解码
-            if not response:
-                response = self.tokenizer.decode(output, skip_special_tokens=True)
-                if "回答：" in response:
-                    # 只在第一个"回答："处分割，避免误分割生成内容中的"回答："
-                    response = response.split("回答：", 1)[-1].strip()
-            
-            # 确保不为空
-            if not response:
-                response = "无法生成回答"
-            
-            responses.append(response)
-        
-        return responses
+        self.pipeline = GenerationPipeline(
+            self.tokenizer, self.model.device, pad_to_multiple_of=self.prompt_bucket
+        )
+        yield from self.pipeline.run(
+            prompt_batches,
+            self._make_generate_fn(max_new_tokens, temperature, top_p, min_new_tokens),
+            prefetch=prefetch
+        )
     
     def calculate_rouge(
         self,
@@ -134,6 +213,16 @@ class MedicalQAEvaluator:
     ) -> Dict:
         """计算 ROUGE 分数"""
         
+        scores, _ = self.calculate_rouge_per_sample(predictions, references)
+        return scores
+    
+    def calculate_rouge_per_sample(
+        self,
+        predictions: List[str],
+        references: List[str]
+    ) -> Tuple[Dict, Dict[str, List[float]]]:
+        """计算 ROUGE 分数及逐样本 F 值（按顺序累加再平均，与 get_scores(avg=True) 相同）"""
+        
         # 确保预测不为空（ROUGE 计算需要）
         safe_predictions = []
         for pred in predictions:
@@ -147,43 +236,124 @@ class MedicalQAEvaluator:
         predictions_seg = [' '.join(jieba.cut(p)) for p in safe_predictions]
         references_seg = [' '.join(jieba.cut(r)) for r in references]
         
-        # 计算 ROUGE
-        scores = self.rouge.get_scores(predictions_seg, references_seg, avg=True)
+        # 计算 ROUGE（逐样本）
+        sample_scores = self.rouge.get_scores(predictions_seg, references_seg)
+        scores = {
+            metric: {
+                stat: sum(item[metric][stat] for item in sample_scores) / len(sample_scores)
+                for stat in stats
+            }
+            for metric, stats in sample_scores[0].items()
+        }
+        per_sample = {metric: [item[metric]['f'] for item in sample_scores] for metric in scores}
         
-        return scores
+        return scores, per_sample
     
-    def evaluate(self, test_data: List[Dict], use_batch=True, max_new_tokens=256) -> Dict:
-        """评估模型"""
+    def evaluate(
+        self,
+        test_data: List[Dict],
+        use_batch=True,
+        max_new_tokens=256,
+        journal_path: Optional[str] = None
+    ) -> Dict:
+        """评估模型
+
+        提供 journal_path 时，每个批次完成后追加写入 JSONL 日志；
+        重新运行时跳过日志中已完成的样本，实现断点续跑。
+        """
+        
+        predictions = [None] * len(test_data)
+        references = [item['output'] for item in test_data]
+        # 每个样本所在批次的生成耗时（秒），从日志恢复的样本为 NaN
+        latencies = np.full(len(test_data), np.nan)
+        
+        journal = PredictionJournal(journal_path) if journal_path else None
+        if journal:
+            for i, item in enumerate(test_data):
+                predictions[i] = journal.get_output(i, item['input'])
+            done_count = sum(1 for pred in predictions if pred is not None)
+            if done_count > 0:
+                print(f"从日志恢复 {done_count}/{len(test_data)} 个已完成样本: {journal_path}")
         
-        predictions = []
-        references = []
+        pending = [i for i, pred in enumerate(predictions) if pred is None]
         
         print("生成回答...")
         
-        if use_batch:
-            # 批量生成（更快）
-            for i in tqdm(range(0, len(test_data), self.batch_size)):
-                batch = test_data[i:i + self.batch_size]
+        try:
+            if use_batch:
+                # 批量生成（流水线：编码下一批、解码上一批与当前批生成重叠）
+                prompts = {
+                    i: f"{test_data[i]['instruction']}\n问题：{test_data[i]['input']}\n回答："
+                    for i in pending
+                }
                 
-                # 准备批量提示
-                prompts = [
-                    f"{item['instruction']}\n问题：{item['input']}\n回答："
-                    for item in batch
-                ]
+                if self.batch_sizer is not None:
+                    # 按长度分桶组批，批次大小随长度自适应
+                    lengths = self.tokenizer(
+                        [prompts[i] for i in pending], truncation=True, max_length=512
+                    )['input_ids']
+                    batch_id_iter = self.batch_sizer.make_batches(
+                        pending, {i: len(ids) for i, ids in zip(pending, lengths)}
+                    )
+                else:
+                    batch_id_iter = (
+                        pending[start:start + self.batch_size]
+                        for start in range(0, len(pending), self.batch_size)
+                    )
                 
-                # 批量生成
-                responses = self.generate_batch(prompts, max_new_tokens=max_new_tokens)
+                # 惰性组批，由流水线预取（自适应批次时等上一批生成完再组批）；记录已发出的批次以便对应结果
+                issued = []
                 
-                predictions.extend(responses)
-                references.extend([item['output'] for item in batch])
-        else:
-            # 单个生成（慢但更稳定）
-            for item in tqdm(test_data):
-                prompt = f"{item['instruction']}\n问题：{item['input']}\n回答："
-                response = self.generate_response(prompt, max_new_tokens=max_new_tokens)
+                def prompt_batches():
+                    for batch_ids in batch_id_iter:
+                        issued.append(batch_ids)
+                        yield [prompts[i] for i in batch_ids]
                 
-                predictions.append(response)
-                references.append(item['output'])
+                progress = tqdm(total=len(pending))
+                responses_iter = self.generate_batches(
+                    prompt_batches(), max_new_tokens=max_new_tokens, prefetch=self.batch_sizer is None
+                )
+                
+                # 流水线下各批次重叠执行，以相邻两批完成的时间间隔作为该批的耗时
+                last_done = time.perf_counter()
+                for k, responses in enumerate(responses_iter):
+                    batch_ids = issued[k]
+                    now = time.perf_counter()
+                    latencies[batch_ids] = now - last_done
+                    last_done = now
+                    for i, response in zip(batch_ids, responses):
+                        predictions[i] = response
+                    
+                    if journal:
+                        journal.append(
+                            {'id': i, 'input': test_data[i]['input'], 'output': predictions[i]}
+                            for i in batch_ids
+                        )
+                    progress.update(len(batch_ids))
+                progress.close()
+                
+                if issued:
+                    self.pipeline.print_timing()
+                    if self.batch_sizer is not None:
+                        self.batch_sizer.print_summary()
+                    if self.compiled_generation is not None:
+                        self.compiled_generation.print_summary()
+                    if self.kv_cache is not None:
+                        self.kv_cache.print_summary()
+            else:
+                # 单个生成（慢但更稳定）
+                for i in tqdm(pending):
+                    item = test_data[i]
+                    prompt = f"{item['instruction']}\n问题：{item['input']}\n回答："
+                    sample_start = time.perf_counter()
+                    predictions[i] = self.generate_response(prompt, max_new_tokens=max_new_tokens)
+                    latencies[i] = time.perf_counter() - sample_start
+                    
+                    if journal:
+                        journal.append([{'id': i, 'input': item['input'], 'output': predictions[i]}])
+        finally:
+            if journal:
+                journal.close()
         
         # 统计空回答（在计算指标之前）
         empty_count = sum(1 for pred in predictions if not pred or pred.strip() == "" or pred == "无法生成回答")
@@ -194,14 +364,16 @@ class MedicalQAEvaluator:
         if empty_count > 0:
             print(f"⚠️  警告: {empty_count}/{len(test_data)} 个样本生成为空")
         
-        rouge_scores = self.calculate_rouge(predictions, references)
+        rouge_scores, per_sample_scores = self.calculate_rouge_per_sample(predictions, references)
         
         results = {
             'rouge_scores': rouge_scores,
             'num_samples': len(test_data),
             'empty_count': empty_count,
             'predictions': predictions,
-            'references': references
+            'references': references,
+            'per_sample_scores': per_sample_scores,
+            'latencies': latencies
         }
         
         return results
@@ -2,22 +2,93 @@
 增强版评估模块 - 支持多种评估指标
 """
 
+import time
+import numpy as np
 import torch
-import jieba
-from rouge_chinese import Rouge
-from typing import List, Dict
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 from tqdm import tqdm
 
+from src.generation import (
+    AdaptiveBatchSizer,
+    CompiledGeneration,
+    GenerationPipeline,
+    decode_responses,
+    encode_prompts,
+    simulate_memory_limit,
+)
+from src.journal import PredictionJournal
+from src.bertscore import DEFAULT_MODEL
+from src.metrics import MetricScheduler
+from src.segmentation import Segmenter
+from src.sequential import SEQUENTIAL_METRICS, SequentialTracker, max_looks
+from src.speculative import SpeculativeStats, assisted_generate
+
 
 class EnhancedMedicalQAEvaluator:
     """增强版医疗问答评估器"""
     
-    def __init__(self, model, tokenizer, batch_size=16):
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        batch_size=16,
+        adaptive_batch=False,
+        max_batch_size=64,
+        memory_limit_tokens=None,
+        draft_model=None,
+        compile_generation=False,
+        compile_cache_dir=None,
+        kv_cache=None,
+        metric_cache_dir=None,
+        metric_workers=None,
+        bertscore_model=DEFAULT_MODEL,
+        bertscore_batch_size=64,
+        bertscore_threads=None,
+        metrics=None
+    ):
         self.model = model
         self.tokenizer = tokenizer
-        self.rouge = Rouge()
         self.batch_size = batch_size
         
+        # 指标共用的分词阶段：参考答案分词结果缓存在 metric_cache_dir，大批量时用进程池并行
+        self.segmenter = Segmenter(metric_cache_dir, metric_workers)
+        # 指标注册表 + 调度器：metrics 为所选指标名（默认全部），按需加载，并发计算
+        # BERTScore 模型常驻，参考答案向量缓存在 metric_cache_dir（多组实验只编码一次）
+        self.metric_scheduler = MetricScheduler(
+            metrics,
+            metric_options={
+                'bertscore': {
+                    'model_type': bertscore_model,
+                    'batch_size': bertscore_batch_size,
+                    'num_threads': bertscore_threads,
+                    'cache_dir': metric_cache_dir
+                }
+            },
+            segmenter=self.segmenter,
+            num_workers=metric_workers
+        )
+        
+        # 自适应批次：以 batch_size 为初始探测值，OOM 时拆分重试
+        self.batch_sizer = AdaptiveBatchSizer(batch_size, max_batch_size) if adaptive_batch else None
+        # 模拟显存上限（token 数），用于在 CPU 上测试 OOM 处理
+        self.memory_limit_tokens = memory_limit_tokens
+        
+        # 编译解码：静态 KV cache + torch.compile，提示长度和批次大小分桶以限制重编译
+        self.compiled_generation = (
+            CompiledGeneration(cache_dir=compile_cache_dir) if compile_generation else None
+        )
+        self.prompt_bucket = self.compiled_generation.bucket_width if compile_generation else None
+        
+        # 量化 KV cache（KVCacheQuantizer），每次 generate 新建一个 cache
+        self.kv_cache = kv_cache
+        
+        # 投机解码：提供草稿模型时改用 assisted generation（逐条生成）
+        self.draft_model = draft_model
+        self.speculative_stats = SpeculativeStats() if draft_model is not None else None
+        
+        # 最近一次生成中每个样本所在批次的耗时（秒），写入逐样本结果存储
+        self.generation_latencies = None
+        
         if self.tokenizer is not None:
             # 设置 pad_token
             if self.tokenizer.pad_token is None:
@@ -36,20 +107,21 @@ class EnhancedMedicalQAEvaluator:
     ) -> str:
         """生成单个回答"""
         
-        inputs = self.tokenizer(prompt, return_tensors='pt').to(self.model.device)
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors='pt',
+            padding=self.prompt_bucket is not None,
+            pad_to_multiple_of=self.prompt_bucket
+        ).to(self.model.device)
         input_length = inputs['input_ids'].shape[1]
         
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                min_new_tokens=min_new_tokens,
-                do_sample=True,
-                top_p=top_p,
-                temperature=temperature,
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
-            )
+        outputs = self._generate_ids(
+            inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            min_new_tokens=min_new_tokens
+        )
         
         # 只解码生成的新token
         generated_tokens = outputs[0][input_length:]
@@ -69,64 +141,120 @@ class EnhancedMedicalQAEvaluator:
         
         return response
     
-    def generate_batch(
+    def _generate_ids(
         self,
-        prompts: List[str],
+        inputs,
         max_new_tokens: int = 256,
         temperature: float = 0.7,
         top_p: float = 0.9,
         min_new_tokens: int = 10
-    ) -> List[str]:
-        """批量生成回答（更快）"""
-        
-        # 批量编码
-        inputs = self.tokenizer(
-            prompts,
-            return_tensors='pt',
-            padding=True,
-            truncation=True,
-            max_length=512
-        ).to(self.model.device)
-        
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
+    ):
+        """对已编码的批次执行 generate，返回完整 token id"""
+        
+        if self.draft_model is not None:
+            return assisted_generate(
+                self.model,
+                self.draft_model,
+                inputs,
+                self.speculative_stats,
+                pad_token_id=self.tokenizer.pad_token_id,
                 max_new_tokens=max_new_tokens,
                 min_new_tokens=min_new_tokens,
                 do_sample=True,
                 top_p=top_p,
                 temperature=temperature,
-                pad_token_id=self.tokenizer.pad_token_id,
                 eos_token_id=self.tokenizer.eos_token_id
             )
         
-        # 批量解码
-        responses = []
-        # 获取输入序列的总长度（包括padding）
-        input_length = inputs['input_ids'].shape[1]
+        generate_kwargs = dict(
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=min_new_tokens,  # 强制最小生成长度
+            do_sample=True,
+            top_p=top_p,
+            temperature=temperature,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id
+        )
         
-        for i, output in enumerate(outputs):
-            # 只取生成的新token（从输入总长度之后开始）
-            generated_tokens = output[input_length:]
-            response = self.tokenizer.decode(generated_tokens, skip_special_tokens=True)
-            
-            # 清理回答
-            response = response.strip()
-            
-            # 如果回答为空，使用完整解码
-            if not response:
-                response = self.tokenizer.decode(output, skip_special_tokens=True)
-                if "回答：" in response:
-                    # 只在第一个"回答："处分割，避免误分割生成内容中的"回答："
-                    response = response.split("回答：", 1)[-1].strip()
-            
-            # 确保不为空
-            if not response:
-                response = "无法生成回答"
-            
-            responses.append(response)
+        with torch.no_grad():
+            if self.compiled_generation is not None:
+                generate_kwargs.update(self.compiled_generation.generate_kwargs())
+                return self.compiled_generation.generate(
+                    inputs,
+                    lambda batch: self.model.generate(**batch, **generate_kwargs),
+                    max_new_tokens
+                )
+            if self.kv_cache is not None:
+                cache = self.kv_cache.new_cache()
+                outputs = self.model.generate(**inputs, past_key_values=cache, **generate_kwargs)
+                self.kv_cache.record(cache, outputs.shape[0])
+                return outputs
+            return self.model.generate(**inputs, **generate_kwargs)
+    
+    def _make_generate_fn(self, max_new_tokens, temperature, top_p, min_new_tokens):
+        """构造生成函数（按需叠加模拟显存上限和 OOM 拆分重试）"""
+        
+        def generate_fn(inputs):
+            return self._generate_ids(
+                inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                min_new_tokens=min_new_tokens
+            )
+        
+        if self.memory_limit_tokens:
+            generate_fn = simulate_memory_limit(generate_fn, self.memory_limit_tokens, max_new_tokens)
         
-        return responses
+        if self.batch_sizer is not None:
+            raw_generate_fn = generate_fn
+            generate_fn = lambda inputs: self.batch_sizer.generate(
+                inputs, raw_generate_fn, self.tokenizer.pad_token_id
+            )
+        
+        return generate_fn
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        min_new_tokens: int = 10  # 强制至少生成10个token
+    ) -> List[str]:
+        """批量生成回答（更快）"""
+        
+        inputs = encode_prompts(
+            self.tokenizer, prompts, self.model.device, pad_to_multiple_of=self.prompt_bucket
+        )
+        generate_fn = self._make_generate_fn(max_new_tokens, temperature, top_p, min_new_tokens)
+        outputs = generate_fn(inputs)
+        # 获取输入序列的总长度（包括padding）
+        return decode_responses(self.tokenizer, outputs, inputs['input_ids'].shape[1])
+    
+    def generate_batches(
+        self,
+        prompt_batches: Iterable[List[str]],
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        min_new_tokens: int = 10,
+        prefetch: bool = True
+    ) -> Iterator[List[str]]:
+        """流水线批量生成：编码下一批、解码上一批与当前批 generate 重叠
+
+        prefetch=False 时本批生成结束后才取下一批（自适应批次），只有解码与生成重叠。
+        分阶段耗时记录在 self.pipeline.stage_times 中。
+        """
+        
+        self.pipeline = GenerationPipeline(
+            self.tokenizer, self.model.device, pad_to_multiple_of=self.prompt_bucket
+        )
+        yield from self.pipeline.run(
+            prompt_batches,
+            self._make_generate_fn(max_new_tokens, temperature, top_p, min_new_tokens),
+            prefetch=prefetch
+        )
     
     def generate_by_vllm(
         self,
@@ -134,6 +262,7 @@ class EnhancedMedicalQAEvaluator:
         dataset_path: str,
         output_path: str,
         lora_path: str = None,
+        journal_path: Optional[str] = None,
     ):
         from src.util import inference_by_vllm
         outputs = inference_by_vllm(
@@ -141,161 +270,438 @@ class EnhancedMedicalQAEvaluator:
             dataset_path=dataset_path,
             output_path=output_path,
             lora_path=lora_path,
+            journal_path=journal_path,
         )
 
         # 只返回 predictions
         return [outputs[str(i)]["output"] for i in range(len(outputs))]
     
-    def calculate_rouge(
+    def calculate_rouge(self, predictions: List[str], references: List[str]) -> Dict:
+        """计算 ROUGE 分数（占位回答按单字“无”计分）"""
+        fields, _ = self.metric_scheduler.compute('rouge', predictions, references)
+        return fields['rouge_scores']
+    
+    def calculate_bleu(self, predictions: List[str], references: List[str]) -> float:
+        """计算 BLEU 分数（句子级 BLEU 的平均，method1 平滑，与 NLTK 一致）"""
+        fields, _ = self.metric_scheduler.compute('bleu', predictions, references)
+        return fields['bleu_score']
+    
+    def calculate_bertscore(self, predictions: List[str], references: List[str]) -> Dict:
+        """计算 BERTScore"""
+        fields, _ = self.metric_scheduler.compute('bertscore', predictions, references)
+        return fields['bert_score']
+    
+    def calculate_length_stats(self, predictions: List[str], references: List[str]) -> Dict:
+        """计算长度统计"""
+        fields, _ = self.metric_scheduler.compute('length', predictions, references)
+        return fields['length_stats']
+    
+    def evaluate(
         self,
-        predictions: List[str],
-        references: List[str]
+        test_data: List[Dict],
+        verbose: bool = True,
+        use_batch: bool = True,
+        max_new_tokens: int = 256,
+        journal_path: Optional[str] = None,
+        stream_metrics: bool = True
     ) -> Dict:
-        """计算 ROUGE 分数"""
-        
-        # 确保预测不为空（ROUGE 计算需要）
-        safe_predictions = []
-        for pred in predictions:
-            # 如果预测为无法生成的占位符，使用单字占位符避免影响分数
-            if pred == "无法生成回答":
-                safe_predictions.append("无")
-            else:
-                safe_predictions.append(pred)
-        
-        # 分词
-        predictions_seg = [' '.join(jieba.cut(p)) for p in safe_predictions]
-        references_seg = [' '.join(jieba.cut(r)) for r in references]
+        """评估模型
+
+        提供 journal_path 时，每个批次完成后追加写入 JSONL 日志；
+        重新运行时跳过日志中已完成的样本，实现断点续跑。
+        stream_metrics=True 时每批生成完成即交给后台累加指标，结果与生成后整批计算相同（BERTScore 浮点差异 < 1e-6）。
+        """
         
-        # 计算 ROUGE
-        scores = self.rouge.get_scores(predictions_seg, references_seg, avg=True)
+        references = [item['output'] for item in test_data]
+        metric_run = self.metric_scheduler.start(references, background=True) if stream_metrics else None
+        
+        predictions = self.generate_predictions(
+            test_data,
+            verbose=verbose,
+            use_batch=use_batch,
+            max_new_tokens=max_new_tokens,
+            journal_path=journal_path,
+            on_batch=self._metric_feeder(metric_run, references) if metric_run else None
+        )
         
-        return scores
+        results = self.evaluate_by_results(test_data, predictions, metric_run=metric_run)
+        results['latencies'] = self.generation_latencies
+        return results
+    
+    @staticmethod
+    def _metric_feeder(metric_run, references: List[str]) -> Callable[[List[int], List[str]], None]:
+        """把一批 (样本下标, 回答) 提交给指标累加"""
+        def feed(ids: List[int], responses: List[str]):
+            metric_run.submit(responses, [references[i] for i in ids], ids)
+        return feed
     
-    def calculate_bleu(
+    def generate_predictions(
         self,
-        predictions: List[str],
-        references: List[str]
-    ) -> float:
-        """计算 BLEU 分数"""
+        test_data: List[Dict],
+        verbose: bool = True,
+        use_batch: bool = True,
+        max_new_tokens: int = 256,
+        journal_path: Optional[str] = None,
+        on_batch: Optional[Callable[[List[int], List[str]], None]] = None
+    ) -> List[str]:
+        """只生成回答，不计算指标（按 test_data 顺序返回）
+
+        on_batch(样本下标, 回答) 在每批完成后调用（从日志恢复的样本最先调用一次），用于边生成边算指标。
+        每个样本所在批次的生成耗时记录在 self.generation_latencies（从日志恢复的样本为 NaN）。
+        """
+        
+        predictions = [None] * len(test_data)
+        latencies = np.full(len(test_data), np.nan)
+        self.generation_latencies = latencies
+        
+        journal = PredictionJournal(journal_path) if journal_path else None
+        if journal:
+            for i, item in enumerate(test_data):
+                predictions[i] = journal.get_output(i, item['input'])
+            done_count = sum(1 for pred in predictions if pred is not None)
+            if verbose and done_count > 0:
+                print(f"从日志恢复 {done_count}/{len(test_data)} 个已完成样本: {journal_path}")
+        
+        pending = [i for i, pred in enumerate(predictions) if pred is None]
+        
+        restored = [i for i, pred in enumerate(predictions) if pred is not None]
+        if on_batch and restored:
+            on_batch(restored, [predictions[i] for i in restored])
+        
+        if verbose:
+            print("生成回答...")
+        
         try:
-            from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-            
-            smooth = SmoothingFunction()
-            bleu_scores = []
-            
-            for pred, ref in zip(predictions, references):
-                pred_tokens = list(jieba.cut(pred))
-                ref_tokens = [list(jieba.cut(ref))]
+            if use_batch:
+                # 批量生成（流水线：编码下一批、解码上一批与当前批生成重叠）
+                prompts = {
+                    i: f"{test_data[i]['instruction']}\n问题：{test_data[i]['input']}\n回答："
+                    for i in pending
+                }
+                
+                if self.batch_sizer is not None:
+                    # 按长度分桶组批，批次大小随长度自适应
+                    lengths = self.tokenizer(
+                        [prompts[i] for i in pending], truncation=True, max_length=512
+                    )['input_ids']
+                    batch_id_iter = self.batch_sizer.make_batches(
+                        pending, {i: len(ids) for i, ids in zip(pending, lengths)}
+                    )
+                else:
+                    batch_id_iter = (
+                        pending[start:start + self.batch_size]
+                        for start in range(0, len(pending), self.batch_size)
+                    )
+                
+                # 惰性组批，由流水线预取（自适应批次时等上一批生成完再组批）；记录已发出的批次以便对应结果
+                issued = []
                 
-                score = sentence_bleu(
-                    ref_tokens, 
-                    pred_tokens,
-                    smoothing_function=smooth.method1
+                def prompt_batches():
+                    for batch_ids in batch_id_iter:
+                        issued.append(batch_ids)
+                        yield [prompts[i] for i in batch_ids]
+                
+                progress = tqdm(total=len(pending), disable=not verbose)
+                responses_iter = self.generate_batches(
+                    prompt_batches(), max_new_tokens=max_new_tokens, prefetch=self.batch_sizer is None
                 )
-                bleu_scores.append(score)
-            
-            return sum(bleu_scores) / len(bleu_scores)
-        except ImportError:
-            print("⚠️  NLTK 未安装，跳过 BLEU 计算")
-            print("   安装命令: pip install nltk")
-            return None
-        except Exception as e:
-            print(f"⚠️  BLEU 计算失败: {e}")
-            return None
+                
+                # 流水线下各批次重叠执行，以相邻两批完成的时间间隔作为该批的耗时
+                last_done = time.perf_counter()
+                for k, responses in enumerate(responses_iter):
+                    batch_ids = issued[k]
+                    now = time.perf_counter()
+                    latencies[batch_ids] = now - last_done
+                    last_done = now
+                    for i, response in zip(batch_ids, responses):
+                        predictions[i] = response
+                    
+                    if journal:
+                        journal.append(
+                            {'id': i, 'input': test_data[i]['input'], 'output': predictions[i]}
+                            for i in batch_ids
+                        )
+                    if on_batch:
+                        on_batch(batch_ids, [predictions[i] for i in batch_ids])
+                    progress.update(len(batch_ids))
+                progress.close()
+                
+                if verbose and issued:
+                    self.pipeline.print_timing()
+                    if self.batch_sizer is not None:
+                        self.batch_sizer.print_summary()
+                    if self.compiled_generation is not None:
+                        self.compiled_generation.print_summary()
+                    if self.kv_cache is not None:
+                        self.kv_cache.print_summary()
+            else:
+                # 单个生成（慢但更稳定）
+                iterator = tqdm(pending) if verbose else pending
+                
+                for i in iterator:
+                    item = test_data[i]
+                    prompt = f"{item['instruction']}\n问题：{item['input']}\n回答："
+                    sample_start = time.perf_counter()
+                    predictions[i] = self.generate_response(prompt, max_new_tokens=max_new_tokens)
+                    latencies[i] = time.perf_counter() - sample_start
+                    
+                    if journal:
+                        journal.append([{'id': i, 'input': item['input'], 'output': predictions[i]}])
+                    if on_batch:
+                        on_batch([i], [predictions[i]])
+        finally:
+            if journal:
+                journal.close()
+        
+        if verbose and self.speculative_stats is not None:
+            self.speculative_stats.print_summary()
+        
+        return predictions
     
-    def calculate_bertscore(
+    def generate_adapter_predictions(
         self,
-        predictions: List[str],
-        references: List[str]
-    ) -> Dict:
-        """计算 BERTScore"""
-        try:
-            from bert_score import score
-            
-            print("  计算 BERTScore (可能需要几分钟)...")
-            
-            # 计算 BERTScore
-            # model_type: 使用中文 BERT 模型
-            P, R, F1 = score(
-                predictions, 
-                references,
-                lang='zh',  # 中文
-                verbose=False,
-                device='cuda' if torch.cuda.is_available() else 'cpu'
+        test_data: List[Dict],
+        adapter_names: List[str],
+        verbose: bool = True,
+        max_new_tokens: int = 256,
+        on_batch: Optional[Callable[[str, List[int], List[str]], None]] = None
+    ) -> Dict[str, List[str]]:
+        """在同一个基础模型上为多个 adapter 生成回答
+
+        所有 (adapter, 样本) 请求交错组成批次，批内每条请求通过 adapter_names 使用各自的 adapter。
+        on_batch(adapter 名, 样本下标, 回答) 在每批完成后按 adapter 分别调用。
+        每条请求所在批次的生成耗时按 adapter 记录在 self.generation_latencies。
+        """
+        
+        requests = [(name, i) for i in range(len(test_data)) for name in adapter_names]
+        predictions = {name: [None] * len(test_data) for name in adapter_names}
+        latencies = {name: np.full(len(test_data), np.nan) for name in adapter_names}
+        self.generation_latencies = latencies
+        
+        batch_list = [
+            requests[start:start + self.batch_size]
+            for start in range(0, len(requests), self.batch_size)
+        ]
+        prompt_batches = (
+            (
+                [
+                    f"{test_data[i]['instruction']}\n问题：{test_data[i]['input']}\n回答："
+                    for _, i in batch
+                ],
+                {'adapter_names': [name for name, _ in batch]}
             )
-            
-            return {
-                'precision': P.mean().item(),
-                'recall': R.mean().item(),
-                'f1': F1.mean().item()
-            }
-        except ImportError:
-            print("⚠️  bert-score 未安装，跳过 BERTScore 计算")
-            print("   安装命令: pip install bert-score")
-            return None
-        except Exception as e:
-            print(f"⚠️  BERTScore 计算失败: {e}")
-            return None
+            for batch in batch_list
+        )
+        
+        if verbose:
+            print(f"生成回答（{len(adapter_names)} 个 adapter × {len(test_data)} 个样本，批内混合）...")
+        
+        start = time.perf_counter()
+        progress = tqdm(total=len(requests), disable=not verbose)
+        responses_iter = self.generate_batches(prompt_batches, max_new_tokens=max_new_tokens)
+        last_done = start
+        for responses, batch in zip(responses_iter, batch_list):
+            now = time.perf_counter()
+            for (name, i), response in zip(batch, responses):
+                predictions[name][i] = response
+                latencies[name][i] = now - last_done
+            last_done = now
+            if on_batch:
+                for name in adapter_names:
+                    ids = [i for batch_name, i in batch if batch_name == name]
+                    if ids:
+                        on_batch(name, ids, [predictions[name][i] for i in ids])
+            progress.update(len(batch))
+        progress.close()
+        elapsed = time.perf_counter() - start
+        
+        if verbose:
+            self.pipeline.print_timing()
+            print(f"多 adapter 生成: {len(requests)} 条请求，{elapsed:.1f}s，{len(requests) / elapsed:.2f} 条/s")
+        
+        return predictions
     
-    def calculate_length_stats(
+    def evaluate_adapters(
         self,
-        predictions: List[str],
-        references: List[str]
-    ) -> Dict:
-        """计算长度统计"""
-        pred_lengths = [len(p) for p in predictions]
-        ref_lengths = [len(r) for r in references]
+        test_data: List[Dict],
+        adapter_names: List[str],
+        verbose: bool = True,
+        max_new_tokens: int = 256,
+        stream_metrics: bool = True
+    ) -> Dict[str, Dict]:
+        """一次生成多个 adapter 的回答，再分别计算指标（stream_metrics=True 时边生成边累加）"""
         
-        return {
-            'avg_pred_length': sum(pred_lengths) / len(pred_lengths),
-            'avg_ref_length': sum(ref_lengths) / len(ref_lengths),
-            'length_ratio': sum(pred_lengths) / sum(ref_lengths)
-        }
+        references = [item['output'] for item in test_data]
+        metric_runs = {
+            name: self.metric_scheduler.start(references, background=True)
+            for name in adapter_names
+        } if stream_metrics else {}
+        feeders = {name: self._metric_feeder(run, references) for name, run in metric_runs.items()}
+        
+        predictions = self.generate_adapter_predictions(
+            test_data,
+            adapter_names,
+            verbose,
+            max_new_tokens,
+            on_batch=(lambda name, ids, responses: feeders[name](ids, responses)) if feeders else None
+        )
+        latencies = self.generation_latencies
+        results = {}
+        for name in adapter_names:
+            results[name] = self.evaluate_by_results(test_data, predictions[name], metric_run=metric_runs.get(name))
+            results[name]['latencies'] = latencies[name]
+        return results
     
-    def evaluate(self, test_data: List[Dict], verbose: bool = True, use_batch: bool = True, max_new_tokens: int = 256) -> Dict:
-        """评估模型"""
-        
-        predictions = []
-        references = []
+    def evaluate_sequential(
+        self,
+        test_data: List[Dict],
+        adapter_names: Optional[List[str]] = None,
+        metric: str = 'rouge-l',
+        chunk_size: int = 500,
+        min_samples: int = 1000,
+        target_half_width: float = 0.005,
+        num_resamples: int = 10000,
+        confidence: float = 0.95,
+        seed: int = 42,
+        max_new_tokens: int = 256,
+        verbose: bool = True
+    ) -> Dict[str, Dict]:
+        """序贯评估：按随机顺序分块生成并评估，置信区间足够窄或模型已能区分时提前停止
+
+        adapter_names 为空时评估当前模型（结果键为 'model'），否则各 adapter 同批生成并两两配对比较。
+        每个结果附带 'sequential'（停止原因、节省的样本数和时间、区间变化）和
+        'sample_indices'（已评估样本在 test_data 中的下标，与 predictions 顺序对应）。
+        """
+        
+        names = list(adapter_names) if adapter_names else ['model']
+        order = np.random.default_rng(seed).permutation(len(test_data))
+        tracker = SequentialTracker(
+            names, target_half_width, min_samples, num_resamples, confidence, seed,
+            max_looks=max_looks(len(test_data), chunk_size, min_samples)
+        )
+        primary = SEQUENTIAL_METRICS[metric]
+        predictions = {name: [] for name in names}
+        latencies = {name: [] for name in names}
+        # 主指标每块的部分结果，结束时直接合并，不再对已评估样本重算
+        primary_parts = {name: [] for name in names}
+        stop_reason = None
         
         if verbose:
-            print("生成回答...")
-        
-        if use_batch:
-            # 批量生成（更快）
-            iterator = range(0, len(test_data), self.batch_size)
-            if verbose:
-                iterator = tqdm(iterator)
+            print(f"序贯评估: 主指标 {metric}，每块 {chunk_size} 条，至少 {min_samples} 条，"
+                  f"目标半宽 {target_half_width}，{confidence:.0%} bootstrap 置信区间")
+            if len(names) > 1:
+                print(f"  差值区间按最多 {tracker.max_looks} 次检查校正为 {tracker.pair_confidence:.2%}")
+        
+        start = time.perf_counter()
+        for begin in range(0, len(order), chunk_size):
+            chunk = [test_data[i] for i in order[begin:begin + chunk_size]]
+            if adapter_names:
+                chunk_predictions = self.generate_adapter_predictions(
+                    chunk, adapter_names, verbose=False, max_new_tokens=max_new_tokens
+                )
+                chunk_latencies = self.generation_latencies
+            else:
+                chunk_predictions = {
+                    'model': self.generate_predictions(chunk, verbose=False, max_new_tokens=max_new_tokens)
+                }
+                chunk_latencies = {'model': self.generation_latencies}
             
-            for i in iterator:
-                batch = test_data[i:i + self.batch_size]
-                
-                # 准备批量提示
-                prompts = [
-                    f"{item['instruction']}\n问题：{item['input']}\n回答："
-                    for item in batch
-                ]
-                
-                # 批量生成
-                responses = self.generate_batch(prompts, max_new_tokens=max_new_tokens)
-                
-                predictions.extend(responses)
-                references.extend([item['output'] for item in batch])
-        else:
-            # 单个生成（慢但更稳定）
-            iterator = tqdm(test_data) if verbose else test_data
+            references = [item['output'] for item in chunk]
+            chunk_scores = {}
+            for name in names:
+                predictions[name].extend(chunk_predictions[name])
+                latencies[name].append(chunk_latencies[name])
+                part = self.metric_scheduler.partial(primary, chunk_predictions[name], references)
+                primary_parts[name].append(part)
+                _, per_sample = self.metric_scheduler.finalize(primary, [part])
+                chunk_scores[name] = per_sample[metric]
             
-            for item in iterator:
-                prompt = f"{item['instruction']}\n问题：{item['input']}\n回答："
-                response = self.generate_response(prompt, max_new_tokens=max_new_tokens)
-                
-                predictions.append(response)
-                references.append(item['output'])
-        
-        return self.evaluate_by_results(test_data, predictions)
+            estimate = tracker.update(chunk_scores)
+            stop_reason = tracker.stop_reason()
+            if verbose:
+                intervals = " | ".join(
+                    f"{name} {item['mean']:.4f}±{item['half_width']:.4f}"
+                    for name, item in estimate['intervals'].items()
+                )
+                print(f"  [{estimate['num_samples']}/{len(test_data)}] {intervals}"
+                      f"（{time.perf_counter() - start:.1f}s）")
+            if stop_reason:
+                break
+        elapsed = time.perf_counter() - start
+        
+        num_samples = tracker.num_samples
+        estimated_full_time = elapsed / max(1, num_samples) * len(test_data)
+        summary = {
+            'metric': metric,
+            'stop_reason': stop_reason or '已评估全部样本',
+            'num_samples': num_samples,
+            'total_samples': len(test_data),
+            'samples_saved': len(test_data) - num_samples,
+            'elapsed': elapsed,
+            'estimated_full_time': estimated_full_time,
+            'time_saved': estimated_full_time - elapsed,
+            'confidence': confidence,
+            'pair_confidence': tracker.pair_confidence,
+            'max_looks': tracker.max_looks,
+            'final': tracker.history[-1] if tracker.history else None,
+            'history': [
+                {
+                    'num_samples': item['num_samples'],
+                    **{name: [interval['mean'], interval['half_width']] for name, interval in item['intervals'].items()}
+                }
+                for item in tracker.history
+            ]
+        }
+        if verbose:
+            self.print_sequential_summary(summary)
+        
+        subset = [test_data[i] for i in order[:num_samples]]
+        results = {}
+        for name in names:
+            results[name] = self.evaluate_by_results(
+                subset, predictions[name],
+                precomputed={primary: self.metric_scheduler.finalize(primary, primary_parts[name])}
+            )
+            results[name]['sequential'] = summary
+            results[name]['sample_indices'] = order[:num_samples].tolist()
+            results[name]['latencies'] = np.concatenate(latencies[name])
+        return results
+    
+    def print_sequential_summary(self, summary: Dict):
+        """打印序贯评估的停止原因、区间和节省量"""
+        
+        print("\n【序贯评估】")
+        print(f"  停止原因: {summary['stop_reason']}")
+        print(
+            f"  已评估 {summary['num_samples']}/{summary['total_samples']} 条，"
+            f"节省 {summary['samples_saved']} 条样本"
+        )
+        print(
+            f"  耗时 {summary['elapsed']:.1f}s，全量预计 {summary['estimated_full_time']:.1f}s，"
+            f"节省约 {summary['time_saved']:.1f}s"
+        )
+        final = summary['final']
+        if final:
+            for name, item in final['intervals'].items():
+                print(f"  {name}: {item['mean']:.4f}  [{item['low']:.4f}, {item['high']:.4f}]")
+            if final['pairs']:
+                print(f"  差值区间置信水平 {summary['pair_confidence']:.2%}（按最多 {summary['max_looks']} 次检查做 Bonferroni 校正）")
+            for pair, item in final['pairs'].items():
+                mark = '✓ 显著' if item['separated'] else '不显著'
+                print(f"  {pair}: 差值 {item['diff']:+.4f}  [{item['low']:+.4f}, {item['high']:+.4f}]  {mark}")
     
-    def evaluate_by_results(self, test_data: List[Dict], predictions: List[str]) -> Dict:
-        """基于已有预测结果进行评估"""
+    def evaluate_by_results(
+        self,
+        test_data: List[Dict],
+        predictions: List[str],
+        metric_run=None,
+        precomputed: Optional[Dict[str, Tuple[Dict, Dict]]] = None
+    ) -> Dict:
+        """基于已有预测结果进行评估
+
+        metric_run 为边生成边累加的指标计算，此时只需等待合并；
+        precomputed 为已算好的指标（指标名 -> (结果字段, 逐样本分数)），不再重算。
+        """
         
         references = [item['output'] for item in test_data]
         
@@ -306,20 +712,19 @@ class EnhancedMedicalQAEvaluator:
         if empty_count > 0:
             print(f"⚠️  警告: {empty_count}/{len(test_data)} 个样本生成为空")
         
-        print("========= calculating ROUGE...")
-        rouge_scores = self.calculate_rouge(predictions, references)
-        print("========= calculating BLEU...")
-        bleu_score = self.calculate_bleu(predictions, references)
-        print("========= calculating BERTScore...")
-        bert_score = self.calculate_bertscore(predictions, references)
-        print("========= calculating Length Stats...")
-        length_stats = self.calculate_length_stats(predictions, references)
+        # 各指标并发计算（n-gram 指标走进程池，BERTScore 在模型线程），结果含逐样本分数和各指标耗时
+        precomputed = precomputed or {}
+        if metric_run is not None:
+            metric_results = metric_run.finish()
+        else:
+            metric_results = self.metric_scheduler.run(predictions, references, skip=tuple(precomputed))
+        for fields, per_sample in precomputed.values():
+            metric_results.update(fields)
+            metric_results['per_sample_scores'].update(per_sample)
+        self.segmenter.print_summary()
         
         results = {
-            'rouge_scores': rouge_scores,
-            'bleu_score': bleu_score,
-            'bert_score': bert_score,
-            'length_stats': length_stats,
+            **metric_results,
             'num_samples': len(test_data),
             'empty_count': empty_count,
             'predictions': predictions,
@@ -338,14 +743,17 @@ class EnhancedMedicalQAEvaluator:
         if results.get('empty_count', 0) > 0:
             print(f"空回答数: {results['empty_count']} ({results['empty_count']/results['num_samples']*100:.1f}%)")
         
-        print("\n【文本重叠度 (ROUGE)】")
-        print(f"  ROUGE-1: {results['rouge_scores']['rouge-1']['f']:.4f}")
-        print(f"  ROUGE-2: {results['rouge_scores']['rouge-2']['f']:.4f}")
-        print(f"  ROUGE-L: {results['rouge_scores']['rouge-l']['f']:.4f}")
+        if results['rouge_scores'] is not None:
+            print("\n【文本重叠度 (ROUGE)】")
+            print(f"  ROUGE-1: {results['rouge_scores']['rouge-1']['f']:.4f}")
+            print(f"  ROUGE-2: {results['rouge_scores']['rouge-2']['f']:.4f}")
+            print(f"  ROUGE-L: {results['rouge_scores']['rouge-l']['f']:.4f}")
         
         if results['bleu_score'] is not None:
             print("\n【N-gram 精确度 (BLEU)】")
             print(f"  BLEU: {results['bleu_score']:.4f}")
+            if results.get('corpus_bleu') is not None:
+                print(f"  Corpus BLEU: {results['corpus_bleu']:.4f}")
         
         if results['bert_score'] is not None:
             print("\n【语义相似度 (BERTScore)】")
@@ -353,10 +761,11 @@ class EnhancedMedicalQAEvaluator:
             print(f"  Recall:    {results['bert_score']['recall']:.4f}")
             print(f"  F1:        {results['bert_score']['f1']:.4f}")
         
-        print("\n【长度统计】")
-        print(f"  平均预测长度: {results['length_stats']['avg_pred_length']:.1f} 字")
-        print(f"  平均参考长度: {results['length_stats']['avg_ref_length']:.1f} 字")
-        print(f"  长度比率: {results['length_stats']['length_ratio']:.2f}")
+        if results['length_stats'] is not None:
+            print("\n【长度统计】")
+            print(f"  平均预测长度: {results['length_stats']['avg_pred_length']:.1f} 字")
+            print(f"  平均参考长度: {results['length_stats']['avg_ref_length']:.1f} 字")
+            print(f"  长度比率: {results['length_stats']['length_ratio']:.2f}")
         
         print("=" * 60)
     
@@ -0,0 +1,398 @@
+"""
+生成流水线模块 - 编码 / 生成 / 解码重叠执行
+"""
+
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import torch
+import torch.nn.functional as F
+import transformers
+from packaging import version
+
+
+def encode_prompts(
+    tokenizer,
+    prompts: List[str],
+    device,
+    max_length: int = 512,
+    pad_to_multiple_of: Optional[int] = None
+):
+    """批量编码提示（左填充 + 截断；pad_to_multiple_of 把长度补齐到桶边界）"""
+    return tokenizer(
+        prompts,
+        return_tensors='pt',
+        padding=True,
+        truncation=True,
+        max_length=max_length,
+        pad_to_multiple_of=pad_to_multiple_of
+    ).to(device)
+
+
+def decode_responses(tokenizer, outputs, input_length: int) -> List[str]:
+    """批量解码生成结果，只对空回答做完整解码兜底"""
+
+    outputs = outputs.cpu()
+    # 只取生成的新token（从输入总长度之后开始）
+    responses = tokenizer.batch_decode(outputs[:, input_length:], skip_special_tokens=True)
+
+    for i, response in enumerate(responses):
+        response = response.strip()
+
+        # 如果回答为空，使用完整解码
+        if not response:
+            response = tokenizer.decode(outputs[i], skip_special_tokens=True)
+            if "回答：" in response:
+                # 只在第一个"回答："处分割，避免误分割生成内容中的"回答："
+                response = response.split("回答：", 1)[-1].strip()
+
+        # 确保不为空
+        if not response:
+            response = "无法生成回答"
+
+        responses[i] = response
+
+    return responses
+
+
+class GenerationPipeline:
+    """生产者/消费者生成流水线
+
+    主线程执行 model.generate 处理第 N 批时，后台线程同时编码第 N+1 批、
+    解码第 N-1 批。编码和解码共用一个工作线程：fast tokenizer 不支持多线程
+    并发调用，而两者都远快于 generate，串行即可被完全掩盖。
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        device,
+        max_length: int = 512,
+        pad_to_multiple_of: Optional[int] = None
+    ):
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_length = max_length
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.stage_times = defaultdict(float)
+        self.generated_tokens = 0
+
+    def _encode(self, batch):
+        start = time.perf_counter()
+        # 批次可以是 (提示列表, 逐行生成参数)，如 {'adapter_names': [...]}；
+        # 逐行参数并入编码结果，OOM 拆分批次时随 input_ids 一起切分
+        prompts, row_kwargs = batch if isinstance(batch, tuple) else (batch, {})
+        inputs = encode_prompts(self.tokenizer, prompts, self.device, self.max_length, self.pad_to_multiple_of)
+        inputs.update(row_kwargs)
+        self.stage_times['tokenize'] += time.perf_counter() - start
+        return inputs
+
+    def _decode(self, outputs, input_length: int) -> List[str]:
+        start = time.perf_counter()
+        self.generated_tokens += int((outputs[:, input_length:] != self.tokenizer.pad_token_id).sum())
+        responses = decode_responses(self.tokenizer, outputs, input_length)
+        self.stage_times['decode'] += time.perf_counter() - start
+        return responses
+
+    def run(
+        self,
+        prompt_batches: Iterable[List[str]],
+        generate_fn: Callable,
+        prefetch: bool = True
+    ) -> Iterator[List[str]]:
+        """按顺序逐批产出回答
+
+        Args:
+            prompt_batches: 提示批次（可以是惰性生成器）；每批为提示列表，
+                或 (提示列表, 逐行生成参数字典) 元组
+            generate_fn: 接收编码结果、返回生成 token id 的函数
+            prefetch: 是否在本批生成前就取出并编码下一批。批次大小依赖本批生成结果时
+                （自适应批次）设为 False：本批 generate 返回后才取下一批，编码不再与生成重叠
+        """
+        wall_start = time.perf_counter()
+        batches = iter(prompt_batches)
+
+        def submit_next():
+            batch = next(batches, None)
+            return worker.submit(self._encode, batch) if batch is not None else None
+
+        try:
+            with ThreadPoolExecutor(max_workers=1) as worker:
+                next_inputs = submit_next()
+                pending_decode = None
+
+                while next_inputs is not None:
+                    inputs = next_inputs.result()
+
+                    # 预取下一批的编码，与本批生成重叠
+                    next_inputs = submit_next() if prefetch else None
+
+                    start = time.perf_counter()
+                    outputs = generate_fn(inputs)
+                    self.stage_times['generate'] += time.perf_counter() - start
+
+                    if not prefetch:
+                        next_inputs = submit_next()
+
+                    if pending_decode is not None:
+                        yield pending_decode.result()
+                    pending_decode = worker.submit(self._decode, outputs, inputs['input_ids'].shape[1])
+
+                if pending_decode is not None:
+                    yield pending_decode.result()
+        finally:
+            self.stage_times['wall'] += time.perf_counter() - wall_start
+
+    def timing_summary(self) -> Dict[str, float]:
+        """各阶段累计耗时（秒）；overlap 为被流水线掩盖的时间"""
+        times = dict(self.stage_times)
+        serial = sum(times.get(k, 0.0) for k in ('tokenize', 'generate', 'decode'))
+        times['overlap'] = max(0.0, serial - times.get('wall', 0.0))
+        return times
+
+    @property
+    def tokens_per_second(self) -> float:
+        """生成阶段吞吐（不含填充 token）"""
+        generate_time = self.stage_times.get('generate', 0.0)
+        return self.generated_tokens / generate_time if generate_time > 0 else 0.0
+
+    def print_timing(self):
+        times = self.timing_summary()
+        print(
+            f"分阶段耗时: 编码 {times.get('tokenize', 0.0):.2f}s | "
+            f"生成 {times.get('generate', 0.0):.2f}s | "
+            f"解码 {times.get('decode', 0.0):.2f}s | "
+            f"总计 {times.get('wall', 0.0):.2f}s "
+            f"(流水线掩盖 {times['overlap']:.2f}s)"
+        )
+        print(f"生成吞吐: {self.generated_tokens} token，{self.tokens_per_second:.1f} token/s")
+
+
+def is_oom_error(error: Exception) -> bool:
+    """判断是否为显存 / 内存分配失败"""
+    if not isinstance(error, RuntimeError):
+        return False
+    message = str(error).lower()
+    return 'out of memory' in message or "can't allocate memory" in message
+
+
+def simulate_memory_limit(generate_fn: Callable, max_tokens: int, max_new_tokens: int) -> Callable:
+    """模拟显存上限（用于在 CPU 上测试自适应批次）
+
+    当 批次大小 × (输入长度 + 最大生成长度) 超过 max_tokens 时抛出 OOM 错误。
+    """
+    def limited(inputs):
+        batch_size, input_length = inputs['input_ids'].shape
+        if batch_size * (input_length + max_new_tokens) > max_tokens:
+            raise RuntimeError(
+                f"CUDA out of memory (simulated): batch={batch_size}, "
+                f"length={input_length}, limit={max_tokens} tokens"
+            )
+        return generate_fn(inputs)
+    return limited
+
+
+class AdaptiveBatchSizer:
+    """按提示长度分桶的自适应批次大小
+
+    每个长度桶记录成功过的最大批次和失败过的最小批次：
+    - 更长的桶里能跑通的批次，在更短的桶里一定也能跑通（安全下界）
+    - 更短的桶里 OOM 的批次，在更长的桶里一定也会 OOM（上界）
+    在上下界之间二分探测；生成时遇到 OOM 就把批次对半拆开重试。
+    """
+
+    def __init__(
+        self,
+        initial_batch_size: int = 16,
+        max_batch_size: int = 64,
+        bucket_width: int = 64
+    ):
+        self.initial_batch_size = initial_batch_size
+        self.max_batch_size = max_batch_size
+        self.bucket_width = bucket_width
+        # 桶 -> [成功的最大批次, 失败的最小批次]
+        self.buckets = {}
+        self.oom_count = 0
+
+    def _bucket(self, length: int) -> int:
+        return length // self.bucket_width
+
+    def _bounds(self, length: int):
+        bucket = self._bucket(length)
+        lower = max((ok for b, (ok, _) in self.buckets.items() if b >= bucket), default=0)
+        upper = min((fail for b, (_, fail) in self.buckets.items() if b <= bucket), default=None)
+        if upper == float('inf'):
+            upper = None
+        return lower, upper
+
+    def size_for(self, length: int) -> int:
+        """给定批内最长提示长度，返回建议批次大小"""
+        lower, upper = self._bounds(length)
+
+        if lower == 0:
+            size = self.initial_batch_size if upper is None else min(self.initial_batch_size, upper // 2)
+        elif upper is None:
+            size = lower * 2
+        elif upper - lower > 1:
+            size = (lower + upper) // 2
+        else:
+            size = lower
+
+        return max(1, min(size, self.max_batch_size))
+
+    def record_success(self, length: int, batch_size: int):
+        state = self.buckets.setdefault(self._bucket(length), [0, float('inf')])
+        state[0] = max(state[0], batch_size)
+
+    def record_failure(self, length: int, batch_size: int):
+        self.oom_count += 1
+        state = self.buckets.setdefault(self._bucket(length), [0, float('inf')])
+        state[1] = min(state[1], batch_size)
+
+    def make_batches(self, ids: List[int], lengths: Dict[int, int]) -> Iterator[List[int]]:
+        """按长度从长到短组批，批次大小随长度桶变化
+
+        从最长的样本开始，先探测最吃显存的情况，后续更短的桶可以直接继承安全下界。
+        惰性产出，取下一批时才按当前的探测结果定批次大小；经 GenerationPipeline 生成时
+        需传 prefetch=False，保证上一批的成功 / OOM 已记录后再组下一批。
+        """
+        order = sorted(ids, key=lambda i: lengths[i], reverse=True)
+        pos = 0
+        while pos < len(order):
+            size = self.size_for(lengths[order[pos]])
+            batch = order[pos:pos + size]
+            pos += len(batch)
+            yield batch
+
+    def generate(self, inputs, generate_fn: Callable, pad_token_id: int):
+        """执行生成；OOM 时对半拆分批次递归重试，结果右侧填充后拼接"""
+        batch_size, input_length = inputs['input_ids'].shape
+
+        try:
+            outputs = generate_fn(inputs)
+        except RuntimeError as e:
+            if not is_oom_error(e) or batch_size == 1:
+                raise
+            outputs = None
+
+        if outputs is not None:
+            self.record_success(input_length, batch_size)
+            return outputs
+
+        # 在 except 块之外重试，确保异常栈引用的中间张量已经释放
+        self.record_failure(input_length, batch_size)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        half = batch_size // 2
+        parts = [
+            self.generate({k: v[:half] for k, v in inputs.items()}, generate_fn, pad_token_id),
+            self.generate({k: v[half:] for k, v in inputs.items()}, generate_fn, pad_token_id),
+        ]
+        max_len = max(part.shape[1] for part in parts)
+        return torch.cat(
+            [F.pad(part, (0, max_len - part.shape[1]), value=pad_token_id) for part in parts],
+            dim=0
+        )
+
+    def print_summary(self):
+        print(f"自适应批次: OOM 拆分 {self.oom_count} 次")
+        for bucket in sorted(self.buckets):
+            ok, fail = self.buckets[bucket]
+            fail_str = '-' if fail == float('inf') else str(int(fail))
+            print(
+                f"  长度 [{bucket * self.bucket_width}, {(bucket + 1) * self.bucket_width}): "
+                f"最大可用批次 {ok}，失败批次 {fail_str}"
+            )
+
+
+# CompileConfig._compile_all_devices 存在且含义不变的 transformers 版本范围 [起, 止)
+COMPILE_ALL_DEVICES_VERSIONS = (version.parse('4.49.0'), version.parse('4.58.0'))
+
+
+def enable_compile_cache(cache_dir: str):
+    """把 inductor 编译产物缓存到磁盘，之后的运行可跳过大部分编译
+
+    需在第一次 torch.compile 之前调用。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = os.path.abspath(cache_dir)
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+
+
+class CompiledGeneration:
+    """torch.compile + 静态 KV cache 解码
+
+    transformers 在 cache_implementation='static' 时预分配 KV cache，并只编译逐 token
+    解码的前向（预填充仍走 eager）。编译结果按 (批次大小, 缓存长度) 特化，为限制重编译，
+    两者都做分桶：
+    - 提示左填充到 bucket_width 的整数倍（编码时传 pad_to_multiple_of），
+      缓存长度 = 填充后长度 + max_new_tokens
+    - 批次补齐到 2 的幂，补齐的行复制第一行，生成后丢弃
+    每个形状桶第一次出现时的耗时计为编译预热。
+    """
+
+    def __init__(self, bucket_width: int = 64, cache_dir: Optional[str] = None):
+        from transformers import CompileConfig
+
+        self.bucket_width = bucket_width
+        if cache_dir:
+            enable_compile_cache(cache_dir)
+
+        self.compile_config = CompileConfig()
+        # transformers 只在 CUDA 上自动编译解码前向，CompileConfig 没有公开的开关让 CPU 也编译；
+        # 已核对过的版本范围内改用内部属性 _compile_all_devices 打开，其余版本不碰私有属性，
+        # CPU 上退化为只用静态 KV cache、不编译
+        if COMPILE_ALL_DEVICES_VERSIONS[0] <= version.parse(transformers.__version__) < COMPILE_ALL_DEVICES_VERSIONS[1]:
+            self.compile_config._compile_all_devices = True
+        else:
+            print(f"⚠️  transformers {transformers.__version__} 下仅在 CUDA 上编译解码，其他设备只使用静态 KV cache")
+
+        self.shapes = set()
+        self.warmup_time = 0.0
+        self.steady_time = 0.0
+
+    def generate_kwargs(self) -> Dict:
+        return {'cache_implementation': 'static', 'compile_config': self.compile_config}
+
+    @staticmethod
+    def _pad_rows(inputs, target: int):
+        """把批次补齐到 target 行（复制第一行）"""
+        extra = target - inputs['input_ids'].shape[0]
+        if extra == 0:
+            return inputs
+        padded = {}
+        for key, value in inputs.items():
+            if isinstance(value, torch.Tensor):
+                padded[key] = torch.cat([value, value[:1].expand(extra, *value.shape[1:])], dim=0)
+            else:
+                padded[key] = list(value) + [value[0]] * extra
+        return padded
+
+    def generate(self, inputs, generate_fn: Callable, max_new_tokens: int):
+        """generate_fn 接收（补齐后的）编码结果，需自行带上 generate_kwargs()"""
+        batch_size, input_length = inputs['input_ids'].shape
+        target = 1 << (batch_size - 1).bit_length()
+        shape = (target, input_length + max_new_tokens)
+
+        start = time.perf_counter()
+        outputs = generate_fn(self._pad_rows(inputs, target))
+        elapsed = time.perf_counter() - start
+
+        if shape in self.shapes:
+            self.steady_time += elapsed
+        else:
+            self.shapes.add(shape)
+            self.warmup_time += elapsed
+        return outputs[:batch_size]
+
+    def print_summary(self):
+        shapes = ', '.join(f"{b}×{length}" for b, length in sorted(self.shapes))
+        print(
+            f"编译解码: {len(self.shapes)} 个形状桶 ({shapes}) | "
+            f"首次编译/预热 {self.warmup_time:.1f}s | 其余生成 {self.steady_time:.1f}s"
+        )
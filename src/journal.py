@@ -0,0 +1,131 @@
+"""
+预测结果日志模块 - 支持断点续跑
+"""
+
+import json
+import os
+import queue
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+
+class PredictionJournal:
+    """JSONL 预测日志
+
+    每完成一个批次就把结果追加写入 JSONL 文件，进程中断后重新运行时
+    读取已完成的 id 并跳过。写盘在后台线程进行，不阻塞生成循环。
+    """
+
+    def __init__(self, journal_path: str, keep_records: bool = True):
+        self.journal_path = journal_path
+        # keep_records=False 时只记录已完成的 id（大规模批量推理时内存不随输出增长）
+        self.keep_records = keep_records
+        self.completed = self.load(journal_path) if keep_records else {}
+        self.completed_ids = set(self.completed) if keep_records else self.load_ids(journal_path)
+
+        dir_name = os.path.dirname(journal_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self._queue = queue.Queue()
+        self._error = None
+        self._file = open(journal_path, 'a', encoding='utf-8')
+        # 上次中断留下的半行需要先换行，避免与新记录粘连
+        if self._file.tell() > 0:
+            with open(journal_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _iter_records(journal_path: str) -> Iterator[Dict]:
+        if not os.path.exists(journal_path):
+            return
+
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程崩溃时最后一行可能只写了一半，直接丢弃
+                    continue
+
+    @classmethod
+    def load(cls, journal_path: str) -> Dict[str, Dict]:
+        """读取已完成的记录（id -> 记录）"""
+        return {str(record['id']): record for record in cls._iter_records(journal_path)}
+
+    @classmethod
+    def load_ids(cls, journal_path: str) -> Set[str]:
+        """只读取已完成的 id"""
+        return {str(record['id']) for record in cls._iter_records(journal_path)}
+
+    def is_done(self, record_id) -> bool:
+        return str(record_id) in self.completed_ids
+
+    def get_output(self, record_id, input_text: Optional[str] = None) -> Optional[str]:
+        """获取已完成的输出；提供 input_text 时校验输入一致（防止测试集变动后错位）"""
+        record = self.completed.get(str(record_id))
+        if record is None:
+            return None
+        if input_text is not None and record.get('input') != input_text:
+            return None
+        return record['output']
+
+    def append(self, records: Iterable[Dict]):
+        """追加一批记录（立即返回，由后台线程写盘）"""
+        if self._error is not None:
+            raise self._error
+
+        records = list(records)
+        for record in records:
+            record['id'] = str(record['id'])
+            self.completed_ids.add(record['id'])
+            if self.keep_records:
+                self.completed[record['id']] = record
+        self._queue.put(records)
+
+    def _writer(self):
+        while True:
+            batches = [self._queue.get()]
+            # 合并队列中积压的批次，一次落盘
+            while batches[-1] is not None:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for records in batches:
+                    if records is None:
+                        continue
+                    for record in records:
+                        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                # 每批落盘一次，保证崩溃时最多丢失当前批次
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                self._error = e
+
+            if batches[-1] is None:
+                break
+
+    def close(self):
+        """等待后台写入完成并关闭文件"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,187 @@
+"""
+量化 KV cache 模块 - 用 int8 / int4 保存 KV cache，支持逐层选择量化位数
+"""
+
+from typing import Dict, List, Optional
+
+import torch
+from transformers.cache_utils import Cache, DynamicLayer, QuantizedLayer
+
+
+KV_CACHE_CHOICES = ['int8', 'int4', 'auto']
+
+
+def quantize_groups(tensor: torch.Tensor, nbits: int, group_size: int) -> Dict:
+    """沿最后一维（head_dim）分组做非对称 min-max 量化
+
+    int4 把相邻两个值打包进一个 uint8。
+    """
+    shape, dtype = tensor.shape, tensor.dtype
+    group_size = min(group_size, shape[-1])
+    groups = tensor.float().reshape(-1, group_size)
+
+    low = groups.amin(dim=-1, keepdim=True)
+    high = groups.amax(dim=-1, keepdim=True)
+    max_q = (1 << nbits) - 1
+    scale = ((high - low) / max_q).clamp(min=1e-8)
+    q = ((groups - low) / scale).round_().clamp_(0, max_q).to(torch.uint8)
+
+    if nbits == 4:
+        q = q.reshape(-1, 2)
+        q = q[:, 0] | (q[:, 1] << 4)
+
+    return {
+        'q': q,
+        'scale': scale.to(dtype),
+        'zero': low.to(dtype),
+        'shape': shape,
+        'group_size': group_size,
+        'nbits': nbits,
+    }
+
+
+def dequantize_groups(packed: Dict) -> torch.Tensor:
+    q = packed['q']
+    if packed['nbits'] == 4:
+        q = torch.stack([q & 0x0F, q >> 4], dim=-1)
+    groups = q.reshape(-1, packed['group_size']).to(packed['scale'].dtype)
+    return (groups * packed['scale'] + packed['zero']).reshape(packed['shape'])
+
+
+def packed_nbytes(packed: Dict) -> int:
+    return sum(packed[k].numel() * packed[k].element_size() for k in ('q', 'scale', 'zero'))
+
+
+class TorchQuantizedLayer(QuantizedLayer):
+    """纯 PyTorch 实现的量化 KV cache 层（不依赖 quanto / hqq）
+
+    沿用 transformers QuantizedLayer 的存储方式：最近 residual_length 个 token 保持原精度，
+    超出后整体量化；注意力计算时临时反量化。
+    """
+
+    def __init__(self, nbits: int = 4, q_group_size: int = 64, residual_length: int = 128):
+        super().__init__(nbits=nbits, q_group_size=q_group_size, residual_length=residual_length)
+
+    def _quantize(self, tensor, axis):
+        return quantize_groups(tensor, self.nbits, self.q_group_size)
+
+    def _dequantize(self, q_tensor):
+        return dequantize_groups(q_tensor)
+
+    def nbytes(self) -> int:
+        if not self.is_initialized:
+            return 0
+        residual = (self.keys.numel() + self.values.numel()) * self.keys.element_size()
+        return packed_nbytes(self._quantized_keys) + packed_nbytes(self._quantized_values) + residual
+
+
+def layer_nbytes(layer) -> int:
+    if isinstance(layer, TorchQuantizedLayer):
+        return layer.nbytes()
+    if not layer.is_initialized:
+        return 0
+    return (layer.keys.numel() + layer.values.numel()) * layer.keys.element_size()
+
+
+def full_precision_nbytes(layer) -> int:
+    """该层以模型原精度保存时的字节数"""
+    if not layer.is_initialized:
+        return 0
+    if isinstance(layer, TorchQuantizedLayer):
+        shape = layer._quantized_keys['shape']
+        tokens = shape[-2] + (layer.keys.shape[-2] if layer.keys.dim() == 4 else 0)
+        return 2 * shape[0] * shape[1] * tokens * shape[-1] * torch.finfo(layer.dtype).bits // 8
+    return layer_nbytes(layer)
+
+
+class KVCacheQuantizer:
+    """为每次 generate 创建量化 KV cache，并统计显存占用
+
+    layer_bits 为每层的量化位数：4 / 8，或 16 表示该层不量化。
+    """
+
+    def __init__(self, layer_bits: List[int], q_group_size: int = 64, residual_length: int = 128):
+        self.layer_bits = layer_bits
+        self.q_group_size = q_group_size
+        self.residual_length = residual_length
+        self.peak_bytes = 0
+        self.peak_full_bytes = 0
+        self.peak_batch_size = 0
+
+    @classmethod
+    def calibrate(
+        cls,
+        model,
+        tokenizer,
+        prompts: List[str],
+        mode: str = 'auto',
+        max_error: float = 0.1,
+        q_group_size: int = 64,
+        residual_length: int = 128
+    ) -> 'KVCacheQuantizer':
+        """确定每层的量化位数
+
+        int8 / int4: 所有层相同；auto: 用校准提示做一次前向，逐层测量 int4 量化 K/V 的
+        相对误差，误差不超过 max_error 的层用 int4，否则用 int8。
+        """
+        num_layers = model.config.get_text_config().num_hidden_layers
+        if mode != 'auto':
+            return cls([8 if mode == 'int8' else 4] * num_layers, q_group_size, residual_length)
+
+        inputs = tokenizer(prompts, return_tensors='pt', padding=True, truncation=True, max_length=512)
+        inputs = inputs.to(model.device)
+        with torch.no_grad():
+            cache = model(**inputs, use_cache=True).past_key_values
+
+        layer_bits = []
+        mask = inputs['attention_mask'].bool()[:, None, :, None]
+        for layer in cache.layers:
+            errors = []
+            for tensor in (layer.keys, layer.values):
+                restored = dequantize_groups(quantize_groups(tensor, 4, q_group_size))
+                diff = (restored.float() - tensor.float()).masked_select(mask)
+                ref = tensor.float().masked_select(mask)
+                errors.append((diff.norm() / ref.norm().clamp(min=1e-8)).item())
+            layer_bits.append(4 if max(errors) <= max_error else 8)
+
+        return cls(layer_bits, q_group_size, residual_length)
+
+    def new_cache(self) -> Cache:
+        """每次 generate 需要一个新的 cache 对象"""
+        layers = [
+            DynamicLayer() if bits >= 16 else TorchQuantizedLayer(bits, self.q_group_size, self.residual_length)
+            for bits in self.layer_bits
+        ]
+        return Cache(layers=layers)
+
+    def record(self, cache: Cache, batch_size: int):
+        """记录一次生成结束时的 KV cache 占用（峰值）"""
+        nbytes = sum(layer_nbytes(layer) for layer in cache.layers)
+        if nbytes > self.peak_bytes:
+            self.peak_bytes = nbytes
+            self.peak_full_bytes = sum(full_precision_nbytes(layer) for layer in cache.layers)
+            self.peak_batch_size = batch_size
+
+    @property
+    def compression(self) -> float:
+        return self.peak_full_bytes / self.peak_bytes if self.peak_bytes else 0.0
+
+    def describe(self) -> str:
+        counts = {bits: self.layer_bits.count(bits) for bits in sorted(set(self.layer_bits))}
+        return ' + '.join(f"{n} 层 {'fp' if bits >= 16 else f'int{bits}'}" for bits, n in counts.items())
+
+    def print_summary(self, budget_bytes: Optional[int] = None):
+        print(f"量化 KV cache: {self.describe()}（分组 {self.q_group_size}，原精度窗口 {self.residual_length}）")
+        if not self.peak_bytes:
+            return
+        print(
+            f"  峰值批次 {self.peak_batch_size}: {self.peak_bytes / 1024 ** 2:.1f} MB"
+            f"（原精度 {self.peak_full_bytes / 1024 ** 2:.1f} MB，压缩 {self.compression:.2f}x）"
+        )
+        if budget_bytes:
+            per_seq = self.peak_bytes / self.peak_batch_size
+            per_seq_full = self.peak_full_bytes / self.peak_batch_size
+            print(
+                f"  KV 预算 {budget_bytes / 1024 ** 3:.1f} GB 可容纳批次: "
+                f"原精度 {int(budget_bytes // per_seq_full)} → 量化 {int(budget_bytes // per_seq)}"
+            )
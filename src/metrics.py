@@ -0,0 +1,433 @@
+"""
+评估指标注册表与调度器
+
+每个指标声明依赖的包、开销类型和是否需要分词，实现类按需延迟导入。
+调度器先做共享分词，再把样本分块：n-gram 指标交给进程池（单核时在主线程计算），
+基于模型的指标放在单独线程，各指标并发执行，最后合并各块结果并报告每个指标的耗时。
+
+指标实现类的接口：
+    partial(batch) -> 部分结果        batch 为一块样本：predictions / references / *_tokens；
+                                      部分结果为数组或数组字典，第一维与样本一一对应
+    finalize(parts) -> (结果字段, {名称: 逐样本分数})
+    prepare(references)              可选，评估开始时对全部参考答案做预处理
+进程池中执行的指标实例必须可以 pickle。基于模型的指标（含 prepare）只在调度器唯一的模型线程中执行。
+"""
+
+import time
+import queue
+import hashlib
+import importlib
+import importlib.util
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.segmentation import Segmenter, default_workers, process_pool
+
+
+class MetricSpec:
+    """注册表中一个指标的声明"""
+
+    def __init__(
+        self,
+        name: str,
+        title: str,
+        loader: str,
+        requires: Tuple[str, ...] = (),
+        cost: str = 'process',
+        needs_tokens: bool = False,
+        streaming: bool = True,
+        fields: Tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.title = title
+        self.loader = loader              # "模块:类名"，调度时才导入
+        self.requires = requires          # 依赖的第三方包
+        self.cost = cost                  # 'process'：CPU 密集；'thread'：基于模型
+        self.needs_tokens = needs_tokens  # 是否使用共享分词结果
+        self.streaming = streaming        # 能否随生成逐批累加（否则在结束时对全部样本一次计算）
+        self.fields = fields              # 写入评估结果的字段（未计算时为 None）
+
+    def missing_requirements(self) -> List[str]:
+        return [package for package in self.requires if importlib.util.find_spec(package) is None]
+
+    def load(self, **options):
+        module_name, class_name = self.loader.split(':')
+        return getattr(importlib.import_module(module_name), class_name)(**options)
+
+
+METRIC_REGISTRY: Dict[str, MetricSpec] = {
+    spec.name: spec
+    for spec in [
+        MetricSpec(
+            'rouge', 'ROUGE', 'src.rouge:RougeMetric',
+            requires=('numpy', 'jieba'), needs_tokens=True, fields=('rouge_scores',)
+        ),
+        MetricSpec(
+            'bleu', 'BLEU', 'src.bleu:BleuMetric',
+            requires=('numpy', 'jieba'), needs_tokens=True, fields=('bleu_score', 'corpus_bleu')
+        ),
+        MetricSpec(
+            'bertscore', 'BERTScore', 'src.bertscore:BertScoreMetric',
+            requires=('torch', 'transformers'), cost='thread', fields=('bert_score',)
+        ),
+        MetricSpec(
+            'length', '长度统计', 'src.metrics:LengthMetric', fields=('length_stats',)
+        ),
+    ]
+}
+
+DEFAULT_METRICS = list(METRIC_REGISTRY)
+
+
+def parse_metric_names(text: str) -> List[str]:
+    """解析 --metrics 参数（逗号分隔）"""
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in names if name not in METRIC_REGISTRY]
+    if unknown:
+        raise ValueError(f"未知指标: {', '.join(unknown)}（可选: {', '.join(METRIC_REGISTRY)}）")
+    return names
+
+
+class LengthMetric:
+    """长度统计（按字符数）"""
+
+    def partial(self, batch: Dict) -> np.ndarray:
+        return np.array(
+            [[len(p), len(r)] for p, r in zip(batch['predictions'], batch['references'])], dtype=np.int64
+        ).reshape(-1, 2)
+
+    def finalize(self, parts: List[np.ndarray]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        lengths = np.concatenate(parts)
+        pred_total, ref_total = (int(total) for total in lengths.sum(axis=0))
+        return {
+            'length_stats': {
+                'avg_pred_length': pred_total / len(lengths),
+                'avg_ref_length': ref_total / len(lengths),
+                'length_ratio': pred_total / ref_total
+            }
+        }, {}
+
+
+def timed_partial(metric, batch: Dict):
+    """在工作进程 / 线程中执行 partial，同时返回耗时"""
+    start = time.perf_counter()
+    result = metric.partial(batch)
+    return result, time.perf_counter() - start
+
+
+def run_inline(metric, batch: Dict) -> Future:
+    """在当前线程计算，包装成已完成的 Future"""
+    future = Future()
+    future.set_result(timed_partial(metric, batch))
+    return future
+
+
+def concat_rows(parts: List):
+    """按样本维拼接部分结果（数组或数组字典）"""
+    if isinstance(parts[0], dict):
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+    return np.concatenate(parts)
+
+
+def take_rows(part, order: np.ndarray):
+    if isinstance(part, dict):
+        return {key: values[order] for key, values in part.items()}
+    return part[order]
+
+
+class MetricRun:
+    """一次评估中的指标计算
+
+    submit 提交一批样本（可带样本下标，顺序任意），finish 等待并合并结果，逐样本分数按下标排序。
+    background=True 时 submit 只入队，分词和 n-gram 指标在后台累加线程中计算，生成循环不被阻塞；
+    BERTScore 每批交给模型线程打分（预测按批编码，填充不同带来的浮点差异 < 1e-6）。
+    不支持流式的指标，以及 prepare=False 时的模型类指标，在 finish 时对全部样本一次计算。
+    """
+
+    def __init__(
+        self,
+        scheduler: 'MetricScheduler',
+        references: Optional[List[str]] = None,
+        background: bool = False,
+        prepare: bool = True,
+        skip: Tuple[str, ...] = ()
+    ):
+        self.scheduler = scheduler
+        self.metrics = {name: metric for name, metric in scheduler.metrics.items() if name not in skip}
+        # 推迟到 finish 的指标：不支持流式的，以及不提前准备时的模型类指标（生成期间不加载模型）
+        self.deferred_names = {
+            name for name in self.metrics
+            if not METRIC_REGISTRY[name].streaming or (not prepare and METRIC_REGISTRY[name].cost == 'thread')
+        }
+        self.start = time.perf_counter()
+        self.pending = {name: [] for name in self.metrics}
+        self.pending_ids = {name: [] for name in self.metrics}
+        self.deferred = []
+        self.compute_time = {name: 0.0 for name in self.metrics}
+        self.segment_time = 0.0
+        self.num_samples = 0
+        self.used_pool = False
+        self.finished_at: Dict[str, float] = {}
+
+        # 提前在模型线程中准备全部参考答案（如 BERTScore 参考向量），与整批计算时的编码方式相同；
+        # 同一组参考答案只准备一次，失败时在 finish 中报告
+        self.prepared = scheduler.prepare(references, list(self.metrics)) if references is not None and prepare else {}
+
+        self.background = background
+        self.queue = queue.Queue() if background else None
+        self.error = None
+        self.worker = None
+        if background:
+            self.worker = threading.Thread(target=self._consume, daemon=True)
+            self.worker.start()
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self._submit(*item)
+            except Exception as e:
+                self.error = e
+
+    def submit(self, predictions: List[str], references: List[str], ids: Optional[List[int]] = None):
+        if ids is None:
+            ids = range(self.num_samples, self.num_samples + len(predictions))
+        self.num_samples += len(predictions)
+        item = (list(predictions), list(references), np.asarray(ids, dtype=np.int64))
+        if self.queue is not None:
+            self.queue.put(item)
+        else:
+            self._submit(*item)
+
+    def _submit(self, predictions: List[str], references: List[str], ids: np.ndarray):
+        scheduler = self.scheduler
+        streaming = {name: metric for name, metric in self.metrics.items() if name not in self.deferred_names}
+        if len(streaming) < len(self.metrics):
+            self.deferred.append((predictions, references, ids))
+        if not streaming:
+            return
+
+        start = time.perf_counter()
+        batch = scheduler.make_batch(
+            predictions, references, any(METRIC_REGISTRY[name].needs_tokens for name in streaming)
+        )
+        self.segment_time += time.perf_counter() - start
+        self._dispatch(streaming, batch, ids)
+
+    def _dispatch(self, metrics: Dict, batch: Dict, ids: np.ndarray):
+        scheduler = self.scheduler
+        use_pool = scheduler.num_workers > 1 and len(ids) >= scheduler.min_parallel
+        size = scheduler.chunk_size if use_pool else max(1, len(ids))
+        self.used_pool = self.used_pool or use_pool
+
+        # 先把模型指标交给模型线程（整块提交，由指标自己按长度分批），
+        # 再在进程池 / 当前线程计算 n-gram 指标，两者重叠
+        for name, metric in metrics.items():
+            if METRIC_REGISTRY[name].cost == 'thread':
+                self._track(name, ids, scheduler.model_thread.submit(timed_partial, metric, batch))
+        for name, metric in metrics.items():
+            if METRIC_REGISTRY[name].cost == 'thread':
+                continue
+            for i in range(0, len(ids), size):
+                chunk = {key: values[i:i + size] for key, values in batch.items()}
+                if use_pool:
+                    future = process_pool(scheduler.num_workers).submit(timed_partial, metric, chunk)
+                else:
+                    future = run_inline(metric, chunk)
+                self._track(name, ids[i:i + size], future)
+
+    def _track(self, name: str, ids: np.ndarray, future: Future):
+        self.pending[name].append(future)
+        self.pending_ids[name].append(ids)
+        future.add_done_callback(lambda _: self._mark_finished(name))
+
+    def _mark_finished(self, name: str):
+        # 记录每个指标最后一块完成的时刻（相对开始）
+        self.finished_at[name] = max(self.finished_at.get(name, 0.0), time.perf_counter() - self.start)
+
+    def _dispatch_deferred(self):
+        """推迟的指标：按下标排好全部样本后一次提交"""
+        metrics = {name: metric for name, metric in self.metrics.items() if name in self.deferred_names}
+        if not metrics or not self.deferred:
+            return
+        ids = np.concatenate([item[2] for item in self.deferred])
+        order = np.argsort(ids, kind='stable')
+        predictions = [text for item in self.deferred for text in item[0]]
+        references = [text for item in self.deferred for text in item[1]]
+        batch = self.scheduler.make_batch(
+            [predictions[k] for k in order],
+            [references[k] for k in order],
+            any(METRIC_REGISTRY[name].needs_tokens for name in metrics)
+        )
+        self._dispatch(metrics, batch, ids[order])
+
+    def finish(self) -> Dict:
+        """等待所有块完成并合并，返回评估结果字段 + per_sample_scores + metric_times"""
+        finish_start = time.perf_counter()
+        if self.worker is not None:
+            self.queue.put(None)
+            self.worker.join()
+            if self.error is not None:
+                raise self.error
+        self._dispatch_deferred()
+
+        results = {field: None for spec in METRIC_REGISTRY.values() for field in spec.fields}
+        per_sample_scores = {}
+        metric_times = {}
+
+        for name, metric in self.metrics.items():
+            try:
+                if name in self.prepared:
+                    self.prepared[name].result()
+                parts = []
+                for future in self.pending[name]:
+                    result, elapsed = future.result()
+                    parts.append(result)
+                    self.compute_time[name] += elapsed
+                if parts:
+                    ids = np.concatenate(self.pending_ids[name])
+                    merged = take_rows(concat_rows(parts), np.argsort(ids, kind='stable'))
+                    fields, per_sample = metric.finalize([merged])
+                    results.update(fields)
+                    per_sample_scores.update(per_sample)
+                metric_times[name] = self.compute_time[name]
+            except Exception as e:
+                print(f"⚠️  {METRIC_REGISTRY[name].title} 计算失败: {e}")
+
+        results['per_sample_scores'] = per_sample_scores
+        results['metric_times'] = metric_times
+        self.print_times(metric_times, time.perf_counter() - finish_start)
+        return results
+
+    def print_times(self, metric_times: Dict[str, float], finish_wait: float):
+        print(f"\n指标耗时（{self.num_samples} 条样本，总计 {time.perf_counter() - self.start:.2f}s）:")
+        if self.background:
+            print(f"  边生成边累加，生成结束后等待 {finish_wait:.2f}s")
+        if self.segment_time:
+            print(f"  {'分词':<12} {self.segment_time:>8.2f}s")
+        for name in self.metrics:
+            if name not in metric_times:
+                continue
+            if METRIC_REGISTRY[name].cost == 'thread':
+                where = '模型线程'
+            else:
+                where = '进程池' if self.used_pool else ('累加线程' if self.background else '主线程')
+            print(
+                f"  {METRIC_REGISTRY[name].title:<12} {self.compute_time[name]:>8.2f}s"
+                f" | 完成于 {self.finished_at.get(name, 0.0):.2f}s | {where}"
+            )
+
+
+class MetricScheduler:
+    """按注册表加载所选指标并并发计算
+
+    缺少依赖的指标在构造时跳过并给出提示；同一调度器可多次 run（模型类指标保持常驻）。
+    基于模型的指标只在调度器唯一的模型线程中执行，多个并发的 MetricRun 不会同时加载或调用模型。
+    """
+
+    def __init__(
+        self,
+        names: Optional[List[str]] = None,
+        metric_options: Optional[Dict[str, Dict]] = None,
+        segmenter: Optional[Segmenter] = None,
+        num_workers: Optional[int] = None,
+        min_parallel: int = 2000,
+        chunk_size: int = 500
+    ):
+        self.metric_options = metric_options or {}
+        self.segmenter = segmenter or Segmenter(num_workers=num_workers)
+        self.num_workers = num_workers or default_workers()
+        self.min_parallel = min_parallel
+        self.chunk_size = chunk_size
+        self.metrics = {}
+        for name in names or DEFAULT_METRICS:
+            spec = METRIC_REGISTRY[name]
+            missing = spec.missing_requirements()
+            if missing:
+                print(f"⚠️  {spec.title} 缺少依赖 {', '.join(missing)}，跳过")
+                continue
+            self.metrics[name] = spec.load(**self.metric_options.get(name, {}))
+
+        self.model_thread = ThreadPoolExecutor(max_workers=1) if any(
+            METRIC_REGISTRY[name].cost == 'thread' for name in self.metrics
+        ) else None
+        self.prepared: Dict[Tuple[str, str], Future] = {}
+        self.prepare_lock = threading.Lock()
+        # 未选中、但被 compute 单独用到的指标（如序贯评估的主指标），加载一次后复用
+        self.extra_metrics = {}
+
+    def prepare(self, references: List[str], names: Optional[List[str]] = None) -> Dict[str, Future]:
+        """在模型线程中预处理参考答案（指标名 -> Future）；同一组参考答案只提交一次，失败后可重新提交"""
+        if self.model_thread is None:
+            return {}
+        digest = hashlib.sha1('\x00'.join(references).encode('utf-8')).hexdigest()
+        futures = {}
+        with self.prepare_lock:
+            for name, metric in self.metrics.items():
+                if not hasattr(metric, 'prepare') or (names is not None and name not in names):
+                    continue
+                future = self.prepared.get((name, digest))
+                if future is None or (future.done() and future.exception() is not None):
+                    future = self.model_thread.submit(metric.prepare, references)
+                    self.prepared[(name, digest)] = future
+                futures[name] = future
+        return futures
+
+    def make_batch(self, predictions: List[str], references: List[str], needs_tokens: bool) -> Dict:
+        """一块样本；需要时附上共享分词结果（参考答案走磁盘缓存）"""
+        batch = {'predictions': predictions, 'references': references}
+        if needs_tokens:
+            batch['prediction_tokens'] = self.segmenter.segment(predictions)
+            batch['reference_tokens'] = self.segmenter.segment(references, persist=True)
+        return batch
+
+    def get_metric(self, name: str):
+        """已选中的指标实例；未选中的指标第一次用到时加载，之后复用"""
+        if name in self.metrics:
+            return self.metrics[name]
+        if name not in self.extra_metrics:
+            self.extra_metrics[name] = METRIC_REGISTRY[name].load(**self.metric_options.get(name, {}))
+        return self.extra_metrics[name]
+
+    def partial(self, name: str, predictions: List[str], references: List[str]):
+        """不经并发调度，计算单个指标的部分结果（模型类指标在模型线程中执行）"""
+        spec = METRIC_REGISTRY[name]
+        metric = self.get_metric(name)
+        batch = self.make_batch(predictions, references, spec.needs_tokens)
+        if spec.cost == 'thread' and self.model_thread is not None:
+            return self.model_thread.submit(metric.partial, batch).result()
+        return metric.partial(batch)
+
+    def finalize(self, name: str, parts: List) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """合并 partial 的结果（按样本顺序），返回 (结果字段, 逐样本分数)"""
+        return self.get_metric(name).finalize([concat_rows(parts)])
+
+    def compute(self, name: str, predictions: List[str], references: List[str]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """不经并发调度，直接计算单个指标"""
+        return self.finalize(name, [self.partial(name, predictions, references)])
+
+    def start(
+        self,
+        references: Optional[List[str]] = None,
+        background: bool = False,
+        prepare: bool = True,
+        skip: Tuple[str, ...] = ()
+    ) -> MetricRun:
+        """开始一次评估；边生成边累加时传入全部参考答案并设置 background=True
+
+        prepare=False 时不提前预处理参考答案（模型类指标推迟到 finish 时才加载模型）；
+        skip 中的指标本次不计算（调用方已有结果）。
+        """
+        return MetricRun(self, references, background, prepare, tuple(skip))
+
+    def run(self, predictions: List[str], references: List[str], skip: Tuple[str, ...] = ()) -> Dict:
+        metric_run = self.start(skip=skip)
+        metric_run.submit(predictions, references)
+        return metric_run.finish()
@@ -2,6 +2,9 @@
 模型加载和配置模块
 """
 
+import os
+import json
+import time
 import torch
 from transformers import (
     AutoTokenizer,
@@ -11,6 +14,8 @@ from transformers import (
 from peft import LoraConfig, get_peft_model, TaskType, PeftModel
 from typing import Dict, Optional, Tuple
 
+from src.speculative import build_layer_skip_draft
+
 
 def load_fixed_tokenizer(tokenizer_name_or_path: str):
     """加载分词器"""
@@ -63,6 +68,63 @@ def load_base_model(
     return model, tokenizer
 
 
+DTYPE_CHOICES = ['auto', 'float16', 'bfloat16', 'float32']
+QUANTIZE_CHOICES = ['int8']
+
+
+def cpu_supports_bf16() -> bool:
+    """CPU 是否有原生 bf16 指令（AVX512-BF16 / AMX）；没有时 bf16 矩阵乘反而比 fp32 慢"""
+    try:
+        return torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported()
+    except AttributeError:
+        return False
+
+
+def select_inference_dtype(dtype: str = 'auto') -> torch.dtype:
+    """选择推理精度
+
+    auto: GPU 用 float16；CPU 支持原生 bf16 时用 bfloat16，否则用 float32
+    （CPU 上的 float16 矩阵乘没有硬件加速，比 float32 慢一个数量级）。
+    """
+    if dtype and dtype != 'auto':
+        return getattr(torch, dtype)
+    if torch.cuda.is_available():
+        return torch.float16
+    return torch.bfloat16 if cpu_supports_bf16() else torch.float32
+
+
+def configure_cpu_threads(num_threads: Optional[int] = None) -> int:
+    """设置 PyTorch 计算线程数（默认保持 PyTorch 自己的设置），返回实际线程数"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
+def inference_load_kwargs(dtype: str = 'auto') -> Dict:
+    """推理用 from_pretrained 参数"""
+    return {
+        'trust_remote_code': True,
+        'device_map': 'auto' if torch.cuda.is_available() else 'cpu',
+        'torch_dtype': select_inference_dtype(dtype),
+        # 直接 mmap safetensors 权重，不先构造一份随机初始化的模型
+        'low_cpu_mem_usage': True,
+    }
+
+
+def quantize_dynamic_int8(model):
+    """对全部 Linear 层做 int8 动态量化（仅 CPU 推理）
+
+    权重离线量化为 int8，激活在每次前向时动态量化，不需要校准数据。
+    LoRA 模型先合并 adapter，否则 LoRA 旁路会被单独量化，无法与原权重合并。
+    """
+    from torch.ao.quantization import quantize_dynamic
+    
+    if isinstance(model, PeftModel):
+        model = model.merge_and_unload()
+    model = model.to(device='cpu', dtype=torch.float32)
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
 def setup_lora(model, lora_config: Dict):
     """配置 LoRA"""
     
@@ -83,31 +145,147 @@ def setup_lora(model, lora_config: Dict):
     return model
 
 
+def is_full_model_dir(model_path: str) -> bool:
+    """判断本地路径是否为完整（或已合并）的模型，而不是 LoRA adapter"""
+    return (
+        os.path.exists(os.path.join(model_path, 'config.json'))
+        and not os.path.exists(os.path.join(model_path, 'adapter_config.json'))
+    )
+
+
 def load_trained_model(
     model_path: str,
-    base_model_path: Optional[str] = None
+    base_model_path: Optional[str] = None,
+    dtype: str = 'auto',
+    num_threads: Optional[int] = None,
+    quantize: Optional[str] = None
 ) -> Tuple:
-    """加载训练好的模型"""
+    """加载训练好的模型
+
+    如果 model_path 是 merge_and_export 导出的合并模型，则忽略 base_model_path 直接加载，
+    避免重复加载基础模型以及 PeftModel 的额外 adapter 计算。
+    dtype 见 select_inference_dtype；num_threads 为 CPU 推理线程数；
+    quantize='int8' 时在 CPU 上以 float32 加载后做 int8 动态量化（忽略 dtype）。
+    """
+    
+    threads = configure_cpu_threads(num_threads)
+    if quantize:
+        assert quantize in QUANTIZE_CHOICES, f"不支持的量化方式: {quantize}"
+        load_kwargs = dict(inference_load_kwargs('float32'), device_map='cpu')
+    else:
+        load_kwargs = inference_load_kwargs(dtype)
+    start = time.perf_counter()
+    
+    if base_model_path and is_full_model_dir(model_path):
+        print(f"   {model_path} 不是 LoRA adapter，按完整模型直接加载")
+        base_model_path = None
     
     if base_model_path:
         # 加载 LoRA 模型
         tokenizer = load_fixed_tokenizer(base_model_path)
-        base_model = AutoModelForCausalLM.from_pretrained(
-            base_model_path,
-            trust_remote_code=True,
-            device_map='auto',
-            torch_dtype=torch.float16
-        )
+        base_model = AutoModelForCausalLM.from_pretrained(base_model_path, **load_kwargs)
         model = PeftModel.from_pretrained(base_model, model_path)
     else:
         # 加载完整模型
         tokenizer = load_fixed_tokenizer(model_path)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            device_map='auto',
-            torch_dtype=torch.float16
-        )
+        model = AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs)
+    
+    if quantize:
+        model = quantize_dynamic_int8(model)
     
     model.eval()
-    return model, tokenizer
\ No newline at end of file
+    precision = quantize or str(model.dtype).replace('torch.', '')
+    print(
+        f"   加载耗时 {time.perf_counter() - start:.1f}s | {precision} | "
+        f"{model.device}" + (f" | {threads} 线程" if model.device.type == 'cpu' else "")
+    )
+    return model, tokenizer
+
+
+def load_multi_adapter_model(
+    adapter_paths: Dict[str, str],
+    base_model_path: str,
+    dtype: str = 'auto',
+    num_threads: Optional[int] = None
+) -> Tuple:
+    """在同一个基础模型上加载多个 LoRA adapter
+
+    生成时通过 adapter_names=[...] 为批内每条请求指定 adapter（'__base__' 表示不使用 adapter），
+    对比多个实验时只需加载一次基础模型。
+    """
+    
+    configure_cpu_threads(num_threads)
+    tokenizer = load_fixed_tokenizer(base_model_path)
+    base_model = AutoModelForCausalLM.from_pretrained(base_model_path, **inference_load_kwargs(dtype))
+    
+    model = None
+    for name, path in adapter_paths.items():
+        if model is None:
+            model = PeftModel.from_pretrained(base_model, path, adapter_name=name)
+        else:
+            model.load_adapter(path, adapter_name=name)
+    
+    model.eval()
+    return model, tokenizer
+
+
+def merge_and_export(
+    model_path: str,
+    base_model_path: str,
+    output_dir: str,
+    max_shard_size: str = '2GB'
+) -> str:
+    """把 LoRA adapter 合并进基础模型权重并导出
+
+    导出分片 safetensors 和修复后的分词器，之后可以直接用 load_trained_model(output_dir) 加载。
+    合并在 CPU 上进行，不需要 GPU。
+    """
+    
+    tokenizer = load_fixed_tokenizer(base_model_path)
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_path,
+        trust_remote_code=True,
+        torch_dtype=torch.float16,
+        low_cpu_mem_usage=True
+    )
+    model = PeftModel.from_pretrained(base_model, model_path)
+    model = model.merge_and_unload()
+    
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(output_dir)
+    
+    # 记录合并来源，便于追溯
+    with open(os.path.join(output_dir, 'merge_info.json'), 'w', encoding='utf-8') as f:
+        json.dump(
+            {'adapter_path': model_path, 'base_model_path': base_model_path},
+            f,
+            ensure_ascii=False,
+            indent=2
+        )
+    
+    return output_dir
+
+
+def load_draft_model(
+    model,
+    draft_model_path: Optional[str] = None,
+    draft_num_layers: Optional[int] = None
+):
+    """加载投机解码用的草稿模型
+
+    - draft_model_path: 独立的小模型（需与目标模型共用词表，如 Qwen2.5-0.5B-Instruct）
+    - draft_num_layers: 直接截取目标模型的前 N 层作为草稿（共享权重，不额外占显存）
+    """
+    
+    if draft_model_path:
+        # 草稿模型与目标模型保持相同精度
+        draft_kwargs = dict(inference_load_kwargs(), torch_dtype=model.dtype)
+        draft_model = AutoModelForCausalLM.from_pretrained(draft_model_path, **draft_kwargs)
+        draft_model.eval()
+        return draft_model
+    
+    if draft_num_layers:
+        return build_layer_skip_draft(model, draft_num_layers)
+    
+    return None
@@ -0,0 +1,170 @@
+"""
+ROUGE 模块 - 与 rouge_chinese 结果一致的 ROUGE-1 / 2 / L 实现，返回逐样本分数
+
+词先映射成整数 id；ROUGE-N 用 NumPy 对 n-gram 编码去重求交集，ROUGE-L 用位并行 LCS
+（每个预测词只做几次大整数运算），样本多时分块交给进程池。
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.segmentation import default_workers, process_pool
+
+
+ROUGE_METRICS = ['rouge-1', 'rouge-2', 'rouge-l']
+ROUGE_STATS = ['r', 'p', 'f']
+
+
+def split_sentences(text: str) -> List[str]:
+    """与 rouge_chinese.Rouge.cut_sent 相同的分句规则"""
+    text = re.sub('([。！？\\?])([^”’])', r"\1\n\2", text)
+    text = re.sub('(\\.{6})([^”’])', r"\1\n\2", text)
+    text = re.sub('(\\…{2})([^”’])', r"\1\n\2", text)
+    text = re.sub('([。！？\\?][”’])([^，。！？\\?])', r'\1\n\2', text)
+    return text.rstrip().split("\n")
+
+
+def split_words(text: str) -> List[str]:
+    """复现 rouge_chinese 的取词方式（分句 → 空白归一化 → 按空格切分后拼接）"""
+    words = []
+    for sentence in split_sentences(text):
+        if len(sentence) > 0:
+            words.extend(" ".join(sentence.split()).split(" "))
+    return words
+
+
+class TokenInterner:
+    """词 → 整数 id"""
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+
+    def __call__(self, words: List[str]) -> np.ndarray:
+        vocab = self.vocab
+        return np.fromiter((vocab.setdefault(w, len(vocab)) for w in words), dtype=np.int64, count=len(words))
+
+    def __len__(self):
+        return len(self.vocab)
+
+
+def unique_ngrams(ids: np.ndarray, n: int, base: int) -> np.ndarray:
+    """n-gram 编码为单个 int64（id 按 base 进制拼接）后去重"""
+    if len(ids) < n:
+        return ids[:0]
+    keys = ids[:len(ids) - n + 1].copy()
+    for k in range(1, n):
+        keys = keys * base + ids[k:len(ids) - n + 1 + k]
+    return np.unique(keys)
+
+
+def lcs_length(x: np.ndarray, y: np.ndarray) -> int:
+    """位并行 LCS 长度（Allison-Dix / Hyyrö），O(len(y)) 次大整数运算"""
+    if len(x) == 0 or len(y) == 0:
+        return 0
+    masks: Dict[int, int] = {}
+    for i, token in enumerate(x.tolist()):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(x)) - 1
+    v = full
+    for token in y.tolist():
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(x) - bin(v).count('1')
+
+
+def f_score(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    # 与 rouge_chinese 相同的平滑项
+    return 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+
+
+def safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def score_chunk(pairs: List[Tuple[np.ndarray, np.ndarray]], base: int) -> np.ndarray:
+    """计算一批 (预测 id, 参考 id) 的 ROUGE，返回 [样本, 指标, (r, p, f)]"""
+    counts = np.zeros((len(pairs), 3, 3), dtype=np.float64)   # [样本, 指标, (预测数, 参考数, 重叠数)]
+    for i, (hyp, ref) in enumerate(pairs):
+        for j, n in enumerate((1, 2)):
+            hyp_ngrams = unique_ngrams(hyp, n, base)
+            ref_ngrams = unique_ngrams(ref, n, base)
+            overlap = len(np.intersect1d(hyp_ngrams, ref_ngrams, assume_unique=True))
+            counts[i, j] = (len(hyp_ngrams), len(ref_ngrams), overlap)
+        counts[i, 2] = (len(hyp), len(ref), lcs_length(ref, hyp))
+
+    scores = np.empty_like(counts)
+    for j in range(3):
+        precision = safe_divide(counts[:, j, 2], counts[:, j, 0])
+        recall = safe_divide(counts[:, j, 2], counts[:, j, 1])
+        scores[:, j] = np.stack([recall, precision, f_score(precision, recall)], axis=1)
+    return scores
+
+
+class NativeRouge:
+    """ROUGE-1 / 2 / L（对应 rouge_chinese.Rouge() 默认设置：exclusive=True、summary-level LCS）
+
+    输入与 rouge_chinese 相同：空格分隔的分词文本。预测或参考没有任何词时该样本记 0 分
+    （rouge_chinese 会直接抛异常）。
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, min_parallel: int = 2000, chunk_size: int = 500):
+        self.num_workers = num_workers or default_workers()
+        self.min_parallel = min_parallel
+        self.chunk_size = chunk_size
+
+    def score_matrix(self, hyps: List[str], refs: List[str]) -> np.ndarray:
+        """逐样本分数 [样本, 指标, (r, p, f)]"""
+        assert len(hyps) == len(refs)
+        interner = TokenInterner()
+        pairs = [(interner(split_words(hyp)), interner(split_words(ref))) for hyp, ref in zip(hyps, refs)]
+        base = max(1, len(interner))
+
+        if self.num_workers <= 1 or len(pairs) < self.min_parallel:
+            return score_chunk(pairs, base) if pairs else np.zeros((0, 3, 3))
+
+        chunks = [pairs[i:i + self.chunk_size] for i in range(0, len(pairs), self.chunk_size)]
+        pool = process_pool(self.num_workers)
+        return np.concatenate(list(pool.map(score_chunk, chunks, [base] * len(chunks))))
+
+    @staticmethod
+    def summarize(matrix: np.ndarray) -> Tuple[Dict, Dict]:
+        """逐样本分数矩阵 → (平均分数, 逐样本分数)
+
+        平均分数格式与 rouge_chinese get_scores(avg=True) 相同；
+        逐样本分数为 {指标: {统计量: np.ndarray}}。
+        """
+        per_sample = {
+            metric: {stat: matrix[:, j, k] for k, stat in enumerate(ROUGE_STATS)}
+            for j, metric in enumerate(ROUGE_METRICS)
+        }
+        averages = {
+            metric: {stat: float(values.mean()) if len(values) else 0.0 for stat, values in stats.items()}
+            for metric, stats in per_sample.items()
+        }
+        return averages, per_sample
+
+    def get_scores(self, hyps: List[str], refs: List[str]) -> Tuple[Dict, Dict]:
+        """返回 (平均分数, 逐样本分数)，格式见 summarize"""
+        return self.summarize(self.score_matrix(hyps, refs))
+
+
+# 无法生成时的占位回答；ROUGE 中按单字“无”计分，避免空预测
+EMPTY_PREDICTION = "无法生成回答"
+
+
+class RougeMetric:
+    """指标注册表中的 ROUGE（接口见 src.metrics）"""
+
+    def partial(self, batch: Dict) -> np.ndarray:
+        hyps = [
+            '无' if text == EMPTY_PREDICTION else ' '.join(tokens)
+            for text, tokens in zip(batch['predictions'], batch['prediction_tokens'])
+        ]
+        refs = [' '.join(tokens) for tokens in batch['reference_tokens']]
+        return NativeRouge(num_workers=1).score_matrix(hyps, refs)
+
+    def finalize(self, parts: List[np.ndarray]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        averages, per_sample = NativeRouge.summarize(np.concatenate(parts))
+        return {'rouge_scores': averages}, {metric: stats['f'] for metric, stats in per_sample.items()}
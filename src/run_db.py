@@ -0,0 +1,413 @@
+"""
+评估结果数据库 - 自动发现结果文件，登记到本地 SQLite，只为变化的实验增量计算统计量
+
+runs     每个结果文件一行：实验名、方法、数据量、检查点（按 方法/数据量/检查点 建索引）
+metrics  每个实验每个指标一行：均值及 bootstrap 置信区间（按指标建索引）
+pairs    每对实验每个指标一行：配对差值、置信区间、bootstrap / 置换检验 p 值
+files    已扫描文件的修改时间和大小（含非结果文件），未变化的文件不再读取
+charts   每张图所依赖数据的指纹，数据未变化时不重画
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+from glob import glob
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.sample_store import STORE_SUFFIX, SampleStore
+from src.significance import align_samples, bootstrap_intervals, holm_adjust, pairwise_tests
+
+
+# 汇总表的列名 → 逐样本存储中的列名
+RUN_METRICS = [
+    ('ROUGE-1', 'rouge-1'),
+    ('ROUGE-2', 'rouge-2'),
+    ('ROUGE-L', 'rouge-l'),
+    ('BLEU', 'bleu'),
+    ('BERTScore-F1', 'bertscore'),
+]
+
+# 默认扫描的结果文件
+DEFAULT_PATTERNS = ['outputs/*.json', 'outputs/*/*.json']
+
+METHOD_PATTERN = re.compile(r'(?P<method>qlora|lora)[_-]?(?P<size>\d+(?:\.\d+)?)(?P<unit>[km]?)', re.IGNORECASE)
+CHECKPOINT_PATTERN = re.compile(r'checkpoint[-_]?(\w+)', re.IGNORECASE)
+METHOD_ORDER = {'-': 0, 'LoRA': 1, 'QLoRA': 2}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    is_run INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT UNIQUE NOT NULL,
+    method TEXT NOT NULL,
+    data_size INTEGER NOT NULL,
+    checkpoint TEXT NOT NULL,
+    num_samples INTEGER,
+    sample_store TEXT,
+    stale INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_runs_method ON runs(method, data_size, checkpoint);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    value REAL,
+    ci_low REAL,
+    ci_high REAL,
+    PRIMARY KEY (run_id, metric)
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_metric ON metrics(metric, value);
+CREATE TABLE IF NOT EXISTS pairs (
+    run_a INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    run_b INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    num_samples INTEGER,
+    diff REAL,
+    ci_low REAL,
+    ci_high REAL,
+    bootstrap_p REAL,
+    permutation_p REAL,
+    PRIMARY KEY (run_a, run_b, metric)
+);
+CREATE INDEX IF NOT EXISTS idx_pairs_metric ON pairs(metric);
+CREATE TABLE IF NOT EXISTS charts (
+    name TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def describe_run(path: str) -> Dict:
+    """从文件路径推断实验信息（outputs/lora_5k.json → LoRA-5k；路径含 checkpoint-xxx 时记为该检查点）"""
+    p = Path(path)
+    text = '/'.join(p.with_suffix('').parts[-2:])
+
+    match = CHECKPOINT_PATTERN.search(text)
+    checkpoint = match.group(1) if match else ''
+
+    match = METHOD_PATTERN.search(text)
+    if match:
+        method = 'QLoRA' if match.group('method').lower() == 'qlora' else 'LoRA'
+        unit = match.group('unit').lower()
+        data_size = int(float(match.group('size')) * {'k': 1000, 'm': 1000000, '': 1}[unit])
+        name = f"{method}-{match.group('size')}{unit}"
+    elif p.stem.lower() == 'base' or p.stem.lower().startswith('base_'):
+        method, data_size, name = '-', 0, 'Baseline'
+    else:
+        method, data_size, name = '其他', 0, p.stem
+
+    if checkpoint:
+        name = f"{name}@{checkpoint}"
+    return {'name': name, 'method': method, 'data_size': data_size, 'checkpoint': checkpoint}
+
+
+def run_metrics(data: Dict) -> Dict[str, float]:
+    """结果文件中的汇总指标（列名 → 值）"""
+    rouge = data.get('rouge_scores') or {}
+    values = {
+        'ROUGE-1': (rouge.get('rouge-1') or {}).get('f'),
+        'ROUGE-2': (rouge.get('rouge-2') or {}).get('f'),
+        'ROUGE-L': (rouge.get('rouge-l') or {}).get('f'),
+        'BLEU': data.get('bleu_score'),
+        'BERTScore-F1': (data.get('bert_score') or {}).get('f1'),
+    }
+    return {name: value for name, value in values.items() if value is not None}
+
+
+class RunDatabase:
+    """评估结果数据库（outputs/summary/runs.sqlite）"""
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- 发现与登记 ----------
+
+    def scan(self, patterns: List[str]) -> Dict[str, List[str]]:
+        """扫描结果文件：新增 / 修改的文件重新登记，已删除的移出数据库，其余不读取"""
+        changes = {'added': [], 'updated': [], 'removed': [], 'unchanged': []}
+        known = {
+            row[0]: (row[1], row[2], row[3])
+            for row in self.conn.execute('SELECT path, mtime, size, is_run FROM files')
+        }
+
+        seen = set()
+        for pattern in patterns:
+            for path in sorted(glob(pattern)):
+                path = Path(path).as_posix()
+                # 逐样本存储目录内的 meta.json 不是结果文件
+                if path in seen or Path(path).parent.suffix == STORE_SUFFIX:
+                    continue
+                seen.add(path)
+                stat = Path(path).stat()
+                if path in known and known[path][:2] == (stat.st_mtime, stat.st_size):
+                    if known[path][2]:
+                        changes['unchanged'].append(path)
+                    continue
+
+                is_run = self._register(path, stat.st_mtime, stat.st_size)
+                if is_run:
+                    changes['updated' if path in known and known[path][2] else 'added'].append(path)
+
+        for path in set(known) - seen:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            if known[path][2]:
+                changes['removed'].append(path)
+
+        self.conn.commit()
+        return changes
+
+    def _register(self, path: str, mtime: float, size: int) -> bool:
+        """读取一个 JSON 文件；是评估结果时登记实验和汇总指标，返回是否为评估结果"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        is_run = isinstance(data, dict) and bool(data.get('rouge_scores'))
+
+        self.conn.execute(
+            'INSERT INTO files (path, mtime, size, is_run) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size, is_run = excluded.is_run',
+            (path, mtime, size, int(is_run))
+        )
+        # 结果变化后旧的指标和配对检验都作废（级联删除）
+        self.conn.execute('DELETE FROM runs WHERE path = ?', (path,))
+        if not is_run:
+            return False
+
+        info = describe_run(path)
+        # 实验名重复（如不同目录下同名的结果文件）：先附目录名，仍重复再加序号
+        name, suffix = info['name'], 1
+        while self.conn.execute('SELECT 1 FROM runs WHERE name = ?', (name,)).fetchone():
+            name = f"{info['name']} ({Path(path).parent.name})" if suffix == 1 else \
+                f"{info['name']} ({Path(path).parent.name}, {suffix})"
+            suffix += 1
+        info['name'] = name
+
+        cursor = self.conn.execute(
+            'INSERT INTO runs (path, name, method, data_size, checkpoint, num_samples, sample_store) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (path, info['name'], info['method'], info['data_size'], info['checkpoint'],
+             data.get('num_samples', 0), data.get('sample_store'))
+        )
+        self.conn.executemany(
+            'INSERT INTO metrics (run_id, metric, value) VALUES (?, ?, ?)',
+            [(cursor.lastrowid, name, value) for name, value in run_metrics(data).items()]
+        )
+        return True
+
+    # ---------- 增量统计 ----------
+
+    def _runs(self) -> List[Dict]:
+        """所有实验，按 方法 / 数据量 / 检查点 排序"""
+        rows = self.conn.execute(
+            'SELECT id, path, name, method, data_size, checkpoint, sample_store, stale FROM runs'
+        ).fetchall()
+        runs = [
+            dict(zip(['id', 'path', 'name', 'method', 'data_size', 'checkpoint', 'sample_store', 'stale'], row))
+            for row in rows
+        ]
+        return sorted(runs, key=lambda run: (
+            METHOD_ORDER.get(run['method'], len(METHOD_ORDER)), run['data_size'], run['checkpoint'], run['name']
+        ))
+
+    @staticmethod
+    def _load_samples(run: Dict) -> Optional[Dict]:
+        """逐样本指标（内存映射读取），没有逐样本存储时返回 None"""
+        if not run['sample_store']:
+            return None
+        store_path = Path(run['path']).parent / run['sample_store']
+        if not store_path.exists():
+            return None
+        store = SampleStore(store_path)
+        scores = {column: store[key] for column, key in RUN_METRICS if key in store}
+        if not scores:
+            return None
+        ids = np.asarray(store['ids'])
+        return {'ids': ids, 'key': hashlib.sha1(ids.tobytes()).hexdigest(), 'scores': scores}
+
+    def update_statistics(self, num_resamples: int = 10000, confidence: float = 0.95, seed: int = 42) -> Tuple[int, int]:
+        """为变化的实验计算置信区间，并重新检验涉及它们的实验对；返回 (更新的实验数, 检验的实验对数)"""
+        settings = {'num_resamples': str(num_resamples), 'confidence': str(confidence), 'seed': str(seed)}
+        if dict(self.conn.execute('SELECT key, value FROM settings').fetchall()) != settings:
+            # 检验参数变化：全部重算
+            self.conn.execute('UPDATE runs SET stale = 1')
+            self.conn.execute('DELETE FROM pairs')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', settings.items()
+            )
+
+        runs = self._runs()
+        stale = [run for run in runs if run['stale']]
+        if not stale:
+            return 0, 0
+
+        samples = {run['id']: self._load_samples(run) for run in runs}
+
+        # 1. 各实验均值的置信区间：样本相同的实验合并为一次 bootstrap
+        groups = {}
+        for run in stale:
+            if samples[run['id']] is not None:
+                groups.setdefault(samples[run['id']]['key'], []).append(run)
+        for group in groups.values():
+            rows = [
+                (run['id'], column, scores)
+                for run in group
+                for column, scores in samples[run['id']]['scores'].items()
+            ]
+            _, low, high = bootstrap_intervals(
+                np.stack([np.asarray(scores, dtype=np.float64) for _, _, scores in rows]),
+                num_resamples, confidence, seed
+            )
+            self.conn.executemany(
+                'UPDATE metrics SET ci_low = ?, ci_high = ? WHERE run_id = ? AND metric = ?',
+                [(float(low[k]), float(high[k]), run_id, column) for k, (run_id, column, _) in enumerate(rows)]
+            )
+
+        # 2. 涉及变化实验的实验对：按（共同样本, 共同指标）分组，每组一次向量化检验
+        stale_ids = {run['id'] for run in stale}
+        pair_groups = {}
+        for a, b in combinations(runs, 2):
+            if a['id'] not in stale_ids and b['id'] not in stale_ids:
+                continue
+            sa, sb = samples[a['id']], samples[b['id']]
+            if sa is None or sb is None:
+                continue
+            columns = tuple(column for column, _ in RUN_METRICS if column in sa['scores'] and column in sb['scores'])
+            common = sa['ids'] if sa['key'] == sb['key'] else np.intersect1d(sa['ids'], sb['ids'])
+            if not columns or len(common) == 0:
+                continue
+            key = (hashlib.sha1(common.tobytes()).hexdigest(), columns)
+            group = pair_groups.setdefault(key, {'common': common, 'columns': columns, 'pairs': []})
+            group['pairs'].append((a, b))
+
+        num_pairs = 0
+        for group in pair_groups.values():
+            members = list({run['id']: run for pair in group['pairs'] for run in pair}.values())
+            index = {run['id']: k for k, run in enumerate(members)}
+            positions = align_samples([group['common']] + [samples[run['id']]['ids'] for run in members])[1:]
+            scores = np.stack([
+                np.stack([
+                    np.asarray(samples[run['id']]['scores'][column], dtype=np.float64)[positions[k]]
+                    for k, run in enumerate(members)
+                ])
+                for column in group['columns']
+            ])
+            pair_i = [index[a['id']] for a, _ in group['pairs']]
+            pair_j = [index[b['id']] for _, b in group['pairs']]
+            tests = pairwise_tests(scores, num_resamples, confidence, seed, pairs=(pair_i, pair_j))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO pairs (run_a, run_b, metric, num_samples, diff, ci_low, ci_high, '
+                'bootstrap_p, permutation_p) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (a['id'], b['id'], column, len(group['common']),
+                     *(float(tests[field][m, k]) for field in ('diff', 'ci_low', 'ci_high', 'bootstrap_p', 'permutation_p')))
+                    for m, column in enumerate(group['columns'])
+                    for k, (a, b) in enumerate(group['pairs'])
+                ]
+            )
+            num_pairs += len(group['pairs'])
+
+        self.conn.execute('UPDATE runs SET stale = 0')
+        self.conn.commit()
+        return len(stale), num_pairs
+
+    # ---------- 查询 ----------
+
+    def summary_frame(self, with_intervals: bool = False) -> pd.DataFrame:
+        """汇总表：每个实验一行（实验 / 方法 / 数据量 / 检查点 + 各指标，可选置信区间列）"""
+        runs = self._runs()
+        values = {}
+        for run_id, metric, value, ci_low, ci_high in self.conn.execute(
+            'SELECT run_id, metric, value, ci_low, ci_high FROM metrics'
+        ):
+            values.setdefault(run_id, {})[metric] = (value, ci_low, ci_high)
+
+        rows = []
+        for run in runs:
+            row = {
+                '实验': run['name'],
+                '方法': run['method'],
+                '数据量': run['data_size'],
+                '检查点': run['checkpoint'],
+            }
+            for column, _ in RUN_METRICS:
+                if column in values.get(run['id'], {}):
+                    row[column] = values[run['id']][column][0]
+            if with_intervals:
+                for column, _ in RUN_METRICS:
+                    value = values.get(run['id'], {}).get(column)
+                    if value is not None and value[1] is not None:
+                        row[f'{column} CI低'] = value[1]
+                        row[f'{column} CI高'] = value[2]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def pairs_frame(self, confidence: float = 0.95) -> pd.DataFrame:
+        """两两配对检验结果（实验按汇总表顺序，指标按 RUN_METRICS 顺序）
+
+        表中所有（实验对, 指标）的置换检验 p 值作为一族做 Holm 校正，“显著”按校正后的 p 值判断。
+        """
+        runs = self._runs()
+        order = {run['id']: k for k, run in enumerate(runs)}
+        names = {run['id']: run['name'] for run in runs}
+        metric_order = {column: k for k, (column, _) in enumerate(RUN_METRICS)}
+
+        rows = sorted(
+            self.conn.execute(
+                'SELECT run_a, run_b, metric, num_samples, diff, ci_low, ci_high, bootstrap_p, permutation_p FROM pairs'
+            ).fetchall(),
+            key=lambda row: (metric_order.get(row[2], len(metric_order)), order[row[0]], order[row[1]])
+        )
+        adjusted = holm_adjust(np.array([row[8] for row in rows], dtype=np.float64))
+        return pd.DataFrame(
+            [
+                {
+                    '实验A': names[row[0]],
+                    '实验B': names[row[1]],
+                    '指标': row[2],
+                    '样本数': row[3],
+                    '差值(A-B)': row[4],
+                    'CI低': row[5],
+                    'CI高': row[6],
+                    'bootstrap p': row[7],
+                    '置换检验 p': row[8],
+                    '校正 p (Holm)': adjusted[k],
+                    '显著': bool(adjusted[k] < 1 - confidence)
+                }
+                for k, row in enumerate(rows)
+            ],
+            columns=['实验A', '实验B', '指标', '样本数', '差值(A-B)', 'CI低', 'CI高', 'bootstrap p', '置换检验 p',
+                     '校正 p (Holm)', '显著']
+        )
+
+    # ---------- 图表缓存 ----------
+
+    def chart_fingerprint(self, name: str) -> Optional[str]:
+        row = self.conn.execute('SELECT fingerprint FROM charts WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_chart_fingerprint(self, name: str, fingerprint: str):
+        self.conn.execute('INSERT OR REPLACE INTO charts (name, fingerprint) VALUES (?, ?)', (name, fingerprint))
+        self.conn.commit()
@@ -0,0 +1,179 @@
+"""
+逐样本结果存储 - 列式目录，每列一个 .npy 文件，读取时内存映射
+
+<结果文件>.samples/
+    meta.json              列名、类型、样本数
+    ids.npy                样本在 test.json 中的下标
+    rouge-l.npy ...        数值列（逐样本指标、token 数、耗时）
+    prediction.data.npy    文本列：UTF-8 字节拼接（uint8）
+    prediction.offsets.npy 文本列：每条文本的起止偏移（int64，长度 = 样本数 + 1）
+
+读取时数值列直接 np.load(mmap_mode='r')，文本列只解码被访问的切片，百万级样本也能快速切片。
+"""
+
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+STORE_SUFFIX = '.samples'
+
+
+def sample_store_path(output_file: Union[str, Path]) -> Path:
+    """结果文件对应的逐样本存储目录（outputs/lora_5k.json → outputs/lora_5k.samples）"""
+    return Path(output_file).with_suffix(STORE_SUFFIX)
+
+
+def write_sample_store(path: Union[str, Path], columns: Dict[str, Sequence], meta: Optional[Dict] = None) -> Path:
+    """写入列式存储（字符串列按文本列保存，其余按数值列保存；先写临时目录再替换）"""
+    path = Path(path)
+    lengths = {name: len(values) for name, values in columns.items()}
+    if len(set(lengths.values())) > 1:
+        raise ValueError(f"各列长度不一致: {lengths}")
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    schema = {}
+    for name, values in columns.items():
+        if len(values) > 0 and isinstance(values[0], str):
+            encoded = [text.encode('utf-8') for text in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(item) for item in encoded], out=offsets[1:])
+            np.save(tmp_path / f"{name}.data.npy", np.frombuffer(b''.join(encoded), dtype=np.uint8))
+            np.save(tmp_path / f"{name}.offsets.npy", offsets)
+            schema[name] = 'text'
+        else:
+            array = np.asarray(values)
+            np.save(tmp_path / f"{name}.npy", array)
+            schema[name] = str(array.dtype)
+
+    with open(tmp_path / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump(
+            {'num_samples': next(iter(lengths.values()), 0), 'columns': schema, **(meta or {})},
+            f, ensure_ascii=False, indent=2
+        )
+
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+    return path
+
+
+class TextColumn:
+    """内存映射的文本列，按下标 / 切片 / 下标数组解码"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _decode(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, index) -> Union[str, List[str]]:
+        if isinstance(index, (int, np.integer)):
+            return self._decode(int(index) % len(self))
+        if isinstance(index, slice):
+            index = range(*index.indices(len(self)))
+        elif np.asarray(index).dtype == bool:
+            index = np.flatnonzero(index)
+        return [self._decode(int(i)) for i in index]
+
+
+class SampleStore:
+    """读取逐样本存储：store['rouge-l'] 为内存映射数组，store['prediction'] 为 TextColumn"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / 'meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return self.meta['num_samples']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.meta['columns']
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.meta['columns'])
+
+    def __getitem__(self, name: str) -> Union[np.ndarray, TextColumn]:
+        if name not in self._columns:
+            kind = self.meta['columns'][name]
+            if kind == 'text':
+                self._columns[name] = TextColumn(
+                    np.load(self.path / f"{name}.data.npy", mmap_mode='r'),
+                    np.load(self.path / f"{name}.offsets.npy", mmap_mode='r')
+                )
+            else:
+                self._columns[name] = np.load(self.path / f"{name}.npy", mmap_mode='r')
+        return self._columns[name]
+
+    def take(self, index, columns: Optional[List[str]] = None) -> Dict[str, Union[np.ndarray, List[str]]]:
+        """按下标 / 切片 / 布尔掩码取出若干行（数值列拷贝为普通数组）"""
+        rows = {}
+        for name in columns or self.columns:
+            column = self[name]
+            rows[name] = column[index] if isinstance(column, TextColumn) else np.array(column[index])
+        return rows
+
+
+def token_counts(tokenizer, test_data: List[Dict], predictions: List[str]) -> Dict[str, np.ndarray]:
+    """提示、生成回答、参考答案的 token 数（与 test_data 顺序对应）"""
+
+    def count(texts):
+        return np.array([len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']], dtype=np.int32)
+
+    return {
+        'prompt_tokens': count([
+            f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in test_data
+        ]),
+        'prediction_tokens': count(predictions),
+        'reference_tokens': count([item['output'] for item in test_data])
+    }
+
+
+def save_eval_samples(
+    output_file: Union[str, Path],
+    test_data: List[Dict],
+    results: Dict,
+    tokenizer=None,
+    counts: Optional[Dict[str, np.ndarray]] = None,
+    meta: Optional[Dict] = None
+) -> Path:
+    """把一次评估的全部样本写入结果文件旁的列式存储
+
+    列：ids、input、prediction、reference、逐样本指标（results['per_sample_scores']）、
+    token 数（提供 tokenizer 时现算，或直接传入 counts）、latency（results['latencies']，
+    样本所在批次的生成耗时，秒；从日志恢复或外部生成的样本为 NaN）。
+    """
+    ids = np.asarray(results.get('sample_indices') or range(len(results['predictions'])), dtype=np.int64)
+    samples = [test_data[i] for i in ids]
+
+    columns = {
+        'ids': ids,
+        'input': [item['input'] for item in samples],
+        'prediction': list(results['predictions']),
+        'reference': list(results['references']),
+    }
+    for name, scores in (results.get('per_sample_scores') or {}).items():
+        columns[name] = np.asarray(scores, dtype=np.float64)
+
+    if counts is None and tokenizer is not None:
+        counts = token_counts(tokenizer, samples, results['predictions'])
+    columns.update(counts or {})
+
+    if results.get('latencies') is not None:
+        columns['latency'] = np.asarray(results['latencies'], dtype=np.float32)
+
+    return write_sample_store(sample_store_path(output_file), columns, meta)
@@ -0,0 +1,152 @@
+"""
+分词模块 - 所有指标共用的 jieba 分词阶段：进程池并行分词 + 参考答案磁盘缓存
+"""
+
+import os
+import json
+import atexit
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import jieba
+
+
+_POOL = None
+_POOL_WORKERS = 0
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def process_pool(num_workers: int) -> ProcessPoolExecutor:
+    """进程内共享的指标计算进程池（spawn，避免 fork 继承模型和线程状态）"""
+    global _POOL, _POOL_WORKERS
+    if _POOL is None or _POOL_WORKERS != num_workers:
+        if _POOL is not None:
+            _POOL.shutdown()
+        _POOL = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'))
+        _POOL_WORKERS = num_workers
+    return _POOL
+
+
+@atexit.register
+def _shutdown_pool():
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def cut_texts(texts: List[str]) -> List[List[str]]:
+    """在工作进程中分词"""
+    jieba.setLogLevel(60)
+    return [list(jieba.cut(text)) for text in texts]
+
+
+class SegmentCache:
+    """分词结果磁盘缓存（JSONL，按文本 sha1 索引，只追加）
+
+    文件名带 jieba 版本，词典变化后自动使用新缓存。
+    """
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"jieba_{jieba.__version__}.jsonl")
+        self.entries: Dict[str, List[str]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时可能留下半行
+                        continue
+                    self.entries[record['key']] = record['tokens']
+
+    def get(self, key: str) -> Optional[List[str]]:
+        return self.entries.get(key)
+
+    def add(self, items: Dict[str, List[str]]):
+        items = {key: tokens for key, tokens in items.items() if key not in self.entries}
+        if not items:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for key, tokens in items.items():
+                f.write(json.dumps({'key': key, 'tokens': tokens}, ensure_ascii=False) + '\n')
+        self.entries.update(items)
+
+
+class Segmenter:
+    """共享分词器
+
+    同一进程内按文本记忆分词结果，ROUGE / BLEU 等指标对同一文本只分词一次；
+    persist=True 的文本（参考答案）额外写入磁盘缓存，多次实验评估同一 test.json 时直接复用。
+    未命中的文本数达到 min_parallel 时分块交给进程池并行分词。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        num_workers: Optional[int] = None,
+        min_parallel: int = 2000,
+        chunk_size: int = 500
+    ):
+        self.disk = SegmentCache(cache_dir) if cache_dir else None
+        self.num_workers = num_workers or default_workers()
+        self.min_parallel = min_parallel
+        self.chunk_size = chunk_size
+        self.memory: Dict[str, List[str]] = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'segmented': 0}
+
+    def _cut(self, texts: List[str]) -> List[List[str]]:
+        if self.num_workers <= 1 or len(texts) < self.min_parallel:
+            return cut_texts(texts)
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = []
+        for part in process_pool(self.num_workers).map(cut_texts, chunks):
+            results.extend(part)
+        return results
+
+    def segment(self, texts: Iterable[str], persist: bool = False) -> List[List[str]]:
+        """返回每个文本的分词结果（列表与输入一一对应，同一文本共享同一个列表对象）"""
+        texts = list(texts)
+        missing = []
+        seen = set()
+        for text in texts:
+            if text in self.memory:
+                self.stats['memory_hits'] += 1
+            elif text not in seen:
+                seen.add(text)
+                missing.append(text)
+
+        if missing and self.disk is not None:
+            remaining = []
+            for text in missing:
+                tokens = self.disk.get(text_key(text))
+                if tokens is None:
+                    remaining.append(text)
+                else:
+                    self.memory[text] = tokens
+                    self.stats['disk_hits'] += 1
+            missing = remaining
+
+        if missing:
+            segmented = self._cut(missing)
+            self.stats['segmented'] += len(missing)
+            for text, tokens in zip(missing, segmented):
+                self.memory[text] = tokens
+            if persist and self.disk is not None:
+                self.disk.add({text_key(text): tokens for text, tokens in zip(missing, segmented)})
+
+        return [self.memory[text] for text in texts]
+
+    def print_summary(self):
+        print(
+            f"分词: 新分词 {self.stats['segmented']} 条 | 磁盘缓存命中 {self.stats['disk_hits']} 条 | "
+            f"内存复用 {self.stats['memory_hits']} 条"
+        )
@@ -0,0 +1,138 @@
+"""
+序贯评估模块 - 按随机顺序分块评估，用 bootstrap 置信区间判断何时可以提前停止
+
+每评估完一块样本，对主指标的逐样本分数做 bootstrap：所有模型共用同一组重采样下标，
+因此同时得到各模型均值的置信区间和两两差值（配对）的置信区间。
+
+每块之后都检查一次差值区间，相当于对同一假设重复检验；差值区间按最多检查次数做
+Bonferroni 校正（置信水平 1 - (1 - confidence) / max_looks），提前停止时的总体第一类错误不超过 1 - confidence。
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# 可作为序贯评估主指标的逐样本分数 → 所属的注册表指标
+SEQUENTIAL_METRICS = {
+    'rouge-1': 'rouge',
+    'rouge-2': 'rouge',
+    'rouge-l': 'rouge',
+    'bleu': 'bleu',
+    'bertscore': 'bertscore',
+}
+
+
+def bootstrap_means(
+    scores: np.ndarray,
+    num_resamples: int,
+    rng: np.random.Generator,
+    max_elements: int = 4_000_000
+) -> np.ndarray:
+    """对 [模型, 样本] 分数矩阵做 bootstrap，返回 [重采样, 模型] 的均值
+
+    每轮重采样的下标转成计数矩阵 [重采样, 样本]，均值 = 计数 @ 分数.T / 样本数（一次矩阵乘法）；
+    按 max_elements 分批生成下标以限制内存。
+    """
+    num_models, n = scores.shape
+    block = max(1, max_elements // max(1, n))
+    means = np.empty((num_resamples, num_models))
+    for start in range(0, num_resamples, block):
+        size = min(block, num_resamples - start)
+        indices = rng.integers(0, n, size=(size, n))
+        counts = np.bincount(
+            (indices + (np.arange(size) * n)[:, None]).ravel(), minlength=size * n
+        ).reshape(size, n)
+        means[start:start + size] = counts @ scores.T / n
+    return means
+
+
+def max_looks(total_samples: int, chunk_size: int, min_samples: int) -> int:
+    """分块评估时最多会做几次停止检查（已评估样本数 ≥ min_samples 后每块一次）"""
+    num_chunks = math.ceil(total_samples / chunk_size)
+    first = min(num_chunks, math.ceil(min_samples / chunk_size))
+    return max(1, num_chunks - first + 1)
+
+
+def percentile_interval(samples: np.ndarray, confidence: float) -> Tuple[np.ndarray, np.ndarray]:
+    alpha = (1 - confidence) / 2
+    return np.quantile(samples, alpha, axis=0), np.quantile(samples, 1 - alpha, axis=0)
+
+
+class SequentialTracker:
+    """累积各模型主指标的逐样本分数，给出置信区间和停止判断
+
+    停止条件（满足其一，且已评估样本数 ≥ min_samples）：
+    - 所有模型置信区间半宽都小于 target_half_width
+    - 多个模型时，所有模型两两之间的差值置信区间都不包含 0（已能区分）；
+      差值区间的置信水平按 max_looks 次检查做 Bonferroni 校正（pair_confidence）
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        target_half_width: float = 0.005,
+        min_samples: int = 1000,
+        num_resamples: int = 10000,
+        confidence: float = 0.95,
+        seed: int = 42,
+        max_looks: int = 1
+    ):
+        self.names = list(names)
+        self.target_half_width = target_half_width
+        self.min_samples = min_samples
+        self.num_resamples = num_resamples
+        self.confidence = confidence
+        self.max_looks = max(1, max_looks)
+        self.pair_confidence = 1 - (1 - confidence) / self.max_looks
+        self.rng = np.random.default_rng(seed)
+        self.scores: Dict[str, List[np.ndarray]] = {name: [] for name in self.names}
+        self.history: List[Dict] = []
+
+    @property
+    def num_samples(self) -> int:
+        return sum(len(part) for part in self.scores[self.names[0]])
+
+    def update(self, chunk_scores: Dict[str, np.ndarray]) -> Dict:
+        """加入一块样本的分数，返回当前的区间估计"""
+        for name in self.names:
+            self.scores[name].append(np.asarray(chunk_scores[name], dtype=np.float64))
+
+        matrix = np.stack([np.concatenate(self.scores[name]) for name in self.names])
+        means = bootstrap_means(matrix, self.num_resamples, self.rng)
+        low, high = percentile_interval(means, self.confidence)
+        estimate = {
+            'num_samples': matrix.shape[1],
+            'intervals': {
+                name: {
+                    'mean': float(matrix[k].mean()),
+                    'low': float(low[k]),
+                    'high': float(high[k]),
+                    'half_width': float((high[k] - low[k]) / 2)
+                }
+                for k, name in enumerate(self.names)
+            },
+            'pairs': {}
+        }
+        for a in range(len(self.names)):
+            for b in range(a + 1, len(self.names)):
+                diff_low, diff_high = percentile_interval(means[:, a] - means[:, b], self.pair_confidence)
+                estimate['pairs'][f"{self.names[a]} vs {self.names[b]}"] = {
+                    'diff': float(matrix[a].mean() - matrix[b].mean()),
+                    'low': float(diff_low),
+                    'high': float(diff_high),
+                    'separated': bool(diff_low > 0 or diff_high < 0)
+                }
+        self.history.append(estimate)
+        return estimate
+
+    def stop_reason(self) -> Optional[str]:
+        if not self.history or self.num_samples < self.min_samples:
+            return None
+        estimate = self.history[-1]
+        if all(item['half_width'] < self.target_half_width for item in estimate['intervals'].values()):
+            return f"置信区间半宽 < {self.target_half_width}"
+        if estimate['pairs'] and all(item['separated'] for item in estimate['pairs'].values()):
+            return f"模型之间差异显著（已按 {self.max_looks} 次检查校正）"
+        return None
@@ -0,0 +1,392 @@
+"""
+推理服务模块 - asyncio HTTP 服务，请求队列在等待窗口内合并成批次生成，支持流式输出
+"""
+
+import json
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+from src.chat import percentile
+from src.generation import encode_prompts
+
+
+class PendingRequest:
+    """队列中的一个生成请求"""
+
+    def __init__(self, prompt: str, max_new_tokens: int, stream: bool, loop):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.stream = stream
+        self.future = loop.create_future()
+        # 流式请求：生成线程把增量文本放进这个队列，None 表示结束
+        self.chunks = asyncio.Queue() if stream else None
+        self.enqueue_time = time.perf_counter()
+        self.start_time = None
+        self.first_token_time = None
+        self.token_ids: List[int] = []
+        self.text = ""
+        self.finished = False
+
+
+class BatchStreamer(BaseStreamer):
+    """批量生成的逐行流式输出
+
+    transformers 自带的 streamer 只支持 batch=1；这里按行收集新 token，
+    遇到 eos 或达到该请求自己的 max_new_tokens 后停止该行，
+    并把增量文本通过 call_soon_threadsafe 送回事件循环。
+    """
+
+    def __init__(self, tokenizer, requests: List[PendingRequest], loop):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.loop = loop
+        self.prompt_skipped = False
+
+    def put(self, value):
+        if not self.prompt_skipped:
+            self.prompt_skipped = True
+            return
+
+        now = time.perf_counter()
+        for request, token_id in zip(self.requests, value.reshape(-1).tolist()):
+            if request.finished:
+                continue
+            if request.first_token_time is None:
+                request.first_token_time = now
+            request.token_ids.append(token_id)
+            if token_id == self.tokenizer.eos_token_id or len(request.token_ids) >= request.max_new_tokens:
+                request.finished = True
+
+            if request.stream:
+                text = self.tokenizer.decode(request.token_ids, skip_special_tokens=True)
+                # 多字节字符可能被拆成多个 token，没解码完整时先不输出
+                if len(text) > len(request.text) and not text.endswith('�'):
+                    delta = text[len(request.text):]
+                    request.text = text
+                    self.loop.call_soon_threadsafe(request.chunks.put_nowait, delta)
+
+    def end(self):
+        for request in self.requests:
+            request.finished = True
+
+
+class ServerMetrics:
+    """服务指标：计数、批次大小、队列深度和最近 N 个请求的延迟分位数"""
+
+    def __init__(self, window: int = 1000):
+        self.start_time = time.time()
+        self.counters = {
+            'requests': 0,
+            'completed': 0,
+            'rejected': 0,
+            'failed': 0,
+            'batches': 0,
+            'generated_tokens': 0,
+        }
+        self.generate_time = 0.0
+        self.peak_queue_depth = 0
+        self.batch_sizes = deque(maxlen=window)
+        self.latencies = {name: deque(maxlen=window) for name in ('queue_wait', 'ttft', 'total')}
+
+    def record_request(self, request: PendingRequest):
+        self.counters['completed'] += 1
+        self.counters['generated_tokens'] += len(request.token_ids)
+        done = time.perf_counter()
+        self.latencies['queue_wait'].append(request.start_time - request.enqueue_time)
+        if request.first_token_time is not None:
+            self.latencies['ttft'].append(request.first_token_time - request.enqueue_time)
+        self.latencies['total'].append(done - request.enqueue_time)
+
+    def snapshot(self, queue_depth: int, config: Dict) -> Dict:
+        batch_sizes = list(self.batch_sizes)
+        return {
+            'uptime': time.time() - self.start_time,
+            'config': config,
+            'counters': dict(self.counters),
+            'queue_depth': queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'avg_batch_size': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'max_batch_size_seen': max(batch_sizes, default=0),
+            'tokens_per_second': (
+                self.counters['generated_tokens'] / self.generate_time if self.generate_time > 0 else 0.0
+            ),
+            'latency_ms': {
+                name: {
+                    f'p{q}': percentile(list(values), q) * 1000
+                    for q in (50, 90, 95, 99)
+                }
+                for name, values in self.latencies.items()
+            },
+        }
+
+
+class InferenceServer:
+    """批处理推理服务
+
+    请求进入有界队列（满时返回 503）；调度协程取到第一个请求后最多再等待 max_wait_ms
+    收集更多请求，凑满 max_batch_size 或超时即发车。generate 在单独的工作线程中执行，
+    不阻塞事件循环，一批生成期间到达的请求自然累积成下一批。
+
+    接口:
+        POST /generate  {"input": "...", "instruction": "...", "max_new_tokens": 128, "stream": false}
+        GET  /health
+        GET  /metrics
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        instruction: str = "回答医疗健康问题",
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_queue: int = 256,
+        max_new_tokens: int = 256,
+        do_sample: bool = False,
+        latency_window: int = 1000
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.instruction = instruction
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+
+        self.metrics = ServerMetrics(latency_window)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue: Optional[asyncio.Queue] = None
+        self.loop = None
+
+    def config(self) -> Dict:
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_queue': self.max_queue,
+            'max_new_tokens': self.max_new_tokens,
+            'do_sample': self.do_sample,
+        }
+
+    # ---------- 调度 ----------
+
+    async def _batch_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.loop.run_in_executor(self.executor, self._run_batch, batch)
+
+    def _run_batch(self, batch: List[PendingRequest]):
+        """在工作线程中生成一批，结果通过事件循环回填到各请求"""
+        start = time.perf_counter()
+        for request in batch:
+            request.start_time = start
+        self.metrics.counters['batches'] += 1
+        self.metrics.batch_sizes.append(len(batch))
+
+        generate_kwargs = dict(
+            max_new_tokens=max(request.max_new_tokens for request in batch),
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id
+        )
+        if self.do_sample:
+            generate_kwargs.update(do_sample=True, temperature=0.7, top_p=0.9)
+        else:
+            generate_kwargs.update(do_sample=False)
+
+        try:
+            inputs = encode_prompts(self.tokenizer, [request.prompt for request in batch], self.model.device)
+            with torch.no_grad():
+                self.model.generate(
+                    **inputs, streamer=BatchStreamer(self.tokenizer, batch, self.loop), **generate_kwargs
+                )
+        except Exception as e:
+            self.metrics.counters['failed'] += len(batch)
+            for request in batch:
+                self.loop.call_soon_threadsafe(self._finish, request, None, e)
+            return
+        finally:
+            self.metrics.generate_time += time.perf_counter() - start
+
+        for request in batch:
+            response = self.tokenizer.decode(request.token_ids, skip_special_tokens=True).strip()
+            self.metrics.record_request(request)
+            self.loop.call_soon_threadsafe(self._finish, request, response or "无法生成回答", None)
+
+    @staticmethod
+    def _finish(request: PendingRequest, response: Optional[str], error: Optional[Exception]):
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(response)
+        if request.stream:
+            request.chunks.put_nowait(None)
+
+    def submit(self, question: str, instruction: Optional[str] = None,
+               max_new_tokens: Optional[int] = None, stream: bool = False) -> Optional[PendingRequest]:
+        """请求入队；队列已满时返回 None"""
+        self.metrics.counters['requests'] += 1
+        prompt = f"{instruction or self.instruction}\n问题：{question}\n回答："
+        max_new_tokens = min(max_new_tokens or self.max_new_tokens, self.max_new_tokens)
+        request = PendingRequest(prompt, max_new_tokens, stream, self.loop)
+        try:
+            self.queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.metrics.counters['rejected'] += 1
+            return None
+        self.metrics.peak_queue_depth = max(self.metrics.peak_queue_depth, self.queue.qsize())
+        return request
+
+    # ---------- HTTP ----------
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], body
+
+    @staticmethod
+    async def _send(writer, status: int, payload, content_type: str = 'application/json'):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error',
+                   503: 'Service Unavailable'}
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            parsed = await self._read_request(reader)
+            if parsed is None:
+                return
+            method, path, body = parsed
+
+            if method == 'GET' and path == '/health':
+                await self._send(writer, 200, {'status': 'ok', 'queue_depth': self.queue.qsize()})
+            elif method == 'GET' and path == '/metrics':
+                await self._send(writer, 200, self.metrics.snapshot(self.queue.qsize(), self.config()))
+            elif method == 'POST' and path == '/generate':
+                await self._handle_generate(writer, body)
+            else:
+                await self._send(writer, 404, {'error': f'未知接口 {method} {path}'})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            try:
+                await self._send(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _handle_generate(self, writer, body: bytes):
+        try:
+            payload = json.loads(body or b'{}')
+            question = payload['input']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            await self._send(writer, 400, {'error': '请求体需要是包含 "input" 字段的 JSON'})
+            return
+
+        if not isinstance(question, str):
+            await self._send(writer, 400, {'error': '"input" 需要是字符串'})
+            return
+        max_new_tokens = payload.get('max_new_tokens')
+        if max_new_tokens is not None and (
+            isinstance(max_new_tokens, bool) or not isinstance(max_new_tokens, int) or max_new_tokens < 1
+        ):
+            await self._send(writer, 400, {'error': '"max_new_tokens" 需要是正整数'})
+            return
+
+        stream = bool(payload.get('stream', False))
+        request = self.submit(question, payload.get('instruction'), max_new_tokens, stream)
+        if request is None:
+            await self._send(writer, 503, {'error': '队列已满', 'queue_depth': self.queue.qsize()})
+            return
+
+        if not stream:
+            response = await request.future
+            await self._send(writer, 200, {
+                'output': response,
+                'new_tokens': len(request.token_ids),
+                'latency': time.perf_counter() - request.enqueue_time,
+            })
+            return
+
+        # 流式：Server-Sent Events，连接关闭表示响应结束
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        while True:
+            delta = await request.chunks.get()
+            if delta is None:
+                break
+            writer.write(f"data: {json.dumps({'text': delta}, ensure_ascii=False)}\n\n".encode('utf-8'))
+            await writer.drain()
+
+        try:
+            response = await request.future
+            event = {
+                'done': True,
+                'output': response,
+                'new_tokens': len(request.token_ids),
+                'latency': time.perf_counter() - request.enqueue_time,
+            }
+        except Exception as e:
+            event = {'done': True, 'error': str(e)}
+        writer.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+        await writer.drain()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        batch_task = asyncio.create_task(self._batch_loop())
+        server = await asyncio.start_server(self._handle, host, port)
+
+        print(f"✓ 服务已启动: http://{host}:{port}")
+        print(f"   POST /generate | GET /health | GET /metrics")
+        print(
+            f"   批次上限 {self.max_batch_size} | 等待窗口 {self.max_wait * 1000:.0f}ms | "
+            f"队列上限 {self.max_queue} | 最大生成长度 {self.max_new_tokens}"
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,120 @@
+"""
+显著性检验模块 - 实验两两之间的配对 bootstrap 与置换检验（NumPy 向量化）
+
+所有实验、所有指标共用同一组重采样下标 / 符号翻转：bootstrap 均值是一次矩阵乘法
+（计数矩阵 @ 分数），置换检验统计量也是一次矩阵乘法（翻转矩阵 @ 配对差值），
+10k 次重采样 × 10k 条样本在数秒内完成。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.sequential import bootstrap_means, percentile_interval
+
+
+def sign_flip_pvalues(
+    differences: np.ndarray,
+    num_permutations: int,
+    rng: np.random.Generator,
+    max_elements: int = 4_000_000
+) -> np.ndarray:
+    """配对置换检验（随机翻转每个样本差值的符号），differences 为 [配对, 样本]，返回双侧 p 值"""
+    num_pairs, n = differences.shape
+    totals = differences.sum(axis=1)
+    observed = np.abs(totals)
+    exceed = np.zeros(num_pairs)
+    block = max(1, max_elements // max(1, n))
+    for start in range(0, num_permutations, block):
+        size = min(block, num_permutations - start)
+        flips = (rng.random((size, n)) < 0.5).astype(np.float64)
+        # 翻转部分样本后的差值总和 = 总和 - 2 × 被翻转样本的差值和
+        statistics = totals - 2 * (flips @ differences.T)
+        exceed += (np.abs(statistics) >= observed - 1e-12).sum(axis=0)
+    return (exceed + 1) / (num_permutations + 1)
+
+
+def bootstrap_intervals(
+    scores: np.ndarray,
+    num_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 42
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """scores 为 [行, 样本]，返回每行的均值及 bootstrap 置信区间 (mean, low, high)"""
+    means = bootstrap_means(scores, num_resamples, np.random.default_rng(seed))
+    low, high = percentile_interval(means, confidence)
+    return scores.mean(axis=1), low, high
+
+
+def pairwise_tests(
+    scores: np.ndarray,
+    num_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = 42,
+    pairs: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> Dict[str, np.ndarray]:
+    """scores 为 [指标, 实验, 样本]（样本已对齐），对每个指标的实验对做检验
+
+    pairs 为 (i 下标数组, j 下标数组)，默认所有 i < j 的实验对（只检验部分实验对时传入）。
+
+    返回的数组均为 [指标, 配对]：
+    - diff / ci_low / ci_high：均值差（i - j）及其 bootstrap 百分位置信区间
+    - bootstrap_p：以观测差值为中心的 bootstrap 双侧 p 值
+    - permutation_p：符号翻转置换检验双侧 p 值
+    另返回 pair_i / pair_j（实验下标）和每个实验均值的置信区间 mean / mean_low / mean_high（[指标, 实验]）。
+    """
+    rng = np.random.default_rng(seed)
+    num_metrics, num_experiments, n = scores.shape
+    pair_i, pair_j = pairs if pairs is not None else np.triu_indices(num_experiments, k=1)
+    pair_i, pair_j = np.asarray(pair_i, dtype=np.int64), np.asarray(pair_j, dtype=np.int64)
+
+    flat = scores.reshape(num_metrics * num_experiments, n)
+    means = bootstrap_means(flat, num_resamples, rng).reshape(num_resamples, num_metrics, num_experiments)
+    mean_low, mean_high = percentile_interval(means, confidence)
+
+    observed = scores.mean(axis=2)
+    diff = observed[:, pair_i] - observed[:, pair_j]
+    resampled = means[:, :, pair_i] - means[:, :, pair_j]
+    ci_low, ci_high = percentile_interval(resampled, confidence)
+    bootstrap_p = ((np.abs(resampled - diff) >= np.abs(diff) - 1e-12).sum(axis=0) + 1) / (num_resamples + 1)
+
+    differences = (scores[:, pair_i] - scores[:, pair_j]).reshape(-1, n)
+    permutation_p = sign_flip_pvalues(differences, num_resamples, rng).reshape(num_metrics, len(pair_i))
+
+    return {
+        'pair_i': pair_i,
+        'pair_j': pair_j,
+        'mean': observed,
+        'mean_low': mean_low,
+        'mean_high': mean_high,
+        'diff': diff,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'bootstrap_p': bootstrap_p,
+        'permutation_p': permutation_p,
+    }
+
+
+def holm_adjust(pvalues: np.ndarray) -> np.ndarray:
+    """Holm 逐步校正后的 p 值（与输入同形状）：同时检验多对实验、多个指标时控制总体第一类错误"""
+    p = np.asarray(pvalues, dtype=np.float64)
+    flat = p.ravel()
+    m = flat.size
+    if m == 0:
+        return p.copy()
+    order = np.argsort(flat, kind='stable')
+    adjusted = np.empty(m)
+    adjusted[order] = np.minimum(1.0, np.maximum.accumulate(flat[order] * (m - np.arange(m))))
+    return adjusted.reshape(p.shape)
+
+
+def align_samples(sample_ids: List[np.ndarray]) -> List[np.ndarray]:
+    """多个实验共同评估过的样本：返回每个实验中这些样本的位置（按样本 id 排序）"""
+    common = sample_ids[0]
+    for ids in sample_ids[1:]:
+        common = np.intersect1d(common, ids)
+    positions = []
+    for ids in sample_ids:
+        order = np.argsort(ids, kind='stable')
+        positions.append(order[np.searchsorted(ids, common, sorter=order)])
+    return positions
@@ -0,0 +1,177 @@
+"""
+投机解码（assisted generation）模块 - 用小草稿模型加速生成
+"""
+
+import copy
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import torch
+import torch.nn.functional as F
+from transformers import LogitsProcessor, LogitsProcessorList
+
+
+def build_layer_skip_draft(model, num_layers: int):
+    """用目标模型的前 num_layers 层构造草稿模型
+
+    与目标模型共享全部权重（包括已注入的 LoRA），不额外占用显存。
+    """
+    base = model.get_base_model() if hasattr(model, 'get_base_model') else model
+
+    decoder = base.get_decoder()
+    num_total = len(decoder.layers)
+    if not 0 < num_layers < num_total:
+        raise ValueError(f"draft_num_layers 需在 1 到 {num_total - 1} 之间，当前为 {num_layers}")
+
+    config = copy.deepcopy(base.config)
+    config.num_hidden_layers = num_layers
+    if getattr(config, 'layer_types', None) is not None:
+        config.layer_types = config.layer_types[:num_layers]
+
+    # 按裁剪后的配置构造同类模型（meta 设备上只建结构、不分配参数），再挂上目标模型的子模块
+    with torch.device('meta'):
+        draft = type(base)(config)
+
+    draft_decoder = draft.get_decoder()
+    for name, module in decoder.named_children():
+        if name == 'layers':
+            module = torch.nn.ModuleList(decoder.layers[:num_layers])
+        setattr(draft_decoder, name, module)
+    draft.set_output_embeddings(base.get_output_embeddings())
+
+    leftover = [name for name, tensor in draft.state_dict().items() if tensor.is_meta]
+    if leftover:
+        raise ValueError(f"草稿模型有未与目标模型共享的参数（模型结构不支持截取前 N 层）: {leftover[:5]}")
+
+    draft.generation_config = copy.deepcopy(base.generation_config)
+    draft.eval()
+    return draft
+
+
+class MinNewTokensProcessor(LogitsProcessor):
+    """生成长度未达下限前屏蔽 EOS
+
+    transformers 的 assisted generation 会拒绝内置的 MinLength 处理器，这里用等价的自定义处理器代替。
+    """
+
+    def __init__(self, prompt_length: int, min_new_tokens: int, eos_token_id):
+        self.min_length = prompt_length + min_new_tokens
+        self.eos_token_ids = eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]
+
+    def __call__(self, input_ids, scores):
+        if input_ids.shape[-1] < self.min_length:
+            scores[:, self.eos_token_ids] = -float('inf')
+        return scores
+
+
+class SpeculativeStats:
+    """投机解码统计
+
+    transformers 的 assisted generation 不直接暴露接受率，这里通过前向钩子计数：
+    每轮草稿模型前向一次产生一个候选 token，目标模型前向一次完成校验并额外产出 1 个 token，
+    因此 被接受的草稿 token ≈ 新 token 数 − 目标模型前向次数。
+    """
+
+    def __init__(self):
+        self.new_tokens = 0
+        self.target_calls = 0
+        self.draft_calls = 0
+        self.elapsed = 0.0
+
+    @contextmanager
+    def track(self, model, draft_model):
+        target = model.get_base_model() if hasattr(model, 'get_base_model') else model
+        counts = {'target': 0, 'draft': 0}
+
+        def make_hook(key):
+            def hook(module, args, output):
+                counts[key] += 1
+            return hook
+
+        handles = [
+            target.register_forward_hook(make_hook('target')),
+            draft_model.register_forward_hook(make_hook('draft')),
+        ]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - start
+            for handle in handles:
+                handle.remove()
+            self.target_calls += counts['target']
+            self.draft_calls += counts['draft']
+
+    @property
+    def acceptance_rate(self) -> float:
+        if self.draft_calls == 0:
+            return 0.0
+        return max(0, self.new_tokens - self.target_calls) / self.draft_calls
+
+    @property
+    def tokens_per_target_step(self) -> float:
+        return self.new_tokens / self.target_calls if self.target_calls else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.new_tokens / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'new_tokens': self.new_tokens,
+            'target_calls': self.target_calls,
+            'draft_calls': self.draft_calls,
+            'acceptance_rate': self.acceptance_rate,
+            'tokens_per_target_step': self.tokens_per_target_step,
+            'tokens_per_second': self.tokens_per_second,
+        }
+
+    def print_summary(self):
+        print(
+            f"投机解码: 草稿接受率 {self.acceptance_rate:.1%} | "
+            f"每次目标前向产出 {self.tokens_per_target_step:.2f} token | "
+            f"{self.tokens_per_second:.1f} token/s"
+        )
+
+
+def assisted_generate(model, draft_model, inputs, stats: SpeculativeStats, pad_token_id: int, **generate_kwargs):
+    """逐条执行 assisted generation（transformers 仅支持 batch=1），再拼回左填充批次
+
+    返回与普通批量 generate 相同布局的 token id：前 input_length 列为左填充的提示。
+    """
+    input_ids = inputs['input_ids']
+    attention_mask = inputs['attention_mask']
+    input_length = input_ids.shape[1]
+    adapter_names = inputs.get('adapter_names')
+    # assisted generation 不支持 min_new_tokens，改用自定义处理器屏蔽过早的 EOS
+    min_new_tokens = generate_kwargs.pop('min_new_tokens', 0)
+    eos_token_id = generate_kwargs.get('eos_token_id')
+
+    rows: List[torch.Tensor] = []
+    for i in range(input_ids.shape[0]):
+        # 去掉左填充，单条生成
+        row_ids = input_ids[i][attention_mask[i].bool()].unsqueeze(0)
+        pad_len = input_length - row_ids.shape[1]
+
+        row_kwargs = {'adapter_names': [adapter_names[i]]} if adapter_names is not None else {}
+        logits_processor = LogitsProcessorList()
+        if min_new_tokens and eos_token_id is not None:
+            logits_processor.append(MinNewTokensProcessor(row_ids.shape[1], min_new_tokens, eos_token_id))
+
+        with stats.track(model, draft_model), torch.no_grad():
+            output = model.generate(
+                input_ids=row_ids,
+                attention_mask=torch.ones_like(row_ids),
+                assistant_model=draft_model,
+                pad_token_id=pad_token_id,
+                logits_processor=logits_processor,
+                **row_kwargs,
+                **generate_kwargs
+            )
+        stats.new_tokens += output.shape[1] - row_ids.shape[1]
+
+        rows.append(F.pad(output[0], (pad_len, 0), value=pad_token_id))
+
+    max_len = max(row.shape[0] for row in rows)
+    return torch.stack([F.pad(row, (0, max_len - row.shape[0]), value=pad_token_id) for row in rows])
@@ -2,18 +2,36 @@ import json
 from vllm import EngineArgs, LLMEngine, RequestOutput, SamplingParams
 from vllm.lora.request import LoRARequest
 
+from src.journal import PredictionJournal
+
 def inference_by_vllm(
     model_path: str,
     dataset_path: str,
     output_path: str,
     lora_path: str = None,
+    journal_path: str = None,
 ):
-    """Use vLLM for efficient batched inference with optional LoRA adapters. Write results to output file."""
+    """Use vLLM for efficient batched inference with optional LoRA adapters. Write results to output file.
+
+    If journal_path is given, every finished request is appended to a JSONL journal and
+    requests already present in it are skipped, so an interrupted run can be resumed.
+    """
     dataset = json.load(open(dataset_path, "r", encoding="utf-8"))
     prompts = [f"{item['instruction']}\n问题：{item['input']}\n回答：" for item in dataset]
     
     # generate responses
-    write_data = {}
+    write_data = {str(i): {"input": prompt} for i, prompt in enumerate(prompts)}
+
+    journal = PredictionJournal(journal_path) if journal_path else None
+    pending_ids = []
+    for i, item in enumerate(dataset):
+        output = journal.get_output(i, item["input"]) if journal else None
+        if output is None:
+            pending_ids.append(i)
+        else:
+            write_data[str(i)]["output"] = output
+    if journal and len(pending_ids) < len(prompts):
+        print(f"resumed {len(prompts) - len(pending_ids)}/{len(prompts)} requests from {journal_path}")
 
     engine_args = EngineArgs(
         model=model_path,
@@ -37,29 +55,40 @@ def inference_by_vllm(
     if lora_path is not None:
         lora_request = LoRARequest("lora", 1, lora_path)
     
-    request_id = 0
-    while request_id < len(prompts) or engine.has_unfinished_requests():
-        if request_id < len(prompts):
-            prompt = prompts[request_id]
-            engine.add_request(
-                str(request_id), prompt, sampling_params, lora_request=lora_request
-            )
-            write_data[str(request_id)] = {"input": prompt}
-            request_id += 1
-        
-        request_outputs: list[RequestOutput] = engine.step()
+    cursor = 0
+    try:
+        while cursor < len(pending_ids) or engine.has_unfinished_requests():
+            if cursor < len(pending_ids):
+                request_id = pending_ids[cursor]
+                engine.add_request(
+                    str(request_id), prompts[request_id], sampling_params, lora_request=lora_request
+                )
+                cursor += 1
+            
+            request_outputs: list[RequestOutput] = engine.step()
+
+            finished = []
+            for request_output in request_outputs:
+                if request_output.finished:
+                    if int(request_output.request_id) % 100 == 0:
+                        print(f"req id {request_output.request_id} done")
+                    
+                    # 获取生成的文本并处理空答案
+                    response = request_output.outputs[0].text.strip()
+                    if not response:
+                        response = "无法生成回答"
+                    
+                    write_data[request_output.request_id]["output"] = response
+                    finished.append(request_output.request_id)
 
-        for request_output in request_outputs:
-            if request_output.finished:
-                if int(request_output.request_id) % 100 == 0:
-                    print(f"req id {request_output.request_id} done")
-                
-                # 获取生成的文本并处理空答案
-                response = request_output.outputs[0].text.strip()
-                if not response:
-                    response = "无法生成回答"
-                
-                write_data[request_output.request_id]["output"] = response
+            if journal and finished:
+                journal.append(
+                    {"id": rid, "input": dataset[int(rid)]["input"], "output": write_data[rid]["output"]}
+                    for rid in finished
+                )
+    finally:
+        if journal:
+            journal.close()
             
 
     # write to output file